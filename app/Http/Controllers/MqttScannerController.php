@@ -7,6 +7,7 @@
 use Illuminate\Support\Facades\Log;
 use App\Models\MqttScanHistory;
 use App\Models\MqttScanResult;
+use App\Services\FlaskScanJobClient;
 use Illuminate\Support\Facades\DB;
 
 class MqttScannerController extends Controller
@@ -81,28 +82,18 @@ public function scan(Request $request)
                 'timestamp' => now()
             ]);
 
-            // Add 30 second timeout for scan operations
-            $response = Http::timeout(30)->withHeaders([
-                'X-API-KEY' => $apiKey,
-            ])->post($flaskBase . '/api/scan', [
-                        'target' => $target,
-                        'creds' => $creds,
-                    ]);
-
-            // Parse response and store results in database
-            if ($response->successful()) {
-                $data = $response->json();
-                if (isset($data['results']) && is_array($data['results'])) {
-                    $this->storeResults($scanHistory, $data['results']);
-                    $scanHistory->markCompleted();
-                    $scanHistory->updateStatistics();
-                }
-            } else {
-                $scanHistory->markFailed('Scan request failed with status: ' . $response->status());
-            }
+            // Queue the scan and poll the Flask job until it finishes; no single request waits for the whole scan
+            $data = (new FlaskScanJobClient($flaskBase, $apiKey))->run([
+                'target' => $target,
+                'creds' => $creds,
+            ]);
 
-            return response($response->body(), $response->status())
-                ->header('Content-Type', $response->header('Content-Type', 'application/json'));
+            // Store results in database
+            $this->storeResults($scanHistory, $data['results']);
+            $scanHistory->markCompleted();
+            $scanHistory->updateStatistics();
+
+            return response()->json($data);
         } catch (\Exception $e) {
             $scanHistory->markFailed($e->getMessage());
 
@@ -113,7 +104,8 @@ public function scan(Request $request)
                 'error' => $e->getMessage(),
                 'ip_address' => $request->ip()
             ]);
-            return response()->json(['error' => 'Failed to reach scanner: ' . $e->getMessage()], 500);
+            $status = $e->getCode() >= 400 ? $e->getCode() : 500;
+            return response()->json(['error' => 'Failed to reach scanner: ' . $e->getMessage()], $status);
         }
     }
 
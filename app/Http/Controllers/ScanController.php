@@ -5,6 +5,7 @@
 use Illuminate\Http\Request;
 use Illuminate\Support\Facades\Http;
 use Illuminate\Support\Facades\Log;
+use App\Services\FlaskScanJobClient;
 use App\Services\MqttSensorService;
 
 class ScanController extends Controller
@@ -246,34 +247,24 @@ private function getBrokerInfoFromFlask($host, $port, $useTls, $creds)
                 'has_creds' => !empty($creds)
             ]);
 
-            $response = Http::withHeaders([
-                'X-API-Key' => $this->apiKey
-            ])->timeout(30)->post($this->scannerApiUrl . '/api/scan', [
-                        'target' => "{$host}:{$port}",
-                        'listen_duration' => 3,
-                        'capture_all_topics' => false, // Only get $SYS topics
-                        'creds' => $creds
-                    ]);
-
-            if ($response->successful()) {
-                $data = $response->json();
-                $results = $data['results'] ?? [];
-
-                if (!empty($results)) {
-                    $firstResult = $results[0];
-                    $brokerInfo = [
-                        'sys_topic_count' => $firstResult['sys_topic_count'] ?? 0,
-                        'regular_topic_count' => $firstResult['regular_topic_count'] ?? 0,
-                        'retained_count' => $firstResult['retained_count'] ?? 0
-                    ];
-                    Log::info('Flask broker info retrieved', $brokerInfo);
-                    return $brokerInfo;
-                }
-            } else {
-                Log::warning('Flask API returned non-successful status', [
-                    'status' => $response->status(),
-                    'body' => $response->body()
-                ]);
+            // Poll the Flask job instead of holding one request open for the whole scan
+            $data = (new FlaskScanJobClient($this->scannerApiUrl, $this->apiKey))->run([
+                'target' => "{$host}:{$port}",
+                'listen_duration' => 3,
+                'capture_all_topics' => false, // Only get $SYS topics
+                'creds' => $creds,
+            ], 60);
+            $results = $data['results'];
+
+            if (!empty($results)) {
+                $firstResult = $results[0];
+                $brokerInfo = [
+                    'sys_topic_count' => $firstResult['sys_topic_count'] ?? 0,
+                    'regular_topic_count' => $firstResult['regular_topic_count'] ?? 0,
+                    'retained_count' => $firstResult['retained_count'] ?? 0
+                ];
+                Log::info('Flask broker info retrieved', $brokerInfo);
+                return $brokerInfo;
             }
 
             return [
@@ -6,6 +6,7 @@
 use Illuminate\Http\Request;
 use Illuminate\Support\Facades\DB;
 use Illuminate\Support\Facades\Http;
+use App\Services\FlaskScanJobClient;
 
 class SensorDataController extends Controller
 {
@@ -328,24 +329,22 @@ public function securityAnalysis()
             $flaskBase = env('FLASK_BASE', 'http://127.0.0.1:5000');
             $apiKey = env('FLASK_API_KEY', 'my-very-secret-flask-key-CHANGEME');
 
-            $response = Http::timeout(30)->withHeaders([
-                'X-API-KEY' => $apiKey,
-            ])->post($flaskBase . '/api/scan', [
-                        'target' => '127.0.0.1',
-                        'listen_duration' => 3,
-                        'capture_all_topics' => false, // Only $SYS topics
-                    ]);
-
-            if (!$response->successful()) {
+            try {
+                // Poll the Flask job instead of holding one request open for the whole scan
+                $data = (new FlaskScanJobClient($flaskBase, $apiKey))->run([
+                    'target' => '127.0.0.1',
+                    'listen_duration' => 3,
+                    'capture_all_topics' => false, // Only $SYS topics
+                ], 60);
+            } catch (\Exception $e) {
                 return response()->json([
                     'status' => 'error',
-                    'message' => 'Flask scanner backend not available',
+                    'message' => 'Flask scanner backend not available: ' . $e->getMessage(),
                     'help' => true
                 ], 500);
             }
 
-            $data = $response->json();
-            $results = $data['results'] ?? [];
+            $results = $data['results'];
 
             // Format results for security modal
             $secureBroker = null;
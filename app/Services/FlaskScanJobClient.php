@@ -0,0 +1,143 @@
+<?php
+
+namespace App\Services;
+
+use Illuminate\Support\Facades\Http;
+use Illuminate\Support\Facades\Log;
+
+/**
+ * Flask Scan Job Client
+ *
+ * Runs a scan through the Flask scanner's job API:
+ * - POST /api/scan queues the job and answers 202 with its job_id
+ * - GET /api/scan/{job_id}/status is polled until the job completes or fails
+ * - GET /api/scan/{job_id}/results is read page by page
+ *
+ * Every request is short, so a scan may take longer than any single HTTP timeout.
+ */
+class FlaskScanJobClient
+{
+    /**
+     * Seconds between status polls
+     */
+    private const POLL_INTERVAL = 0.5;
+
+    /**
+     * Results fetched per page (the scanner's maximum)
+     */
+    private const RESULTS_PER_PAGE = 5000;
+
+    private $flaskBase;
+    private $apiKey;
+
+    public function __construct($flaskBase = null, $apiKey = null)
+    {
+        $this->flaskBase = rtrim($flaskBase ?? env('FLASK_BASE', 'http://127.0.0.1:5000'), '/');
+        $this->apiKey = $apiKey ?? env('FLASK_API_KEY', 'my-very-secret-flask-key-CHANGEME');
+    }
+
+    /**
+     * Queue a scan and wait for its results
+     *
+     * @param array $payload Body for POST /api/scan (target, creds, listen_duration, ...)
+     * @param int $maxWaitSeconds How long to wait for the job before giving up
+     * @return array ['status' => 'ok', 'job_id' => string, 'results' => array]
+     * @throws \Exception When the scan cannot be queued, fails or does not finish in time
+     */
+    public function run(array $payload, $maxWaitSeconds = 300)
+    {
+        $jobId = $this->start($payload);
+        $this->waitForJob($jobId, $maxWaitSeconds);
+
+        return [
+            'status' => 'ok',
+            'job_id' => $jobId,
+            'results' => $this->results($jobId),
+        ];
+    }
+
+    /**
+     * Queue a scan; returns its job_id
+     */
+    public function start(array $payload)
+    {
+        $response = $this->request(15)->post($this->flaskBase . '/api/scan', $payload);
+
+        if (!$response->successful()) {
+            // Keep the scanner's status (429 rate limited, 503 busy, 400 bad target) as the code
+            throw new \Exception('Failed to start scan: ' . $response->body(), $response->status());
+        }
+
+        $jobId = $response->json('job_id');
+        if (!$jobId) {
+            throw new \Exception('No job_id returned from Flask scanner');
+        }
+
+        Log::info('Flask scan job queued', ['job_id' => $jobId, 'target' => $payload['target'] ?? null]);
+        return $jobId;
+    }
+
+    /**
+     * Poll the job status until it completes; returns the final status
+     */
+    public function waitForJob($jobId, $maxWaitSeconds = 300)
+    {
+        $deadline = microtime(true) + $maxWaitSeconds;
+
+        while (true) {
+            $response = $this->request(10)->get($this->flaskBase . "/api/scan/{$jobId}/status");
+
+            if ($response->successful()) {
+                $status = $response->json();
+
+                if (($status['status'] ?? null) === 'completed') {
+                    return $status;
+                }
+                if (($status['status'] ?? null) === 'failed') {
+                    throw new \Exception('Scan job failed: ' . ($status['error'] ?? 'Unknown error'));
+                }
+            } elseif ($response->status() === 404) {
+                throw new \Exception("Unknown scan job: {$jobId}");
+            }
+
+            if (microtime(true) >= $deadline) {
+                throw new \Exception("Scan job {$jobId} did not complete within {$maxWaitSeconds}s");
+            }
+            usleep((int) (self::POLL_INTERVAL * 1000000));
+        }
+    }
+
+    /**
+     * All results of a job, across pages
+     */
+    public function results($jobId)
+    {
+        $results = [];
+        $page = 1;
+
+        do {
+            $response = $this->request(30)->get($this->flaskBase . "/api/scan/{$jobId}/results", [
+                'page' => $page,
+                'per_page' => self::RESULTS_PER_PAGE,
+            ]);
+
+            if (!$response->successful()) {
+                throw new \Exception('Failed to fetch scan results (HTTP ' . $response->status() . '): ' . $response->body());
+            }
+
+            $data = $response->json();
+            $results = array_merge($results, $data['results'] ?? []);
+            $pages = $data['pages'] ?? 1;
+            $page++;
+        } while ($page <= $pages);
+
+        return $results;
+    }
+
+    private function request($timeout)
+    {
+        return Http::timeout($timeout)->withHeaders([
+            'X-API-KEY' => $this->apiKey,
+        ]);
+    }
+}
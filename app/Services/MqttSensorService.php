@@ -138,7 +138,14 @@ public function captureLatestSensorData($scanSecure = true, $scanInsecure = true
      */
     protected function subscribeToTopics($host, $port, $useTls = false)
     {
-        // Try Python quick subscriber first (faster and more reliable)
+        // Latest values from the Flask broker monitor: served from memory, no new broker session
+        try {
+            return $this->subscribeViaMonitor($host, $port, $useTls);
+        } catch (\Exception $e) {
+            Log::warning("Flask monitor unavailable, falling back to Python helper: " . $e->getMessage());
+        }
+
+        // Then the Python quick subscriber (spawns a process and connects per read)
         try {
             return $this->subscribeViaPythonHelper($host, $port, $useTls);
         } catch (\Exception $e) {
@@ -148,6 +155,71 @@ protected function subscribeToTopics($host, $port, $useTls = false)
         }
     }
 
+    /**
+     * Read the latest sensors/# values from the Flask broker monitor.
+     * The first call registers the broker (and waits for its retained messages);
+     * later calls are in-memory lookups.
+     */
+    protected function subscribeViaMonitor($host, $port, $useTls = false)
+    {
+        $flaskBase = env('FLASK_BASE', 'http://127.0.0.1:5000');
+        $apiKey = env('FLASK_API_KEY', 'my-very-secret-flask-key-CHANGEME');
+
+        $broker = [
+            'host' => $host,
+            'port' => (int) $port,
+            'tls' => (bool) $useTls,
+            'wait' => 3,
+        ];
+        if ($useTls && $this->username && $this->password) {
+            $broker['username'] = $this->username;
+            $broker['password'] = $this->password;
+        }
+
+        $statusResponse = Http::timeout(10)->withHeaders([
+            'X-API-KEY' => $apiKey,
+        ])->post($flaskBase . '/api/monitor/brokers', $broker);
+
+        if (!$statusResponse->successful()) {
+            throw new \Exception('Monitor rejected broker: ' . $statusResponse->body());
+        }
+
+        $status = $statusResponse->json();
+        if (($status['state'] ?? null) !== 'connected') {
+            throw new \Exception('Monitor not connected to broker: ' . ($status['error'] ?? 'unknown'));
+        }
+
+        $latestResponse = Http::timeout(5)->withHeaders([
+            'X-API-KEY' => $apiKey,
+        ])->get($flaskBase . '/api/monitor/latest', [
+            'broker' => $status['broker'],
+            'topic' => 'sensors/#',
+        ]);
+
+        if (!$latestResponse->successful()) {
+            throw new \Exception('Monitor query failed: ' . $latestResponse->body());
+        }
+
+        $capturedData = [];
+        foreach ($latestResponse->json() as $value) {
+            $raw = $value['payload'] ?? null;
+            $message = $raw !== null ? json_decode($raw, true) : null;
+            if ($message === null) {
+                continue; // Sensor payloads are JSON; skip anything else, like quick_sub.py does
+            }
+            $capturedData[] = [
+                'topic' => $value['topic'],
+                'message' => $message,
+                'raw' => $raw,
+                'timestamp' => $value['timestamp'],
+            ];
+        }
+
+        Log::info("Flask monitor returned " . count($capturedData) . " sensor values from {$host}:{$port}");
+
+        return $capturedData;
+    }
+
     /**
      * Subscribe using Python helper script (fast, non-blocking)
      */
@@ -1,13 +1,24 @@
 # app.py — prettier Flask UI + auth + TLS info + $SYS probe + Topic Capture
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, session, stream_with_context
 from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect
-from scanner import run_scan # Assumes scanner.py is in the same directory or accessible via PYTHONPATH
-import csv, os, ssl, socket, time, json # Added json
+from scanner import run_scan, expand_targets, parse_ports, try_mqtt_connect, analyze_tls_certificate, build_outcome, COMMON_PORTS, LISTEN_MODE, LISTEN_MODE_FIXED, LISTEN_MODE_ADAPTIVE # Assumes scanner.py is in the same directory or accessible via PYTHONPATH
+from jobs import ScanJobManager, JobQueueFull, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING
+from result_store import ResultStore
+from incremental import PreviousResults, cert_fingerprint
+from scan_diff import diff_scans
+from monitor import BrokerMonitor, RotatingMessageLog, parse_broker
+from tls_analysis import cert_info_from_analysis, cert_cache
+from tls_context import tls_contexts
+from metrics import scan_metrics, STAGE_ENRICH, STAGE_PERSIST
+from pipeline import ResultPipeline, Stage, ENRICH_WORKERS, PERSIST_WORKERS
+from detect import PROTO_TLS, port_hint
+from pacing import ConnectionPacer
+import os, time, json # Added json
+import threading
 from functools import wraps
-from paho.mqtt import client as mqtt_client
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
 
 app = Flask(__name__, template_folder='templates')
@@ -78,8 +89,8 @@ def require_auth(f):
         return jsonify(error="Authentication required. Provide valid API key or login."), 401
     return decorated_function
 
-# --- CSV Path ---
-CSV_PATH = os.path.join(os.path.dirname(__file__), 'mqtt_scan_report.csv')
+# --- Result Store (SQLite, see result_store.py; path from SCAN_RESULTS_DB) ---
+result_store = ResultStore()
 
 # --- Simple User Authentication (Session-based) ---
 # WARNING: Store credentials securely in production (e.g., hashed in DB, env vars)
@@ -127,217 +138,263 @@ def home():
 
 # --- Helper: Get TLS Certificate Info ---
 def get_cert_info(host, port, timeout=3):
-    """Fetches and parses the server's TLS certificate into human-readable fields."""
-    context = ssl.create_default_context()
-    context.check_hostname = False
-    context.verify_mode = ssl.CERT_NONE # Accept self-signed for scanning purposes
-
-    cert_info = {
-        'subject': None,
-        'issuer': None,
-        'valid_from': None,
-        'valid_to': None,
-        'serial_number': None,
-        'version': None,
-        'pem_snippet': None,
-        'error': None
-    }
-
-    try:
-        with socket.create_connection((host, port), timeout=timeout) as sock:
-            with context.wrap_socket(sock, server_hostname=host) as ssock:
-                # Get certificate in both formats
-                cert_dict = ssock.getpeercert()  # Human-readable dict
-                der_cert = ssock.getpeercert(binary_form=True)  # Binary for PEM conversion
-
-                if cert_dict:
-                    # Extract human-readable fields
-                    cert_info['subject'] = dict(x[0] for x in cert_dict.get('subject', []))
-                    cert_info['issuer'] = dict(x[0] for x in cert_dict.get('issuer', []))
-                    cert_info['valid_from'] = cert_dict.get('notBefore')
-                    cert_info['valid_to'] = cert_dict.get('notAfter')
-                    cert_info['serial_number'] = cert_dict.get('serialNumber')
-                    cert_info['version'] = cert_dict.get('version')
-
-                if der_cert:
-                    pem_cert = ssl.DER_cert_to_PEM_cert(der_cert)
-                    # Store truncated PEM for reference (first 500 chars)
-                    cert_info['pem_snippet'] = pem_cert[:500].strip()
-
-    except ssl.SSLError as e:
-        cert_info['error'] = f'SSL error: {str(e)}'
-    except socket.timeout:
-        cert_info['error'] = 'Timeout getting certificate'
-    except ConnectionRefusedError:
-        cert_info['error'] = 'Connection refused'
-    except Exception as e:
-        cert_info['error'] = f'Error: {str(e)}'
-
-    return cert_info
+    """
+    Fetches and parses the server's TLS certificate into human-readable fields.
+    Standalone helper; scans get cert_info from their probe's own handshake.
+    """
+    return cert_info_from_analysis(analyze_tls_certificate(host, port, timeout=timeout))
 
 # --- Helper: Probe Broker Topics (Enhanced) ---
-def probe_broker_topics(host, port, creds=None, use_tls=False, listen_secs=3, capture_all=True):
+def probe_broker_topics(host, port, creds=None, use_tls=None, listen_secs=3, capture_all=True):
     """
     Connects and subscribes to capture broker info and active topics.
+    Standalone helper; scans get broker_info from the same probe session.
 
     Args:
-        capture_all: If True, subscribes to # (all topics) to detect publishers.
-                     If False, only subscribes to $SYS/# for broker info.
+        capture_all: If True, summarises all topics to detect publishers.
+                     If False, only $SYS topics are summarised for broker info.
     """
-    info = {
+    creds = creds or {}
+    res = try_mqtt_connect(host, port, use_tls=use_tls, username=creds.get('user'),
+                           password=creds.get('pass'), listen_secs=listen_secs, capture_all=capture_all)
+    if 'broker_info' in res:
+        return res['broker_info']
+    return {
         'sys_topics': {},
         'regular_topics': {},
         'retained_topics': [],
-        'error': None,
+        'error': f"Connection failed ({res.get('result')})",
         'sys_count': 0,
         'regular_count': 0,
         'client_list': []
     }
-    client = None
-    msgs = [] # Collect messages here
-
-    def on_connect(c, userdata, flags, rc, properties=None):
-        if rc == 0:
-            try:
-                # Subscribe based on mode
-                if capture_all:
-                    c.subscribe("#", qos=0)  # All topics
-                    app.logger.debug(f"Subscribed to # (all topics) on {host}:{port}")
-                else:
-                    c.subscribe("$SYS/#", qos=0)  # Only system topics
-                    app.logger.debug(f"Subscribed to $SYS/# on {host}:{port}")
-            except Exception as sub_e:
-                info['error'] = f"Subscription error: {sub_e}"
-                app.logger.error(f"Failed to subscribe on {host}:{port}: {sub_e}")
-        else:
-            info['error'] = f"Connection failed (rc={rc})"
-            app.logger.warning(f"Failed to connect to {host}:{port} for topic probe (rc={rc})")
 
-    def on_message(c, userdata, msg):
-        try:
-            topic = msg.topic
-            # Decode payload safely, handle potential non-UTF8 data
-            payload = msg.payload.decode('utf-8', errors='replace')
-            is_retained = msg.retain
-            msgs.append((topic, payload, is_retained))
+# --- Scan pipeline helpers ---
+def enrich_result(r):
+    """
+    Normalises one probe result for the API/result store, or returns None if it
+    cannot be stored. Certificate info and broker info are already captured by
+    the probe's single session, so no extra connections are made here.
+    """
+    # Keep a record of ports closed at TCP level, as they are
+    if r.get('classification') == 'closed_or_unreachable':
+        return r
+
+    r2 = r.copy() # Work with a copy
+    host = r2.get('ip')
+    port = r2.get('port')
 
-            if topic.startswith('$SYS/'):
-                info['sys_count'] += 1
-            else:
-                info['regular_count'] += 1
+    if not host or not port:
+        app.logger.warning(f"Skipping result with missing host/port: {r}")
+        return None
 
-        except Exception as msg_e:
-            app.logger.error(f"Error processing message from {host}:{port} on topic {msg.topic}: {msg_e}")
+    try: port = int(port) # Ensure port is integer
+    except ValueError:
+        app.logger.warning(f"Skipping result with invalid port: {r}")
+        return None
 
+    r2.setdefault('tls', port_hint(port) == PROTO_TLS) # Probes record what was detected; fall back to the port hint
+    r2.setdefault('cert_info', {'error': 'Not a TLS port'})
+
+    # Ensure 'publishers' key exists, even if empty
+    if 'publishers' not in r2:
+        r2['publishers'] = []
+    return r2
+
+def result_row(row):
+    """
+    The flat row stored per result and returned by /api/results (the old CSV report
+    columns), plus what incremental rescans carry forward from it (see result_from_row).
+    """
+    cert_info = row.get('cert_info') or {}
+    broker_info = row.get('broker_info') or {}
+    cert_details = (row.get('tls_analysis') or {}).get('cert_details') or {}
+    return {
+        'ip': row.get('ip'),
+        'port': row.get('port'),
+        'result': row.get('result'),
+        'classification': row.get('classification'),
+        'risk_level': (row.get('security_summary') or {}).get('risk_level'),
+        'tls': bool(row.get('tls')),
+        'cert_subject': cert_info.get('subject') or cert_info.get('error', ''),
+        'cert_issuer': cert_info.get('issuer') or '',
+        'cert_valid_from': cert_info.get('valid_from', ''),
+        'cert_valid_to': cert_info.get('valid_to', ''),
+        'broker_error': broker_info.get('error', ''),
+        'sys_topic_count': broker_info.get('sys_count', 0),
+        'regular_topic_count': broker_info.get('regular_count', 0),
+        'retained_count': broker_info.get('retained_count', len(broker_info.get('retained_topics', []))),
+        'publishers': row.get('publishers', []),
+        'cert_fingerprint': cert_fingerprint(row),
+        'cert_expired': bool(cert_details.get('expired', row.get('cert_expired'))),
+        'anonymous_allowed': bool((row.get('security_assessment') or {}).get('anonymous_allowed')),
+        'incremental': (row.get('incremental') or {}).get('status'),
+        'timestamp': row.get('timestamp'),
+        'outcome': row.get('outcome'),
+        'protocol': row.get('protocol'),
+        'subscribers': row.get('subscribers', []),
+        'topics_discovered': row.get('topics_discovered', {}),
+        'tls_analysis': row.get('tls_analysis'),
+    }
+
+def result_from_row(row):
+    """
+    Rebuild a probe result from a stored row, as much as incremental rescans
+    need to compare against it and carry it forward (result_row() of the
+    rebuilt result gives back the same row).
+    """
+    if row is None:
+        return None
+    cert_info = {'error': row.get('cert_subject')}
+    if row.get('cert_valid_from') or row.get('cert_issuer'):
+        cert_info = {
+            'subject': row.get('cert_subject'),
+            'issuer': row.get('cert_issuer'),
+            'valid_from': row.get('cert_valid_from'),
+            'valid_to': row.get('cert_valid_to'),
+        }
+    result = {
+        'scan_id': row.get('scan_id'),
+        'ip': row.get('ip'),
+        'port': row.get('port'),
+        'result': row.get('result'),
+        'classification': row.get('classification'),
+        'security_summary': {'risk_level': row.get('risk_level')},
+        'tls': bool(row.get('tls')),
+        'cert_info': cert_info,
+        'cert_fingerprint': row.get('cert_fingerprint'),
+        'cert_expired': row.get('cert_expired', False),
+        'security_assessment': {'anonymous_allowed': row.get('anonymous_allowed', False)},
+        'broker_info': {
+            'error': row.get('broker_error'),
+            'sys_count': row.get('sys_topic_count', 0),
+            'regular_count': row.get('regular_topic_count', 0),
+            'retained_count': row.get('retained_count', 0),
+        },
+        'publishers': row.get('publishers', []),
+        'subscribers': row.get('subscribers', []),
+        'topics_discovered': row.get('topics_discovered', {}),
+        'protocol': row.get('protocol'),
+        'tls_analysis': row.get('tls_analysis'),
+        'timestamp': row.get('timestamp'),
+    }
+    # Rows stored before the outcome was kept get it rebuilt from what is there
+    result['outcome'] = row.get('outcome') or build_outcome(result)
+    return result
+
+def flatten_broker_info(enriched_results):
+    """Flatten broker_info fields to top level for easier access"""
+    for r in enriched_results:
+        broker_info = r.get('broker_info', {})
+        if broker_info:
+            r['sys_topic_count'] = broker_info.get('sys_count', 0)
+            r['regular_topic_count'] = broker_info.get('regular_count', 0)
+            r['retained_count'] = len(broker_info.get('retained_topics', []))
+            r['broker_error'] = broker_info.get('error')
+
+def run_scan_job(job):
+    """
+    ScanJobManager runner. Sweep and probe run on run_scan's event loop; each
+    finished probe is handed to the enrich and persist stages (pipeline.py)
+    and recorded on `job` once stored, so post-processing overlaps the probes
+    still running instead of following the whole scan.
+    """
+    params = job.params
+    start_time = time.time()
+
+    targets = params['targets']  # Parsed in api_scan; iterated lazily by run_scan
+    job.set_total(len(targets), len(params['ports']))
+    job.set_phase('scanning')
+    writer = result_store.writer(job.id, job.target)
+    previous = None
+    if params.get('incremental'):
+        # Compare every target against its latest stored result from any earlier scan. run_scan asks
+        # for them a window of pairs at a time as it hands targets out, so only that window is loaded.
+        def previous_rows(pairs):
+            ips = list(dict.fromkeys(ip for ip, _ in pairs))
+            ports = sorted({port for _, port in pairs})
+            rows = result_store.latest_results(ips, ports)
+            return {key: result_from_row(row) for key, row in rows.items()}
+
+        previous = PreviousResults(lookup_many=previous_rows, max_age=params.get('max_age'))
+
+    def enrich(res):
+        row = enrich_result(res)
+        if row is not None:
+            flatten_broker_info([row])
+        return row
+
+    def persist(row):
+        # Appended in batches; the writer is shared by all persist workers
+        writer.add(result_row(row))
+        return row
+
+    # Request limits where given, the SCAN_*CONNECT_* defaults otherwise
+    pacer = ConnectionPacer(rate=params.get('connect_rate'), burst=params.get('connect_burst'),
+                            subnet_rate=params.get('subnet_connect_rate'),
+                            subnet_burst=params.get('subnet_connect_burst'))
+    pipeline = ResultPipeline([Stage(STAGE_ENRICH, enrich, ENRICH_WORKERS),
+                               Stage(STAGE_PERSIST, persist, PERSIST_WORKERS)],
+                              timings=job.timings, on_output=job.record_result).start()
     try:
-        client_id = f"sysprobe-{int(time.time())}"
-        # Handle both paho-mqtt v1.x and v2.x compatibility
         try:
-            # Try paho-mqtt 2.x style first
-            client = mqtt_client.Client(client_id=client_id, callback_api_version=mqtt_client.CallbackAPIVersion.VERSION2)
-        except (AttributeError, TypeError):
-            # Fall back to paho-mqtt 1.x style
-            client = mqtt_client.Client(client_id=client_id)
-
-        if creds and creds.get('user'):
-            client.username_pw_set(creds.get('user'), creds.get('pass'))
-
-        if use_tls:
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-            try: client.tls_set_context(ctx)
-            except Exception:
-                try:
-                    client.tls_set()
-                    client.tls_insecure_set(True)
-                except Exception as tls_e:
-                    info['error'] = f"TLS setup error: {tls_e}"
-                    app.logger.error(f"TLS setup failed for $SYS probe on {host}:{port}: {tls_e}")
-                    return info # Cannot proceed without TLS setup
-
-        client.on_connect = on_connect
-        client.on_message = on_message
-
-        # Use connect_async for non-blocking connection attempt
-        client.connect_async(host, port, keepalive=10)
-        client.loop_start()
-
-        # Wait briefly for connection and initial messages
-        connect_wait_start = time.time()
-        while time.time() - connect_wait_start < listen_secs + 1: # Wait a bit longer than listen_secs
-             if info['error'] and 'Connection failed' in info['error']:
-                 break # Stop waiting if connection failed early
-             time.sleep(0.1)
-
-        client.loop_stop()
-        try: client.disconnect()
-        except: pass
-
-        # Process collected messages
-        for topic, payload, is_retained in msgs:
-            # Limit payload length shown for brevity
-            payload_snippet = payload[:100] + ('...' if len(payload) > 100 else '')
-
-            # Track retained messages (these show up immediately, indicating existing publishers)
-            if is_retained and topic not in [t['topic'] for t in info['retained_topics']]:
-                info['retained_topics'].append({'topic': topic, 'payload': payload_snippet})
-
-            # Separate $SYS topics from regular topics
-            if topic.startswith('$SYS/'):
-                # Extract client list if available
-                if 'clients' in topic.lower() or 'connected' in topic.lower():
-                    try:
-                        # Some brokers publish client lists in $SYS topics
-                        if payload.strip():
-                            info['client_list'].append({'sys_topic': topic, 'info': payload_snippet})
-                    except: pass
-
-                # Store $SYS topics
-                if topic not in info['sys_topics']:
-                    info['sys_topics'][topic] = payload_snippet
-                elif info['sys_topics'][topic] != payload_snippet:
-                    # Handle duplicate topics with different payloads
-                    if not isinstance(info['sys_topics'][topic], list):
-                        info['sys_topics'][topic] = [info['sys_topics'][topic]]
-                    if payload_snippet not in info['sys_topics'][topic]:
-                        info['sys_topics'][topic].append(payload_snippet)
-            else:
-                # Store regular topics (non-$SYS)
-                if topic not in info['regular_topics']:
-                    info['regular_topics'][topic] = {
-                        'payload': payload_snippet,
-                        'retained': is_retained,
-                        'count': 1
-                    }
-                else:
-                    info['regular_topics'][topic]['count'] += 1
-                    # Update payload if different
-                    if info['regular_topics'][topic]['payload'] != payload_snippet:
-                        info['regular_topics'][topic]['last_payload'] = payload_snippet
-
-    except Exception as e:
-        info['error'] = f"Probe execution error: {str(e)}"
-        app.logger.error(f"Error during $SYS probe for {host}:{port}: {e}")
+            run_scan(targets, params.get('creds'), on_result=pipeline.put_async, ports=params['ports'],
+                     listen_secs=params['listen_duration'],
+                     capture_all_topics=params['capture_all_topics'],
+                     listen_mode=params['listen_mode'],
+                     keep_results=False, previous=previous, timings=job.timings, pacer=pacer)
+        finally:
+            job.set_phase('enriching')
+            pipeline.close()  # Whatever the probes produced is still stored
     finally:
-        try: # Ensure cleanup even if errors occurred
-            if client:
-                client.loop_stop()
-                client.disconnect()
-        except: pass
-
-    # Clean up error message if successful messages were received
-    total_count = info['sys_count'] + info['regular_count']
-    if total_count > 0 and info['error'] and 'Connection failed' not in info['error'] and 'Subscription error' not in info['error']:
-        info['error'] = None # Clear minor errors if we got data
-
-    return info
+        writer.close()
+    app.logger.info(f"[{job.id}] Pipeline stages: {pipeline.stats()}")
+    app.logger.info(f"[{job.id}] Connection pacing: {pacer.summary()}")
+    if previous is not None:
+        app.logger.info(f"[{job.id}] Incremental scan: {previous.stats}")
+
+    elapsed_time = time.time() - start_time
+    app.logger.info(f"[{job.id}] Scan and processing for target '{job.target}' completed in {elapsed_time:.2f} seconds.")
+    return job.results  # Recorded by the pipeline as rows were stored (empty for streamed jobs)
+
+scan_jobs = ScanJobManager(run_scan_job)
+
+# --- Broker monitor ---
+# Persistent subscriptions to the brokers in SCAN_MONITOR_BROKERS (comma separated
+# mqtt:// / mqtts:// URLs), so latest values are served from memory instead of a
+# fresh connect-and-listen per request.
+MONITOR_BROKERS = [b.strip() for b in os.environ.get('SCAN_MONITOR_BROKERS', '').split(',') if b.strip()]
+MONITOR_TOPICS = [t.strip() for t in os.environ.get('SCAN_MONITOR_TOPICS', '#').split(',') if t.strip()]
+MONITOR_MAX_WAIT_SECS = 5
+broker_monitor = None
+broker_monitor_lock = threading.Lock()
+
+def get_broker_monitor():
+    """The app's monitor, started on first use (or at startup when SCAN_MONITOR_BROKERS is set)."""
+    global broker_monitor
+    with broker_monitor_lock:
+        if broker_monitor is None:
+            broker_monitor = BrokerMonitor(MONITOR_BROKERS, topics=MONITOR_TOPICS, log=RotatingMessageLog()).start()
+        return broker_monitor
+
+if MONITOR_BROKERS:
+    get_broker_monitor()
 
 # --- API: Run Scan (POST) ---
 @app.route('/api/scan', methods=['POST'])
 @csrf.exempt  # Exempt API routes from CSRF (they use API key auth)
 @require_auth
 def api_scan():
+    """
+    Queues a scan job and returns its job_id immediately (202).
+    Poll /api/scan/<job_id>/status and fetch /api/scan/<job_id>/results.
+    Pass "wait": true to block until the job finishes and get the results inline,
+    or "stream": true to get the results as they complete (see stream_job_results).
+    "incremental": true only re-probes targets that are new, changed or whose latest
+    stored result is older than "max_age" seconds (see incremental.py).
+    "connect_rate"/"connect_burst" and "subnet_connect_rate"/"subnet_connect_burst"
+    pace new connections for the whole scan and per destination /24 (see pacing.py).
+    """
     # Check rate limit first
     client_ip = request.remote_addr
     allowed, retry_after = check_rate_limit(client_ip)
@@ -350,220 +407,347 @@ def api_scan():
             'limit': f'{MAX_SCANS_PER_WINDOW} scans per {RATE_LIMIT_WINDOW} seconds'
         }), 429
 
-    start_time = time.time()
     data = request.json or {}
     target = data.get('target', '127.0.0.1') # Default to localhost if no target specified
-    creds = data.get('creds') # Optional: {'user': 'x', 'pass': 'y'}
+    params = {
+        'creds': data.get('creds'), # Optional: {'user': 'x', 'pass': 'y'}
+        # Configurable scan parameters with safe defaults
+        'listen_duration': min(int(data.get('listen_duration', 3)), 10),  # Max 10 seconds (upper bound when adaptive)
+        'listen_mode': data.get('listen_mode', LISTEN_MODE),  # 'adaptive' ends early on quiet brokers, 'fixed' always waits
+        'capture_all_topics': data.get('capture_all_topics', False),  # Default: only $SYS
+        # Streamed scans keep nothing in memory; their results stay queryable in the result store
+        'keep_results': not data.get('stream'),
+        # Only re-probe targets that are new, changed or not confirmed within max_age seconds
+        'incremental': bool(data.get('incremental')),
+        'max_age': data.get('max_age'),
+    }
 
-    # Configurable scan parameters with safe defaults
-    listen_duration = min(int(data.get('listen_duration', 3)), 10)  # Max 10 seconds
-    capture_all_topics = data.get('capture_all_topics', False)  # Default: only $SYS
+    # Connection pacing; callers may change the limits but not switch pacing off
+    for key, cast in (('connect_rate', float), ('connect_burst', int),
+                      ('subnet_connect_rate', float), ('subnet_connect_burst', int)):
+        if data.get(key) is None:
+            continue
+        try:
+            params[key] = cast(data[key])
+        except (TypeError, ValueError):
+            params[key] = 0
+        if params[key] <= 0:
+            return jsonify(error=f"{key} must be a positive number"), 400
 
-    app.logger.info(f"Scan request received for target: {target} from {client_ip} (listen={listen_duration}s, capture_all={capture_all_topics})")
+    if params['listen_mode'] not in (LISTEN_MODE_ADAPTIVE, LISTEN_MODE_FIXED):
+        return jsonify(error=f"listen_mode must be '{LISTEN_MODE_ADAPTIVE}' or '{LISTEN_MODE_FIXED}'"), 400
 
+    if params['max_age'] is not None:
+        try:
+            params['max_age'] = float(params['max_age'])
+        except (TypeError, ValueError):
+            return jsonify(error="max_age must be a number of seconds"), 400
+
+    # Target spec: IPs, CIDRs of any size, a.b.c.d-e ranges, hostnames (comma separated),
+    # minus optional 'exclude'. Target files (@path) are CLI-only, never read on behalf of API callers.
     try:
-        # run_scan now returns list including 'publishers'
-        results = run_scan(target, creds)
-        app.logger.info(f"Scan function completed. Found {len(results)} potential results.")
-
-        # DEBUG: Log what run_scan returned
-        for r in results:
-            app.logger.info(f"Raw result from scanner: IP={r.get('ip')}, Port={r.get('port')}, Publishers count={len(r.get('publishers', []))}")
-            if r.get('publishers'):
-                for pub in r.get('publishers')[:2]:  # Log first 2 publishers
-                    app.logger.info(f"  Raw publisher: topic={pub.get('topic')}, has_payload={'payload' in pub}")
-
-        enriched_results = []
-        for r in results:
-            # Skip results indicating the port was closed at TCP level initially
-            if r.get('classification') == 'closed_or_unreachable':
-                 enriched_results.append(r) # Keep record of closed ports
-                 continue
-
-            r2 = r.copy() # Work with a copy
-            host = r2.get('ip')
-            port = r2.get('port')
-
-            if not host or not port:
-                app.logger.warning(f"Skipping result with missing host/port: {r}")
-                continue
-
-            try: port = int(port) # Ensure port is integer
-            except ValueError:
-                app.logger.warning(f"Skipping result with invalid port: {r}")
-                continue
-
-            is_tls_port = (port == 8883)
-            r2['tls'] = is_tls_port # Indicate if it's the standard TLS port
-
-            # Attempt to get Certificate Info for TLS ports
-            if is_tls_port:
-                app.logger.debug(f"Getting certificate info for {host}:{port}")
-                cert_info = get_cert_info(host, port)
-                r2['cert_info'] = cert_info
-            else:
-                r2['cert_info'] = {'error': 'Not a TLS port'}
-
-            # Attempt topic probe if connection was successful
-            if r2.get('classification') == 'open_or_auth_ok':
-                app.logger.debug(f"Probing broker topics for {host}:{port} (capture_all={capture_all_topics})")
-                broker_info = probe_broker_topics(
-                    host, port,
-                    creds=creds,
-                    use_tls=is_tls_port,
-                    listen_secs=listen_duration,
-                    capture_all=capture_all_topics
-                )
-                r2['broker_info'] = broker_info
-
-            # Ensure 'publishers' key exists, even if empty
-            if 'publishers' not in r2:
-                r2['publishers'] = []
-
-            enriched_results.append(r2)
-
-        app.logger.info(f"Enrichment complete for {len(enriched_results)} results.")
-
-        # DEBUG: Log publishers data before sending to browser
-        for r in enriched_results:
-            if r.get('publishers'):
-                app.logger.info(f"Publishers for {r.get('ip')}:{r.get('port')}: {len(r.get('publishers'))} publishers")
-                for pub in r.get('publishers'):
-                    app.logger.info(f"  Topic: {pub.get('topic')}")
-                    app.logger.info(f"  Publisher keys: {pub.keys()}")
-                    app.logger.info(f"  Payload field exists: {'payload' in pub}")
-                    app.logger.info(f"  Payload value: {pub.get('payload')[:50] if pub.get('payload') else 'NO PAYLOAD'}")
-
-        # --- Write results to CSV ---
-        if enriched_results: # Only write if there are results
-            # Define headers with enhanced certificate and broker info fields
-            fieldnames = [
-                'ip', 'port', 'result', 'classification', 'tls',
-                'cert_subject', 'cert_issuer', 'cert_valid_from', 'cert_valid_to',
-                'broker_error', 'sys_topic_count', 'regular_topic_count', 'retained_count',
-                'publishers', 'timestamp'
-            ]
-            try:
-                with open(CSV_PATH, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-                    writer.writeheader()
-                    for row in enriched_results:
-                        # Extract cert info
-                        cert_info = row.get('cert_info', {})
-                        cert_subject = json.dumps(cert_info.get('subject')) if cert_info.get('subject') else cert_info.get('error', '')
-                        cert_issuer = json.dumps(cert_info.get('issuer')) if cert_info.get('issuer') else ''
-
-                        # Extract broker info
-                        broker_info = row.get('broker_info', {})
-
-                        # Prepare row for CSV writing
-                        csv_row = {
-                            'ip': row.get('ip'),
-                            'port': row.get('port'),
-                            'result': row.get('result'),
-                            'classification': row.get('classification'),
-                            'tls': row.get('tls'),
-                            'cert_subject': cert_subject,
-                            'cert_issuer': cert_issuer,
-                            'cert_valid_from': cert_info.get('valid_from', ''),
-                            'cert_valid_to': cert_info.get('valid_to', ''),
-                            'broker_error': broker_info.get('error', ''),
-                            'sys_topic_count': broker_info.get('sys_count', 0),
-                            'regular_topic_count': broker_info.get('regular_count', 0),
-                            'retained_count': len(broker_info.get('retained_topics', [])),
-                            # Serialize publishers list as a JSON string for CSV
-                            'publishers': json.dumps(row.get('publishers', [])),
-                            'timestamp': row.get('timestamp')
-                        }
-                        writer.writerow(csv_row)
-                app.logger.info(f"Results successfully written to {CSV_PATH}")
-            except IOError as e:
-                app.logger.error(f"Failed to write CSV file at {CSV_PATH}: {e}")
-            except Exception as e:
-                 app.logger.error(f"An unexpected error occurred during CSV writing: {e}")
-        else:
-             app.logger.info("No results to write to CSV.")
-             # Optionally clear the CSV or leave it as is from previous scan
-             if os.path.exists(CSV_PATH):
-                 try: os.remove(CSV_PATH) # Clear old results if scan yields nothing
-                 except OSError as e: app.logger.error(f"Could not remove old CSV {CSV_PATH}: {e}")
-
-        elapsed_time = time.time() - start_time
-        app.logger.info(f"Scan and processing for target '{target}' completed in {elapsed_time:.2f} seconds.")
-
-        # Flatten broker_info fields to top level for easier access
-        for r in enriched_results:
-            broker_info = r.get('broker_info', {})
-            if broker_info:
-                r['sys_topic_count'] = broker_info.get('sys_count', 0)
-                r['regular_topic_count'] = broker_info.get('regular_count', 0)
-                r['retained_count'] = len(broker_info.get('retained_topics', []))
-                r['broker_error'] = broker_info.get('error')
-
-        # DEBUG: Log what we're about to send to browser
-        app.logger.info(f"About to send {len(enriched_results)} results to browser")
-        for r in enriched_results[:1]:  # Log first result only
-            app.logger.info(f"Sample result keys: {r.keys()}")
-            app.logger.info(f"Sample result sys_topic_count: {r.get('sys_topic_count', 'MISSING')}")
-            if r.get('publishers'):
-                app.logger.info(f"Sample result publishers[0] keys: {r['publishers'][0].keys()}")
-                app.logger.info(f"Sample result publishers[0] payload: {r['publishers'][0].get('payload', 'MISSING')[:50]}")
-
-        return jsonify({'status':'ok', 'results': enriched_results})
-
-    except Exception as e:
-        elapsed_time = time.time() - start_time
-        app.logger.error(f"Scan request failed for target '{target}' after {elapsed_time:.2f} seconds: {e}", exc_info=True) # Log full traceback
-        return jsonify(error=f"Scan failed: {str(e)}"), 500
+        params['targets'] = expand_targets(target, exclude=data.get('exclude'), allow_files=False)
+    except ValueError as e:
+        return jsonify(error=f"Invalid target: {e}"), 400
+
+    # Ports to probe on every target (list or "1883,8883,8884"); TLS vs plaintext is detected per port
+    try:
+        params['ports'] = parse_ports(data['ports']) if data.get('ports') else COMMON_PORTS
+    except ValueError as e:
+        return jsonify(error=f"Invalid ports: {e}"), 400
+
+    app.logger.info(f"Scan request received for target: {target} from {client_ip} (listen={params['listen_duration']}s {params['listen_mode']}, capture_all={params['capture_all_topics']})")
+
+    try:
+        job = scan_jobs.submit(target, params)
+    except JobQueueFull as e:
+        app.logger.warning(f"Rejecting scan for {target}: {e}")
+        return jsonify(error=f"Scanner busy: {e}. Try again later."), 503
+
+    if data.get('stream'):
+        return stream_job_results(job)
+
+    if data.get('wait'):
+        job.done.wait()
+        if job.status == STATUS_FAILED:
+            app.logger.error(f"Scan request failed for target '{target}': {job.error}")
+            return jsonify(error=f"Scan failed: {job.error}", job_id=job.id), 500
+        return jsonify({'status': 'ok', 'job_id': job.id, 'results': job.results})
+
+    status = job.to_status()
+    status['status_url'] = url_for('api_scan_status', job_id=job.id)
+    status['results_url'] = url_for('api_scan_results', job_id=job.id)
+    status['stream_url'] = url_for('api_scan_stream', job_id=job.id)
+    return jsonify(status), 202
+
+# --- API: Scan Job Status (GET) ---
+@app.route('/api/scan/<job_id>/status', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_scan_status(job_id):
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify(error=f"Unknown scan job: {job_id}"), 404
+    return jsonify(job.to_status())
+
+# --- Result streaming ---
+STREAM_HEARTBEAT_SECS = float(os.environ.get('SCAN_STREAM_HEARTBEAT_SECS', 10))
+
+def stream_job_results(job):
+    """
+    Streams a job's results as they complete, as NDJSON (default) or as
+    server-sent events when the client accepts text/event-stream.
+
+    Each per-port result dict is sent as its own record, unchanged. Records with
+    a 'type' are stream metadata: 'progress' after STREAM_HEARTBEAT_SECS without
+    results, 'gap' when the client fell more than the stream buffer behind, and
+    a final 'summary' with the job status and counts per classification.
+    """
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+
+    def encode(record):
+        line = json.dumps(record, default=str)
+        return f"data: {line}\n\n" if sse else line + '\n'
+
+    def generate():
+        seq = 0
+        while True:
+            finished = job.done.is_set()
+            results, seq, missed = job.results_since(seq, timeout=None if finished else STREAM_HEARTBEAT_SECS)
+            if missed:
+                yield encode({'type': 'gap', 'missed': missed})
+            for result in results:
+                yield encode(result)
+            if finished:
+                break
+            if not results:
+                status = job.to_status()
+                yield encode({'type': 'progress', 'hosts_done': status['hosts_done'],
+                              'hosts_total': status['hosts_total'], 'progress': status['progress']})
+
+        summary = job.to_status()
+        summary['type'] = 'summary'
+        summary['classification_counts'] = dict(job.classification_counts)
+        yield encode(summary)
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['X-Job-Id'] = job.id
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a reverse proxy buffer the stream
+    return response
+
+# --- API: Scan Job Result Stream (GET) ---
+@app.route('/api/scan/<job_id>/stream', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_scan_stream(job_id):
+    """Streams the job's results from the start (as far as the stream buffer reaches), then a summary."""
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify(error=f"Unknown scan job: {job_id}"), 404
+    return stream_job_results(job)
+
+# --- API: Scan Job Results (GET, paged) ---
+@app.route('/api/scan/<job_id>/results', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_scan_results(job_id):
+    """Returns ?page=N (1-based) of ?per_page=M results; partial while the job is still running."""
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify(error=f"Unknown scan job: {job_id}"), 404
+
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(max(1, int(request.args.get('per_page', 500))), 5000)
+    except ValueError:
+        return jsonify(error="page and per_page must be integers"), 400
+
+    if not job.keep_results:
+        return jsonify(error="Results of streamed scans are not kept in memory",
+                       results_url=url_for('api_results', scan_id=job.id)), 409
+
+    results, total = job.page(page, per_page)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page,
+        'count': total,
+        'results': results,
+    })
 
 # --- API: Get Results (GET) ---
 @app.route('/api/results', methods=['GET'])
 @csrf.exempt  # Exempt API routes from CSRF (they use API key auth)
 @require_auth
 def api_results():
-    """Reads the latest scan results from the CSV file."""
-    results = []
-    if os.path.exists(CSV_PATH):
+    """
+    Returns stored result rows as a JSON list; by default those of the latest scan.
+
+    Filters: scan_id ('all' for every scan), ip, port, classification,
+    risk_level, since / until (ISO timestamps). Paging: limit (default 500)
+    and cursor; when more rows match, the X-Next-Cursor response header holds
+    the cursor for the next page.
+    """
+    args = request.args
+    scan_id = args.get('scan_id') or result_store.latest_scan_id()
+    if scan_id is None:
+        return jsonify([]) # Nothing scanned yet
+    try:
+        rows, next_cursor = result_store.query(
+            limit=int(args.get('limit', 500)),
+            cursor=int(args['cursor']) if args.get('cursor') else None,
+            scan_id=None if scan_id == 'all' else scan_id,
+            ip=args.get('ip'),
+            port=int(args['port']) if args.get('port') else None,
+            classification=args.get('classification'),
+            risk_level=args.get('risk_level'),
+            since=args.get('since'),
+            until=args.get('until'),
+        )
+    except ValueError:
+        return jsonify(error="limit, cursor and port must be integers"), 400
+
+    response = jsonify(rows)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+# --- API: Stored Scans (GET) ---
+@app.route('/api/scans', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_scans():
+    """Most recent scans in the result store, newest first (?limit=50)."""
+    try:
+        limit = min(max(1, int(request.args.get('limit', 50))), 1000)
+    except ValueError:
+        return jsonify(error="limit must be an integer"), 400
+    return jsonify(result_store.scans(limit))
+
+# --- API: Scan Diff (GET) ---
+@app.route('/api/scans/diff', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_scans_diff():
+    """
+    Streams the changed findings between two stored scans as NDJSON
+    (?old=<scan_id>&new=<scan_id>, new defaults to the latest finished scan):
+    one record per changed host:port, then a 'summary' record with counts.
+    """
+    old_id = request.args.get('old')
+    new_id = request.args.get('new') or result_store.latest_scan_id()
+    if not old_id:
+        return jsonify(error="old scan_id is required"), 400
+    for scan_id in (old_id, new_id):
+        if not scan_id or result_store.scan(scan_id) is None:
+            return jsonify(error=f"Scan not found: {scan_id}"), 404
+
+    def generate():
+        stats = Counter()
+        for change in diff_scans(result_store, old_id, new_id, stats):
+            yield json.dumps(change) + '\n'
+        yield json.dumps({'type': 'summary', 'old_scan_id': old_id, 'new_scan_id': new_id, **stats}) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# --- API: Broker Monitor (GET) ---
+@app.route('/api/monitor', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_monitor():
+    """Connection state and counters of every monitored broker."""
+    return jsonify(get_broker_monitor().status())
+
+@app.route('/api/monitor/brokers', methods=['POST'])
+@csrf.exempt
+@require_auth
+def api_monitor_add_broker():
+    """
+    Starts monitoring a broker (idempotent). Body: {"url": "mqtts://host:8883"} or
+    {"host", "port", "tls", "username", "password"}; "wait": seconds (max 5) to
+    block until its retained messages are in. Returns the broker's status.
+    """
+    data = request.json or {}
+    try:
+        if data.get('url'):
+            spec = parse_broker(data['url'])
+        else:
+            port = int(data.get('port', 1883))
+            tls = data.get('tls')
+            scheme = 'mqtt-auto' if tls is None else 'mqtts' if tls else 'mqtt'
+            spec = parse_broker(f"{scheme}://{data.get('host', '')}:{port}")
+        if data.get('username'):
+            spec = spec._replace(username=data['username'], password=data.get('password'))
+        monitor = get_broker_monitor()
+        spec = monitor.add_broker(spec)
+        wait = min(float(data.get('wait', 0)), MONITOR_MAX_WAIT_SECS)
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    status = monitor.wait_ready(spec.key, wait) if wait > 0 else monitor.broker_status(spec.key)
+    return jsonify(status)
+
+@app.route('/api/monitor/latest', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_monitor_latest():
+    """
+    Latest value per topic, from memory: ?topic=<MQTT filter, '+'/'#' allowed, default #>
+    &broker=host:port (default all monitored brokers) &max_age=<seconds> (only topics
+    updated within it). Never opens a broker connection.
+    """
+    monitor = get_broker_monitor()
+    broker = request.args.get('broker') or None
+    topic_filter = request.args.get('topic', '#')
+    since = None
+    if request.args.get('max_age'):
         try:
-            with open(CSV_PATH, mode='r', newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # Parse JSON fields
-                    try:
-                        row['publishers'] = json.loads(row.get('publishers', '[]'))
-                    except json.JSONDecodeError:
-                        row['publishers'] = []
-
-                    # Parse certificate subject/issuer if they're JSON strings
-                    for cert_field in ['cert_subject', 'cert_issuer']:
-                        if row.get(cert_field) and row[cert_field].startswith('{'):
-                            try:
-                                row[cert_field] = json.loads(row[cert_field])
-                            except json.JSONDecodeError:
-                                pass  # Keep as string
-
-                    # Convert boolean strings back to boolean
-                    row['tls'] = row.get('tls', 'False').lower() == 'true'
-
-                    # Convert count fields back to int
-                    for count_field in ['sys_topic_count', 'regular_topic_count', 'retained_count']:
-                        try:
-                            row[count_field] = int(row.get(count_field, 0))
-                        except (ValueError, TypeError):
-                            row[count_field] = 0
-
-                    results.append(row)
-            app.logger.debug(f"Retrieved {len(results)} results from {CSV_PATH}")
-        except IOError as e:
-             app.logger.error(f"Failed to read CSV file at {CSV_PATH}: {e}")
-             return jsonify(error=f"Could not read results file: {e}"), 500
-        except Exception as e:
-             app.logger.error(f"An unexpected error occurred reading CSV: {e}")
-             return jsonify(error=f"Error processing results file: {e}"), 500
-    else:
-         app.logger.info(f"Results file not found: {CSV_PATH}")
-         # Return empty list, not an error, if file doesn't exist yet
-    return jsonify(results)
+            since = time.time() - float(request.args['max_age'])
+        except ValueError:
+            return jsonify(error="max_age must be a number of seconds"), 400
+    if broker is not None and not monitor.watching(broker):
+        return jsonify(error=f"Broker {broker} is not monitored (POST /api/monitor/brokers)"), 404
+    return jsonify(monitor.latest.match(topic_filter, broker=broker, since=since))
+
+# --- API: TLS Certificate Cache Metrics (GET) ---
+@app.route('/api/tls/cert-cache', methods=['GET'])
+@csrf.exempt
+@require_auth
+def api_cert_cache():
+    """Hit/miss counters of the certificate analysis cache shared by all scans."""
+    return jsonify(cert_cache.metrics())
+
+# --- Metrics (GET, Prometheus text format) ---
+@app.route('/metrics', methods=['GET'])
+@csrf.exempt
+@require_auth
+def metrics():
+    """
+    In-flight probes, queue depth, completion rate, probe/result totals and
+    per-stage latency summaries of all scans (see metrics.py), plus job,
+    certificate cache and TLS session resumption counters. Scrape with the
+    X-API-KEY header.
+    """
+    jobs = scan_jobs.counts()
+    cache = cert_cache.metrics()
+    tls = tls_contexts.metrics()
+    extra = {
+        'jobs_queued': ('gauge', 'Scan jobs waiting for an executor slot.', jobs[STATUS_QUEUED]),
+        'jobs_running': ('gauge', 'Scan jobs running.', jobs[STATUS_RUNNING]),
+        'tls_cert_cache_hits_total': ('counter', 'Certificate analysis cache hits.', cache['hits']),
+        'tls_cert_cache_misses_total': ('counter', 'Certificate analysis cache misses.', cache['misses']),
+        'tls_handshakes_total': ('counter', 'TLS handshakes completed by probes and monitors.', tls['handshakes']),
+        'tls_handshakes_resumed_total': ('counter', 'TLS handshakes that resumed a cached session.', tls['resumed']),
+        'tls_sessions_cached': ('gauge', 'Resumable TLS sessions held (one per host, port and profile).',
+                                tls['sessions']),
+    }
+    return Response(scan_metrics.render(extra), mimetype='text/plain; version=0.0.4')
 
 # --- Main Execution ---
 if __name__ == '__main__':
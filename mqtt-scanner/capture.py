@@ -0,0 +1,308 @@
+"""
+Bounded per-probe message capture for the listen window.
+
+Everything a probe learns from the messages it receives (topics, publishers,
+broker_info, payload samples) is folded into one record per topic, and the
+number of records, the payload samples per record and the total payload text
+kept are all capped, so a firehose broker costs fixed memory:
+
+- Topics are sampled bottom-k by hash: the CAPTURE_MAX_TOPICS topics with the
+  smallest hashes are kept. That is a uniform sample of the distinct topics,
+  it is stable when a topic repeats, and the k-th smallest hash gives an
+  estimate of how many distinct topics there were (reported as topics_seen).
+- Each kept topic holds a reservoir (Algorithm R) of at most
+  CAPTURE_MAX_MESSAGES_PER_TOPIC payload snippets, uniform over its messages.
+- Stored payload text never exceeds CAPTURE_MAX_PAYLOAD_BYTES; updates that
+  would pass it are dropped and counted.
+
+Message and byte totals stay exact. The counters are reported as result['capture'].
+"""
+import datetime
+import heapq
+import logging
+import os
+import random
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_MAX_TOPICS = int(os.environ.get('SCAN_CAPTURE_MAX_TOPICS', 5000))
+CAPTURE_MAX_MESSAGES_PER_TOPIC = int(os.environ.get('SCAN_CAPTURE_MAX_MESSAGES_PER_TOPIC', 5))
+CAPTURE_MAX_PAYLOAD_BYTES = int(os.environ.get('SCAN_CAPTURE_MAX_PAYLOAD_BYTES', 4 * 1024 * 1024))
+
+# Only this much of a payload is decoded; snippets kept in results are far shorter
+PAYLOAD_DECODE_BYTES = 2048
+LATEST_PAYLOAD_CHARS = 500  # publishers[].payload
+SNIPPET_CHARS = 100         # broker_info payloads and samples
+
+_HASH_SPACE = 1 << 64
+
+
+def payload_text(msg):
+    return msg.payload[:PAYLOAD_DECODE_BYTES].decode('utf-8', errors='replace')
+
+
+def _snippet(payload):
+    # Limit payload length shown for brevity
+    return payload[:SNIPPET_CHARS] + ('...' if len(payload) > SNIPPET_CHARS else '')
+
+
+def _utf8_len(text):
+    # The payload budget is in bytes; non-ASCII text takes more than one per character
+    return len(text.encode('utf-8'))
+
+
+class Reservoir:
+    """Uniform sample of at most `capacity` items from a stream (Algorithm R)."""
+
+    __slots__ = ('capacity', 'items', 'seen')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = []
+        self.seen = 0
+
+    def offer(self, item):
+        """
+        Offer the next stream item. Returns (slot, replaced): slot is the index the
+        item should go to (None if it is not sampled), replaced the item it displaces.
+        The caller stores it with store(), so it can refuse (e.g. over a byte budget).
+        """
+        self.seen += 1
+        if len(self.items) < self.capacity:
+            return len(self.items), None
+        slot = random.randrange(self.seen)
+        if slot < self.capacity:
+            return slot, self.items[slot]
+        return None, None
+
+    def store(self, slot, item):
+        if slot == len(self.items):
+            self.items.append(item)
+        else:
+            self.items[slot] = item
+
+
+class TopicSampler:
+    """
+    Bottom-k sample of distinct topics by 64-bit hash.
+
+    admit(topic) returns (kept, evicted): whether the topic is in the sample
+    now, and the topic it pushed out, if any.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self._kept = {}   # topic -> hash
+        self._heap = []   # (-hash, topic); the root is the largest kept hash
+        self.full = False
+
+    def __len__(self):
+        return len(self._kept)
+
+    def admit(self, topic):
+        if topic in self._kept:
+            return True, None
+        h = hash(topic) % _HASH_SPACE
+        if len(self._kept) < self.capacity:
+            self._kept[topic] = h
+            heapq.heappush(self._heap, (-h, topic))
+            return True, None
+        self.full = True
+        if h >= -self._heap[0][0]:
+            return False, None
+        _neg, evicted = heapq.heapreplace(self._heap, (-h, topic))
+        del self._kept[evicted]
+        self._kept[topic] = h
+        return True, evicted
+
+    def estimate(self):
+        """Number of distinct topics offered; exact until the sample first fills."""
+        if not self.full:
+            return len(self._kept)
+        largest = -self._heap[0][0]
+        return int((self.capacity - 1) * _HASH_SPACE / (largest + 1))
+
+
+class ProbeCapture:
+    """
+    Per-probe message state for one listen window. Each topic is one record in
+    a dict, so a message is an O(1) update however many topics the broker has,
+    and nothing is shared between probes (no locks in the hot path).
+
+    Usage:
+        capture = ProbeCapture(host, port, capture_all=True)
+        capture.add(msg)             # for every PUBLISH
+        capture.finish(result)       # fills publishers, topics_discovered, broker_info, capture
+    """
+
+    def __init__(self, host, port, capture_all=True, max_topics=None, max_messages_per_topic=None,
+                 max_payload_bytes=None):
+        self.host = host
+        self.port = port
+        self.capture_all = capture_all
+        self.max_messages_per_topic = max_messages_per_topic or CAPTURE_MAX_MESSAGES_PER_TOPIC
+        self.max_payload_bytes = CAPTURE_MAX_PAYLOAD_BYTES if max_payload_bytes is None else max_payload_bytes
+        max_topics = max_topics or CAPTURE_MAX_TOPICS
+        self.topics = {}  # topic -> record, in first-seen order
+        self._samplers = {True: TopicSampler(max_topics), False: TopicSampler(max_topics)}  # keyed by is_sys
+        self.sys_clients = set()
+        self.payload_bytes = 0
+        self.stats = {
+            'messages': 0,
+            'sys_messages': 0,
+            'regular_messages': 0,
+            'bytes': 0,
+            'topics_evicted': 0,
+            'messages_unsampled': 0,   # Messages on topics outside the topic sample
+            'payload_bytes_dropped': 0,
+        }
+
+    def _charge(self, record, old, new):
+        """Swap stored text `old` for `new` in `record` if the byte budget allows; returns the kept text."""
+        new_bytes = _utf8_len(new)
+        delta = new_bytes - _utf8_len(old)
+        if delta > 0 and self.payload_bytes + delta > self.max_payload_bytes:
+            self.stats['payload_bytes_dropped'] += new_bytes
+            return old
+        self.payload_bytes += delta
+        record['bytes'] += delta
+        return new
+
+    def _new_record(self, msg, is_sys):
+        return {
+            'is_sys': is_sys,
+            'first_seen': datetime.datetime.utcnow().isoformat(),
+            'count': 0,
+            'qos': msg.qos,
+            'retained': msg.retain,
+            'payload_size': 0,
+            'latest': '',
+            'first': None,
+            'retained_payload': None,
+            'samples': Reservoir(self.max_messages_per_topic),
+            'bytes': 0,
+        }
+
+    def _evict(self, topic):
+        record = self.topics.pop(topic, None)
+        if record is not None:
+            self.payload_bytes -= record['bytes']
+            self.stats['topics_evicted'] += 1
+
+    def add(self, msg):
+        """Fold one PUBLISH into the capture."""
+        topic = msg.topic
+        is_sys = topic.startswith('$SYS/')
+        self.stats['messages'] += 1
+        self.stats['bytes'] += len(msg.payload)
+        if is_sys:
+            self.stats['sys_messages'] += 1
+        elif self.capture_all:
+            self.stats['regular_messages'] += 1
+
+        record = self.topics.get(topic)
+        if record is None:
+            kept, evicted = self._samplers[is_sys].admit(topic)
+            if evicted is not None:
+                self._evict(evicted)
+            if not kept:
+                self.stats['messages_unsampled'] += 1
+                return
+            record = self.topics[topic] = self._new_record(msg, is_sys)
+            if is_sys:
+                # Detect publishers from $SYS topics
+                parts = topic.split('/')
+                if topic.startswith('$SYS/broker/clients/') and len(parts) >= 4:
+                    self.sys_clients.add(parts[3])
+            else:
+                logger.info(f"[{self.host}:{self.port}] Detected publisher on topic: {topic}")
+
+        payload = payload_text(msg)
+        record['count'] += 1
+        record['payload_size'] = len(msg.payload)
+        if not is_sys:
+            record['latest'] = self._charge(record, record['latest'], payload[:LATEST_PAYLOAD_CHARS])
+        if not is_sys and not self.capture_all:
+            return  # Regular traffic is only summarised in broker_info in capture_all mode
+
+        snippet = _snippet(payload)
+        if record['first'] is None:
+            record['first'] = self._charge(record, '', snippet)
+        # Track retained messages (these show up immediately, indicating existing publishers)
+        if msg.retain and record['retained_payload'] is None:
+            record['retained_payload'] = self._charge(record, '', snippet)
+        if is_sys:
+            record['latest'] = self._charge(record, record['latest'], snippet)
+
+        slot, replaced = record['samples'].offer(snippet)
+        if slot is not None:
+            replaced = replaced or ''
+            if self._charge(record, replaced, snippet) is snippet:
+                record['samples'].store(slot, snippet)
+
+    def finish(self, result):
+        """Write publishers, topics_discovered, broker_info and the capture counters into `result`."""
+        broker_info = {
+            'sys_topics': {},
+            'regular_topics': {},
+            'retained_topics': [],
+            'error': None,
+            'sys_count': self.stats['sys_messages'],
+            'regular_count': self.stats['regular_messages'],
+            'client_list': []
+        }
+        publishers = []
+        topics_discovered = {}
+
+        for topic, record in self.topics.items():
+            samples = record['samples'].items
+            if record['retained_payload'] is not None:
+                broker_info['retained_topics'].append({'topic': topic, 'payload': record['retained_payload']})
+
+            if record['is_sys']:
+                variants = list(dict.fromkeys([record['first']] + samples))
+                broker_info['sys_topics'][topic] = variants[0] if len(variants) == 1 else variants
+                # Some brokers publish client lists in $SYS topics
+                if ('clients' in topic.lower() or 'connected' in topic.lower()) and record['latest'].strip():
+                    broker_info['client_list'].append({'sys_topic': topic, 'info': record['latest']})
+                continue
+
+            topics_discovered[topic] = {
+                'first_seen': record['first_seen'],
+                'message_count': record['count'],
+                'publishers': []
+            }
+            publishers.append({
+                'topic': topic,
+                'payload': record['latest'],
+                'payload_size': record['payload_size'],
+                'qos': record['qos'],
+                'retained': record['retained'],
+                'message_count': record['count'],
+                'samples': samples,
+                'client_id_note': 'Unknown - MQTT v3.x limitation'
+            })
+            if self.capture_all:
+                regular = {'payload': record['first'], 'retained': record['retained'], 'count': record['count']}
+                last = _snippet(record['latest'])
+                if last != record['first']:
+                    regular['last_payload'] = last
+                broker_info['regular_topics'][topic] = regular
+
+        result['publishers'] = publishers
+        result['topics_discovered'] = topics_discovered
+        result['broker_info'] = broker_info
+        result['capture'] = dict(
+            self.stats,
+            topics_seen=self._samplers[False].estimate(),
+            sys_topics_seen=self._samplers[True].estimate(),
+            topics_kept=len(topics_discovered),
+            sampled=self._samplers[False].full or self._samplers[True].full,
+            payload_bytes=self.payload_bytes,
+            limits={
+                'max_topics': self._samplers[False].capacity,
+                'max_messages_per_topic': self.max_messages_per_topic,
+                'max_payload_bytes': self.max_payload_bytes,
+            },
+        )
+        return result
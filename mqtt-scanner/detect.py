@@ -0,0 +1,86 @@
+"""
+Per-port transport detection: TLS or plaintext, decided from the wire.
+
+A TLS ClientHello is sent on a freshly connected socket and the first bytes
+of the reply are inspected. A TLS server answers with a handshake or alert
+record (0x16/0x15 followed by a 0x03 version byte); a plaintext MQTT broker
+sees an invalid CONNECT and either answers with non-TLS bytes or hangs up;
+a WebSocket listener answers with an HTTP status line. The port number is
+only used as a fallback when the peer stays silent.
+"""
+import asyncio
+import os
+import ssl
+
+# How long to wait for the first reply bytes before falling back to the port hint
+DETECT_TIMEOUT = float(os.environ.get('SCAN_DETECT_TIMEOUT', 1.0))
+
+PROTO_TLS = 'tls'
+PROTO_PLAIN = 'plain'
+PROTO_HTTP = 'http'        # HTTP/WebSocket listener (e.g. MQTT over WebSockets)
+PROTO_UNKNOWN = 'unknown'  # Peer stayed silent; use port_hint()
+
+# Ports assumed to be TLS when detection is inconclusive
+TLS_PORT_HINTS = frozenset(
+    int(p) for p in os.environ.get('SCAN_TLS_PORT_HINTS', '8883,8884,443,8443').split(',') if p.strip()
+)
+
+_TLS_RECORD_TYPES = (0x15, 0x16)  # alert, handshake
+_client_hello = None
+
+
+def client_hello():
+    """Bytes of a TLS ClientHello, built once with the ssl module and reused for every probe."""
+    global _client_hello
+    if _client_hello is None:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        tls = ctx.wrap_bio(incoming, outgoing, server_side=False)
+        try:
+            tls.do_handshake()
+        except ssl.SSLWantReadError:
+            pass
+        _client_hello = outgoing.read()
+    return _client_hello
+
+
+def classify_reply(data):
+    """Protocol implied by the first bytes a peer sent back after the ClientHello."""
+    if not data:
+        return PROTO_PLAIN  # Closed on us without a TLS alert: not a TLS server
+    if data[0] in _TLS_RECORD_TYPES and (len(data) < 2 or data[1] == 0x03):
+        return PROTO_TLS
+    if data.startswith(b'HTTP/'):
+        return PROTO_HTTP
+    return PROTO_PLAIN
+
+
+def port_hint(port):
+    return PROTO_TLS if port in TLS_PORT_HINTS else PROTO_PLAIN
+
+
+async def detect_on_socket(sock, timeout=None):
+    """
+    Run detection on an already connected non-blocking socket; returns a PROTO_* value.
+    The socket is left for the caller to close; it is not usable for MQTT afterwards.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.sock_sendall(sock, client_hello())
+        data = await asyncio.wait_for(loop.sock_recv(sock, 8), timeout or DETECT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return PROTO_UNKNOWN
+    except (ConnectionResetError, BrokenPipeError):
+        return PROTO_PLAIN
+    except OSError:
+        return PROTO_UNKNOWN
+    return classify_reply(data)
+
+
+def resolve_protocol(protocol, port):
+    """Detected protocol, or the port hint when detection was skipped or inconclusive."""
+    if protocol in (None, PROTO_UNKNOWN):
+        return port_hint(port)
+    return protocol
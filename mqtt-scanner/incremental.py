@@ -0,0 +1,147 @@
+"""
+Incremental rescans: reuse recent results for targets whose state hasn't changed.
+
+A scheduled rescan of a stable fleet mostly rediscovers what the previous scan
+already recorded. With a PreviousResults passed to run_scan(previous=...),
+each (ip, port) is first looked up in the stored history:
+
+- no previous result, or one older than INCREMENTAL_MAX_AGE: full probe
+- closed/filtered or non-MQTT, and recent: one TCP connect (the sweep's, or
+  the probe's port check with protocol detection) checks that it still is;
+  if so the previous result is reused (status 'reused'), otherwise the target
+  is probed in full (status 'changed'). A broker that came up since the last
+  scan is therefore found by the next one, not INCREMENTAL_MAX_AGE later
+- any other recent outcome: one short probe (TCP, TLS handshake, CONNECT,
+  no listen window) checks the port state, certificate fingerprint and auth
+  outcome. If they match, the previous result's topics, publishers and broker
+  info are carried forward (status 'confirmed'); if not, the target is probed
+  in full (status 'changed').
+
+Carried-forward results keep the timestamp of the full probe they came from,
+so every target is fully re-probed at least once per INCREMENTAL_MAX_AGE.
+Each result says what happened in result['incremental'].
+"""
+import copy
+import datetime
+import os
+import threading
+
+# How long a previous result counts as "confirmed recently"
+INCREMENTAL_MAX_AGE = float(os.environ.get('SCAN_INCREMENTAL_MAX_AGE', 6 * 3600))
+# Pairs whose previous results are looked up together (see PreviousResults.prefetch)
+INCREMENTAL_LOOKUP_WINDOW = int(os.environ.get('SCAN_INCREMENTAL_LOOKUP_WINDOW', 1024))
+
+STATUS_NEW = 'new'
+STATUS_STALE = 'stale'
+STATUS_REUSED = 'reused'
+STATUS_CONFIRMED = 'confirmed'
+STATUS_CHANGED = 'changed'
+
+# Outcomes that a rescan reuses after a single TCP connect confirms them
+_REUSABLE_CLASSIFICATIONS = ('closed_or_unreachable', 'non_mqtt_service')
+
+
+def cert_fingerprint(result):
+    """SHA-256 certificate fingerprint of a raw or stored result, or None."""
+    details = (result.get('tls_analysis') or {}).get('cert_details') or {}
+    return details.get('fingerprint_sha256') or result.get('cert_fingerprint')
+
+
+def result_state(result):
+    """What a short probe must reproduce for a previous result to stay valid."""
+    return result.get('classification'), bool(result.get('tls')), cert_fingerprint(result)
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PreviousResults:
+    """
+    Recent results per (ip, port) for an incremental run_scan.
+
+    lookup(ip, port) returns the latest stored result for that pair (a raw
+    probe result, or anything result_state() can read) or None. Alternatively
+    lookup_many(pairs) returns {(ip, port): result} for a window of pairs at
+    once; run_scan calls prefetch() per INCREMENTAL_LOOKUP_WINDOW pairs, so a
+    large range costs one lookup per window and only that window is in memory.
+
+    Usage:
+        previous = PreviousResults(lookup)              # or PreviousResults(lookup_many=...)
+        run_scan(target, previous=previous)
+        previous.stats    # new / stale / reused / confirmed / changed counts
+    """
+
+    def __init__(self, lookup=None, max_age=None, lookup_many=None):
+        if lookup is None and lookup_many is None:
+            raise ValueError("PreviousResults needs lookup or lookup_many")
+        self.lookup = lookup
+        self.lookup_many = lookup_many
+        self.max_age = INCREMENTAL_MAX_AGE if max_age is None else max_age
+        self._window = {}  # (ip, port) -> result, from the last prefetch()
+        self._lock = threading.Lock()
+        self.stats = {
+            STATUS_NEW: 0,
+            STATUS_STALE: 0,
+            STATUS_REUSED: 0,
+            STATUS_CONFIRMED: 0,
+            STATUS_CHANGED: 0,
+        }
+
+    def recent(self, ip, port):
+        """
+        (previous, status) for (ip, port): the previous result if it is recent
+        enough to rely on, else None with STATUS_NEW or STATUS_STALE.
+        """
+        if self.lookup_many is not None:
+            previous = self._window.pop((ip, port), None)
+        else:
+            previous = self.lookup(ip, port)
+        if previous is None:
+            return None, STATUS_NEW
+        observed = _parse_timestamp(previous.get('timestamp'))
+        if observed is None or (datetime.datetime.utcnow() - observed).total_seconds() > self.max_age:
+            return None, STATUS_STALE
+        return previous, None
+
+    def prefetch(self, pairs):
+        """Look up the previous results of `pairs` (the next recent() calls) in one lookup_many() call."""
+        if self.lookup_many is not None:
+            self._window = self.lookup_many(pairs)
+
+    @staticmethod
+    def reusable(previous):
+        """True if `previous` is a negative result: a TCP connect is enough to confirm it."""
+        return previous.get('classification') in _REUSABLE_CLASSIFICATIONS
+
+    @staticmethod
+    def still_negative(previous, check):
+        """True if `check` (a port check or short probe result) shows what `previous` showed."""
+        if (check.get('sweep') or {}).get('error'):
+            return False  # The connect failed on our side; it confirms nothing
+        return check.get('classification') == previous.get('classification')
+
+    @staticmethod
+    def matches(previous, probe):
+        return result_state(previous) == result_state(probe)
+
+    def annotate(self, res, status, previous=None, checked=False):
+        """Record `status` for `res` (in res['incremental'] and in stats)."""
+        with self._lock:
+            self.stats[status] += 1
+        res['incremental'] = {
+            'status': status,
+            'previous_scan_id': previous.get('scan_id') if previous else None,
+        }
+        if checked:
+            res['incremental']['checked_at'] = datetime.datetime.utcnow().isoformat()
+        return res
+
+    def carry_forward(self, previous, status, checked=False):
+        """A copy of `previous`, annotated; `checked` if a short probe confirmed it."""
+        res = copy.deepcopy(previous)
+        res.pop('scan_id', None)
+        return self.annotate(res, status, previous, checked=checked)
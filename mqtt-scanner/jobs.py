@@ -0,0 +1,218 @@
+"""
+Background scan jobs for the Flask API.
+
+POST /api/scan registers a ScanJob and returns its id straight away; the scan
+itself runs on a bounded executor so several jobs can progress at once
+without any of them holding an HTTP request open.
+
+Every finished probe also lands in a bounded ring of recent results with a
+sequence number, which is what result streams tail (see results_since()).
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from metrics import StageTimings
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_JOBS = int(os.environ.get('SCAN_MAX_CONCURRENT_JOBS', 2))
+MAX_QUEUED_JOBS = int(os.environ.get('SCAN_MAX_QUEUED_JOBS', 20))
+JOB_RETENTION_SECS = int(os.environ.get('SCAN_JOB_RETENTION_SECS', 3600))
+# Recent results kept per job for streams; a stream that falls further behind gets a gap
+STREAM_BUFFER_SIZE = int(os.environ.get('SCAN_STREAM_BUFFER_SIZE', 10000))
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting for an executor slot."""
+
+
+class ScanJob:
+    """State of one scan job; all mutators are thread-safe."""
+
+    def __init__(self, target, params):
+        self.id = f"scan-{uuid.uuid4().hex[:8]}"
+        self.target = target
+        self.params = params
+        self.status = STATUS_QUEUED
+        self.phase = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self.hosts_total = 0
+        self.hosts_done = 0
+        self.ports_per_host = 1
+        self.results = []
+        # Streamed jobs don't keep their results in memory (they are in the result store)
+        self.keep_results = params.get('keep_results', True)
+        self.classification_counts = Counter()
+        # Per-stage latencies of this job's probes (run_scan fills it, see metrics.py)
+        self.timings = StageTimings()
+        self.done = threading.Event()
+
+        self._ports_seen = {}  # ip -> ports finished so far
+        self._recent = deque(maxlen=STREAM_BUFFER_SIZE)
+        self._seq = 0  # results recorded so far; the last one has sequence number _seq - 1
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def set_total(self, hosts_total, ports_per_host):
+        with self._lock:
+            self.hosts_total = hosts_total
+            self.ports_per_host = max(1, ports_per_host)
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+
+    def record_result(self, result):
+        """Called once per finished (ip, port) probe; a host is done when all its ports are."""
+        ip = result.get('ip')
+        with self._lock:
+            # Results are visible while the job runs, in the order they were stored
+            if self.keep_results:
+                self.results.append(result)
+            self._recent.append(result)
+            self._seq += 1
+            self.classification_counts[result.get('classification')] += 1
+            seen = self._ports_seen.get(ip, 0) + 1
+            if seen >= self.ports_per_host:
+                self._ports_seen.pop(ip, None)
+                self.hosts_done += 1
+            else:
+                self._ports_seen[ip] = seen
+            self._changed.notify_all()
+
+    def finish(self, results=None, error=None):
+        with self._lock:
+            if results is not None and self.keep_results:
+                self.results = results
+            self.error = error
+            self.status = STATUS_FAILED if error else STATUS_COMPLETED
+            self.phase = None
+            self.finished_at = time.time()
+            self.done.set()
+            self._changed.notify_all()
+
+    def eta_seconds(self):
+        if self.status != STATUS_RUNNING or not self.hosts_done or not self.started_at:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = max(0, self.hosts_total - self.hosts_done)
+        return round(elapsed / self.hosts_done * remaining, 1)
+
+    def to_status(self):
+        with self._lock:
+            if self.status == STATUS_COMPLETED:
+                progress = 100
+            elif self.hosts_total:
+                progress = int(self.hosts_done * 100 / self.hosts_total)
+            else:
+                progress = 0
+            end = self.finished_at or time.time()
+            return {
+                'job_id': self.id,
+                'target': self.target,
+                'status': self.status,
+                'phase': self.phase,
+                'progress': progress,
+                'hosts_done': self.hosts_done,
+                'hosts_total': self.hosts_total,
+                'results_count': len(self.results) if self.keep_results else self._seq,
+                'eta_seconds': self.eta_seconds(),
+                'elapsed_seconds': round(end - self.started_at, 2) if self.started_at else 0,
+                'created_at': self.created_at,
+                'error': self.error,
+                'timings': self.timings.summary(),
+            }
+
+    def results_since(self, seq, timeout=None):
+        """
+        Results recorded from sequence number `seq` on, waiting up to `timeout`
+        seconds for one if there are none yet. Returns (results, next_seq, missed):
+        missed counts results that already left the stream buffer.
+        """
+        with self._changed:
+            if timeout and self._seq <= seq and not self.done.is_set():
+                self._changed.wait(timeout)
+            first = self._seq - len(self._recent)
+            missed = max(0, first - seq)
+            seq = max(seq, first)
+            return list(islice(self._recent, seq - first, None)), self._seq, missed
+
+    def page(self, page, per_page):
+        """Return (results slice, total) for 1-based `page`."""
+        with self._lock:
+            total = len(self.results)
+            start = (page - 1) * per_page
+            return self.results[start:start + per_page], total
+
+
+class ScanJobManager:
+    """
+    Owns the job table and the executor.
+
+    `runner(job)` does the actual work: it must call job.set_total() once the
+    target size is known, job.record_result() per finished probe, and return
+    the final list of results.
+    """
+
+    def __init__(self, runner, max_concurrent_jobs=MAX_CONCURRENT_JOBS,
+                 max_queued_jobs=MAX_QUEUED_JOBS, retention_secs=JOB_RETENTION_SECS):
+        self.runner = runner
+        self.max_queued_jobs = max_queued_jobs
+        self.retention_secs = retention_secs
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix='scan-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, target, params):
+        with self._lock:
+            self._prune()
+            queued = sum(1 for j in self._jobs.values() if j.status == STATUS_QUEUED)
+            if queued >= self.max_queued_jobs:
+                raise JobQueueFull(f"{queued} scan jobs already queued")
+            job = ScanJob(target, params)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        logger.info(f"Scan job {job.id} queued for target {target}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.status = STATUS_RUNNING
+        job.started_at = time.time()
+        try:
+            results = self.runner(job)
+            job.finish(results=results)
+            logger.info(f"Scan job {job.id} completed with {len(results)} results")
+        except Exception as e:
+            logger.error(f"Scan job {job.id} failed: {e}", exc_info=True)
+            job.finish(error=str(e))
+
+    def counts(self):
+        """Number of known jobs per status."""
+        with self._lock:
+            return Counter(j.status for j in self._jobs.values())
+
+    def _prune(self):
+        """Forget finished jobs older than the retention window (caller holds the lock)."""
+        cutoff = time.time() - self.retention_secs
+        expired = [jid for jid, j in self._jobs.items() if j.finished_at and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
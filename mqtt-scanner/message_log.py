@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Compact append-only capture format for MQTT messages, with indexed replay.
+
+A capture is a directory of segments. Each segment is self-contained:
+
+    header   b'MQLG' + <version u16> + <reserved u16>
+    records  <timestamp_us i64> <topic_id u32> <payload_len u32> <flags u8> <payload>
+
+flags holds the QoS (bits 0-1), the retain flag (bit 2) and bit 3, which
+marks a topic definition: that record's payload is b'<source>\\0<topic>' and
+assigns topic_id for the rest of the segment. Payloads are the raw bytes as
+received; nothing is decoded on the write path.
+
+A segment rotates once it passes max_bytes, and only the newest `segments`
+are kept. When a segment is closed, a sidecar .idx file is written next to
+it. The index holds the offsets of every record per topic and a sparse time
+index (one entry per TIME_INDEX_INTERVAL records). MessageLogReader memory-
+maps the segments and uses the index to jump straight to one topic's records
+or to a point in time. A segment without an index (still being written, or
+left by a crash) is indexed by one scan when it is opened, and a torn last
+record is ignored.
+
+Usage:
+    log = MessageLogWriter('captures/')
+    log.write(msg, source='10.0.0.5:1883')   # anything with topic/payload/qos/retain
+    log.close()
+    for rec in MessageLogReader('captures/').replay(topic='sensors/#', since=t0):
+        rec.timestamp, rec.source, rec.topic, rec.payload, rec.qos, rec.retain
+    python message_log.py captures/ --topic 'sensors/#' --since 2026-01-01T00:00:00
+"""
+import argparse
+import base64
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+MAGIC = b'MQLG'
+INDEX_MAGIC = b'MQIX'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHH')
+_RECORD = struct.Struct('<qIIB')
+_INDEX_HEADER = struct.Struct('<4sHHQqqQII')  # magic, version, reserved, size, first_ts, last_ts, records, topics, time entries
+_INDEX_TOPIC = struct.Struct('<IHHqqI')        # topic_id, source_len, topic_len, first_ts, last_ts, count
+
+FLAG_QOS = 0x03
+FLAG_RETAIN = 0x04
+FLAG_TOPIC_DEF = 0x08
+
+SEGMENT_SUFFIX = '.mqlog'
+INDEX_SUFFIX = '.idx'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+MAX_SEGMENT_BYTES = 0xFFFFFFFF  # Offsets in the index are u32
+TIME_INDEX_INTERVAL = 256
+# Replay of a time window stops this far past `until`, allowing for small clock steps back
+CLOCK_SKEW_US = 5 * 1000000
+
+Record = namedtuple('Record', ['timestamp', 'source', 'topic', 'payload', 'qos', 'retain'])
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT topic filter match ('+' one level, '#' the rest; wildcards never match '$' topics at the root)."""
+    filter_levels, topic_levels = topic_filter.split('/'), topic.split('/')
+    if topic_levels[0].startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class _TopicIndex:
+    __slots__ = ('source', 'topic', 'first_ts', 'last_ts', 'offsets')
+
+    def __init__(self, source, topic):
+        self.source = source
+        self.topic = topic
+        self.first_ts = None
+        self.last_ts = None
+        self.offsets = array('I')
+
+    def add(self, offset, ts):
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        self.offsets.append(offset)
+
+
+class _SegmentIndex:
+    """Per-topic record offsets and a sparse (running max timestamp, offset) time index."""
+
+    def __init__(self):
+        self.topics = {}        # topic_id -> _TopicIndex
+        self.time_ts = array('q')
+        self.time_offsets = array('I')
+        self.first_ts = None
+        self.last_ts = None     # Latest timestamp seen, which is not always the last record's
+        self.records = 0
+        self.size = _HEADER.size
+
+    def define(self, topic_id, source, topic):
+        self.topics[topic_id] = _TopicIndex(source, topic)
+
+    def add(self, topic_id, offset, ts):
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        if self.records % TIME_INDEX_INTERVAL == 0:
+            self.time_ts.append(self.last_ts)
+            self.time_offsets.append(offset)
+        self.records += 1
+        self.topics[topic_id].add(offset, ts)
+
+    def seek_offset(self, since_us):
+        """An offset at or before the first record with timestamp >= since_us."""
+        i = bisect_left(self.time_ts, since_us)
+        return self.time_offsets[i - 1] if i > 0 else _HEADER.size
+
+    def save(self, path):
+        parts = [_INDEX_HEADER.pack(INDEX_MAGIC, VERSION, 0, self.size, self.first_ts or 0, self.last_ts or 0,
+                                    self.records, len(self.topics), len(self.time_ts))]
+        for topic_id, entry in self.topics.items():
+            source, topic = entry.source.encode('utf-8'), entry.topic.encode('utf-8')
+            parts.append(_INDEX_TOPIC.pack(topic_id, len(source), len(topic), entry.first_ts or 0,
+                                           entry.last_ts or 0, len(entry.offsets)))
+            parts += [source, topic, entry.offsets.tobytes()]
+        parts += [self.time_ts.tobytes(), self.time_offsets.tobytes()]
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, segment_size):
+        """The saved index, or None if it is missing or does not cover the segment as it is now."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, _r, size, first_ts, last_ts, records, n_topics, n_time = _INDEX_HEADER.unpack_from(data, 0)
+        except (OSError, struct.error):
+            return None
+        if magic != INDEX_MAGIC or version != VERSION or size != segment_size:
+            return None
+        index = cls()
+        index.size, index.records = size, records
+        index.first_ts, index.last_ts = (first_ts, last_ts) if records else (None, None)
+        pos = _INDEX_HEADER.size
+        for _ in range(n_topics):
+            topic_id, source_len, topic_len, t_first, t_last, count = _INDEX_TOPIC.unpack_from(data, pos)
+            pos += _INDEX_TOPIC.size
+            source = data[pos:pos + source_len].decode('utf-8')
+            pos += source_len
+            topic = data[pos:pos + topic_len].decode('utf-8')
+            pos += topic_len
+            entry = index.topics[topic_id] = _TopicIndex(source, topic)
+            entry.first_ts, entry.last_ts = (t_first, t_last) if count else (None, None)
+            entry.offsets.frombytes(data[pos:pos + 4 * count])
+            pos += 4 * count
+        index.time_ts.frombytes(data[pos:pos + 8 * n_time])
+        pos += 8 * n_time
+        index.time_offsets.frombytes(data[pos:pos + 4 * n_time])
+        return index
+
+
+def _segment_files(directory, prefix):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, n) for n in names if n.startswith(prefix + '-') and n.endswith(SEGMENT_SUFFIX))
+
+
+def _index_path(segment_path):
+    return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+class MessageLogWriter:
+    """
+    Appends messages to size-rotated segments in `directory`, keeping the
+    newest `segments` of them. Writes are buffered; flush() makes them
+    visible to readers, close() (or rotation) also writes the segment index.
+    Thread-safe within one process (append, flush and close take a lock);
+    still one writer per directory, other processes must only read it.
+    """
+
+    def __init__(self, directory, max_bytes=None, segments=20, prefix='messages'):
+        self.directory = directory
+        self.max_bytes = min(max_bytes or DEFAULT_MAX_BYTES, MAX_SEGMENT_BYTES)
+        self.segments = max(1, segments)
+        self.prefix = prefix
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._path = None
+        self._index = None
+        self._topic_ids = {}  # (source, topic) -> topic_id in the current segment
+        self._lock = threading.Lock()
+        self.written = 0
+
+    def _open_segment(self):
+        self._close_segment()
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(self.directory, f'{self.prefix}-{stamp}{SEGMENT_SUFFIX}')
+        n = 0
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(self.directory, f'{self.prefix}-{stamp}-{n}{SEGMENT_SUFFIX}')
+        self._file = open(path, 'wb', buffering=1024 * 1024)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, 0))
+        self._path = path
+        self._index = _SegmentIndex()
+        self._topic_ids = {}
+        for old in _segment_files(self.directory, self.prefix)[:-self.segments]:
+            os.remove(old)
+            if os.path.exists(_index_path(old)):
+                os.remove(_index_path(old))
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._index.save(_index_path(self._path))
+        self._file = None
+
+    def _append(self, ts_us, topic_id, flags, payload):
+        offset = self._index.size
+        self._file.write(_RECORD.pack(ts_us, topic_id, len(payload), flags))
+        self._file.write(payload)
+        self._index.size += _RECORD.size + len(payload)
+        return offset
+
+    def write(self, msg, timestamp=None, source=''):
+        """Append one message (any object with topic, payload, qos and retain)."""
+        ts_us = int((time.time() if timestamp is None else timestamp) * 1000000)
+        payload = bytes(msg.payload)
+        with self._lock:
+            self._write(msg.topic, payload, msg.qos, msg.retain, ts_us, source or '')
+
+    def _write(self, topic, payload, qos, retain, ts_us, source):
+        if self._file is None or (self._index.records and self._index.size + _RECORD.size + len(payload) > self.max_bytes):
+            self._open_segment()
+        key = (source, topic)
+        topic_id = self._topic_ids.get(key)
+        if topic_id is None:
+            topic_id = self._topic_ids[key] = len(self._topic_ids) + 1
+            self._append(ts_us, topic_id, FLAG_TOPIC_DEF, source.encode('utf-8') + b'\0' + topic.encode('utf-8'))
+            self._index.define(topic_id, source, topic)
+        flags = (int(qos) & FLAG_QOS) | (FLAG_RETAIN if retain else 0)
+        offset = self._append(ts_us, topic_id, flags, payload)
+        self._index.add(topic_id, offset, ts_us)
+        self.written += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _Segment:
+    """One memory-mapped segment and its index (loaded from the sidecar, or built by a scan)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if size < _HEADER.size or _HEADER.unpack_from(self.data, 0)[0] != MAGIC:
+            self.index = _SegmentIndex()
+            self.index.size = 0
+            return
+        self.index = _SegmentIndex.load(_index_path(path), size) or self._scan(size)
+
+    def _scan(self, size):
+        index = _SegmentIndex()
+        pos = _HEADER.size
+        while pos + _RECORD.size <= size:
+            ts, topic_id, length, flags = _RECORD.unpack_from(self.data, pos)
+            end = pos + _RECORD.size + length
+            if end > size:
+                break  # Torn write at the tail
+            if flags & FLAG_TOPIC_DEF:
+                source, _sep, topic = bytes(self.data[pos + _RECORD.size:end]).partition(b'\0')
+                index.define(topic_id, source.decode('utf-8'), topic.decode('utf-8'))
+            elif topic_id in index.topics:
+                index.add(topic_id, pos, ts)
+            pos = end
+        index.size = pos
+        return index
+
+    def record_at(self, offset):
+        """(timestamp_us, topic_id, payload, flags) of the record at `offset`."""
+        ts, topic_id, length, flags = _RECORD.unpack_from(self.data, offset)
+        start = offset + _RECORD.size
+        return ts, topic_id, self.data[start:start + length], flags
+
+    def scan_from(self, offset):
+        """(offset, timestamp_us, topic_id) of every message record from `offset` on."""
+        end = self.index.size
+        while offset + _RECORD.size <= end:
+            ts, topic_id, length, flags = _RECORD.unpack_from(self.data, offset)
+            if not flags & FLAG_TOPIC_DEF:
+                yield offset, ts, topic_id
+            offset += _RECORD.size + length
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._file.close()
+
+
+class MessageLogReader:
+    """Replays and queries the segments of a capture directory (see module docstring)."""
+
+    def __init__(self, directory, prefix='messages'):
+        self.directory = directory
+        self.prefix = prefix
+        self._segments = {}  # path -> _Segment; unindexed (active) segments are reopened on each query
+
+    def _segment(self, path):
+        segment = self._segments.get(path)
+        if segment is None or not os.path.exists(_index_path(path)):
+            if segment is not None:
+                segment.close()
+            segment = self._segments[path] = _Segment(path)
+        return segment
+
+    def segments(self):
+        return [self._segment(path) for path in _segment_files(self.directory, self.prefix)]
+
+    def topics(self, source=None):
+        """Every (source, topic) in the capture with its message count and first/last timestamps."""
+        totals = {}
+        for segment in self.segments():
+            for entry in segment.index.topics.values():
+                if source is not None and entry.source != source or not entry.offsets:
+                    continue
+                key = (entry.source, entry.topic)
+                first, last, count = totals.get(key, (entry.first_ts, entry.last_ts, 0))
+                totals[key] = (min(first, entry.first_ts), max(last, entry.last_ts), count + len(entry.offsets))
+        return [{'source': s, 'topic': t, 'count': count, 'first': first / 1e6, 'last': last / 1e6}
+                for (s, t), (first, last, count) in sorted(totals.items())]
+
+    def replay(self, topic=None, source=None, since=None, until=None):
+        """
+        Yield Records in write order, optionally only for topics matching the MQTT
+        filter `topic`, one `source`, and timestamps (epoch seconds) in [since, until].
+        Payloads are bytes copied out of the mapped segment.
+        """
+        since_us = None if since is None else int(since * 1000000)
+        until_us = None if until is None else int(until * 1000000)
+        for segment in self.segments():
+            index = segment.index
+            if not index.records:
+                continue
+            if since_us is not None and index.last_ts < since_us:
+                continue
+            if until_us is not None and index.first_ts > until_us:
+                continue
+            wanted = {topic_id: entry for topic_id, entry in index.topics.items()
+                      if (source is None or entry.source == source)
+                      and (topic is None or topic_matches(topic, entry.topic))}
+            if not wanted:
+                continue
+            yield from self._replay_segment(segment, wanted, len(wanted) < len(index.topics), since_us, until_us)
+
+    @staticmethod
+    def _replay_segment(segment, wanted, by_topic, since_us, until_us):
+        start = segment.index.seek_offset(since_us) if since_us is not None else _HEADER.size
+        if by_topic:
+            # Only the matching topics' records, straight from the index
+            if len(wanted) == 1:
+                offsets = next(iter(wanted.values())).offsets
+            else:
+                offsets = sorted(o for entry in wanted.values() for o in entry.offsets)
+            candidates = ((o, None, None) for o in offsets[bisect_left(offsets, start):])
+        else:
+            candidates = segment.scan_from(start)
+
+        for offset, ts, topic_id in candidates:
+            if ts is None:
+                ts, topic_id, payload, flags = segment.record_at(offset)
+            else:
+                payload = flags = None
+            if since_us is not None and ts < since_us:
+                continue
+            if until_us is not None and ts > until_us:
+                if ts > until_us + CLOCK_SKEW_US:
+                    break
+                continue
+            if payload is None:
+                ts, topic_id, payload, flags = segment.record_at(offset)
+            entry = wanted.get(topic_id)
+            if entry is None:
+                continue
+            yield Record(ts / 1e6, entry.source, entry.topic, bytes(payload), flags & FLAG_QOS, bool(flags & FLAG_RETAIN))
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a message capture as NDJSON.')
+    parser.add_argument('directory')
+    parser.add_argument('--topic', help='MQTT topic filter')
+    parser.add_argument('--source', help='only messages from this broker (host:port)')
+    parser.add_argument('--since', help='epoch seconds or ISO time (UTC)')
+    parser.add_argument('--until', help='epoch seconds or ISO time (UTC)')
+    parser.add_argument('--prefix', default='messages')
+    parser.add_argument('--topics', action='store_true', help='list topics with counts instead')
+    args = parser.parse_args()
+
+    with MessageLogReader(args.directory, prefix=args.prefix) as reader:
+        if args.topics:
+            for entry in reader.topics(source=args.source):
+                sys.stdout.write(json.dumps(entry) + '\n')
+            return
+        for rec in reader.replay(args.topic, args.source, _parse_time(args.since), _parse_time(args.until)):
+            out = {'ts': datetime.datetime.utcfromtimestamp(rec.timestamp).isoformat(), 'source': rec.source,
+                   'topic': rec.topic, 'qos': rec.qos, 'retain': rec.retain}
+            try:
+                out['payload'] = rec.payload.decode('utf-8')
+            except UnicodeDecodeError:
+                out['payload_b64'] = base64.b64encode(rec.payload).decode('ascii')
+            sys.stdout.write(json.dumps(out) + '\n')
+
+
+if __name__ == '__main__':
+    main()
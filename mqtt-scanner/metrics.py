@@ -0,0 +1,248 @@
+"""
+Latency instrumentation for the scan pipeline.
+
+Every probe result carries result['timings']: milliseconds spent per stage
+(the STAGE_* names below; a stage a probe never reached is absent). Scans
+aggregate them in a StageTimings, which keeps count/sum/max per stage and a
+bounded random sample of values for p50/p95/p99, so memory stays flat
+however many results a scan produces.
+
+scan_metrics is the process-wide view behind GET /metrics: running
+schedulers (in-flight probes, queue depth, completion rate), probe totals,
+connection pacing and stage latencies across all scans, in the Prometheus
+text format.
+"""
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Values sampled per stage for percentiles; count, sum and max are always exact
+TIMING_SAMPLE_SIZE = int(os.environ.get('SCAN_TIMING_SAMPLE_SIZE', 10000))
+
+STAGE_PACING = 'pacing'                # Waiting for connection-rate slots (pacing.py)
+STAGE_SWEEP = 'sweep'                  # TCP connect of the port sweep (large scans)
+STAGE_PORT_CHECK = 'port_check'        # TCP pre-check and protocol detection (small scans)
+STAGE_TCP_CONNECT = 'tcp_connect'      # Probe's own TCP connect
+STAGE_TLS_HANDSHAKE = 'tls_handshake'
+STAGE_TLS_ASSESS = 'tls_assess'        # Certificate analysis of the handshake (cert_info)
+STAGE_CONNACK = 'connack'              # CONNECT sent until CONNACK (or timeout)
+STAGE_LISTEN = 'listen'                # Listen window (topics, broker info)
+STAGE_ENRICH = 'enrich'                # Normalise the result for the API and store
+STAGE_PERSIST = 'persist'              # Hand the row to the result store
+STAGE_TOTAL = 'total'                  # Whole probe of one (ip, port), retries included
+STAGES = (STAGE_PACING, STAGE_SWEEP, STAGE_PORT_CHECK, STAGE_TCP_CONNECT, STAGE_TLS_HANDSHAKE, STAGE_TLS_ASSESS,
+          STAGE_CONNACK, STAGE_LISTEN, STAGE_ENRICH, STAGE_PERSIST, STAGE_TOTAL)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def elapsed_ms(started):
+    """Milliseconds since `started` (a time.monotonic() value)."""
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+def to_ms(secs):
+    return round(secs * 1000, 1)
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'max', 'sample')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample = []
+
+
+class StageTimings:
+    """Per-stage latency aggregate (milliseconds); thread-safe."""
+
+    def __init__(self, sample_size=None):
+        self.sample_size = sample_size or TIMING_SAMPLE_SIZE
+        self._stages = {}
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, ms):
+        with self._lock:
+            self._add(stage, ms)
+
+    def add(self, timings):
+        """Fold in one result's timings dict (None is ignored)."""
+        if not timings:
+            return
+        with self._lock:
+            for stage, ms in timings.items():
+                self._add(stage, ms)
+
+    def _add(self, stage, ms):
+        entry = self._stages.get(stage)
+        if entry is None:
+            entry = self._stages[stage] = _Stage()
+        entry.count += 1
+        entry.total += ms
+        entry.max = max(entry.max, ms)
+        if len(entry.sample) < self.sample_size:
+            entry.sample.append(ms)
+        else:
+            # Reservoir sampling: every value so far has the same chance to be in the sample
+            i = self._rng.randrange(entry.count)
+            if i < self.sample_size:
+                entry.sample[i] = ms
+
+    def summary(self):
+        """{stage: {'count', 'mean', 'p50', 'p95', 'p99', 'max'}} in milliseconds."""
+        with self._lock:
+            stages = {stage: (e.count, e.total, e.max, sorted(e.sample)) for stage, e in self._stages.items()}
+        out = {}
+        for stage in sorted(stages, key=_stage_order):
+            count, total, top, sample = stages[stage]
+            out[stage] = {'count': count, 'mean': round(total / count, 1),
+                          **{f'p{int(q * 100)}': _quantile(sample, q) for q in QUANTILES}, 'max': top}
+        return out
+
+    def totals(self):
+        """{stage: (count, sum_ms, sorted sample)} for exporters."""
+        with self._lock:
+            return {stage: (e.count, e.total, sorted(e.sample)) for stage, e in self._stages.items()}
+
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+def _quantile(sorted_values, q):
+    """Nearest-rank quantile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(q * len(sorted_values) + 0.5) - 1))]
+
+
+class ScanMetrics:
+    """
+    Process-wide scan metrics. run_scan registers its scheduler for the
+    duration of the scan (tracking()) and records every result.
+    """
+
+    def __init__(self):
+        self.stages = StageTimings()
+        self.classifications = Counter()
+        self._schedulers = set()
+        self._pacers = set()
+        self._finished = Counter()  # submitted/completed/failed of schedulers (and pacer counts) that are done
+        self.scans_started = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def tracking(self, scheduler, pacer=None):
+        with self._lock:
+            self._schedulers.add(scheduler)
+            if pacer is not None:
+                self._pacers.add(pacer)
+            self.scans_started += 1
+        try:
+            yield scheduler
+        finally:
+            with self._lock:
+                self._schedulers.discard(scheduler)
+                for key in ('submitted', 'completed', 'failed'):
+                    self._finished[key] += scheduler.stats[key]
+                if pacer is not None:
+                    self._pacers.discard(pacer)
+                    self._finished.update(_pacing_counts(pacer))
+
+    def record(self, result):
+        with self._lock:
+            self.classifications[result.get('classification')] += 1
+        self.stages.add(result.get('timings'))
+
+    def snapshot(self):
+        """Current gauges and counters as a dict."""
+        with self._lock:
+            schedulers = list(self._schedulers)
+            pacers = list(self._pacers)
+            totals = Counter(self._finished)
+            classifications = dict(self.classifications)
+            scans_started = self.scans_started
+        gauges = {'scans_running': len(schedulers), 'probes_in_flight': 0, 'probe_queue_depth': 0,
+                  'probe_concurrency_limit': 0, 'probes_per_second': 0.0}
+        for scheduler in schedulers:
+            stats = scheduler.stats
+            for key in ('submitted', 'completed', 'failed'):
+                totals[key] += stats[key]
+            gauges['probes_in_flight'] += stats['in_flight']
+            gauges['probe_queue_depth'] += stats['queue_depth']
+            gauges['probe_concurrency_limit'] += scheduler.max_concurrency
+            gauges['probes_per_second'] += scheduler.throughput()
+        for pacer in pacers:
+            totals.update(_pacing_counts(pacer))
+        return {'gauges': gauges, 'totals': dict(totals), 'classifications': classifications,
+                'scans_started': scans_started}
+
+    def render(self, extra=None):
+        """Prometheus text exposition (version 0.0.4). extra: {name: (type, help, value)} to append."""
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP mqtt_scanner_{name} {help_text}')
+            lines.append(f'# TYPE mqtt_scanner_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f'mqtt_scanner_{name}{{{label_text}}} {value}' if label_text
+                             else f'mqtt_scanner_{name} {value}')
+
+        gauges = snap['gauges']
+        metric('scans_running', 'gauge', 'Scans currently running.', [({}, gauges['scans_running'])])
+        metric('scans_started_total', 'counter', 'Scans started since process start.', [({}, snap['scans_started'])])
+        metric('probes_in_flight', 'gauge', 'Probes currently running.', [({}, gauges['probes_in_flight'])])
+        metric('probe_queue_depth', 'gauge', 'Probe tasks waiting for a worker.', [({}, gauges['probe_queue_depth'])])
+        metric('probe_concurrency_limit', 'gauge', 'Worker slots of running scans.',
+               [({}, gauges['probe_concurrency_limit'])])
+        metric('probes_per_second', 'gauge', 'Completion rate of running scans (average since each started).',
+               [({}, round(gauges['probes_per_second'], 3))])
+        for key in ('submitted', 'completed', 'failed'):
+            metric(f'probes_{key}_total', 'counter', f'Probes {key} since process start.',
+                   [({}, snap['totals'].get(key, 0))])
+        metric('connection_attempts_total', 'counter', 'Connection attempts that went through a scan pacer.',
+               [({}, snap['totals'].get('pacing_connects', 0))])
+        metric('connections_paced_total', 'counter', 'Connection attempts held back by a scan pacer.',
+               [({}, snap['totals'].get('pacing_delayed', 0))])
+        metric('connection_pacing_wait_seconds_total', 'counter', 'Time connection attempts waited for a pacer slot.',
+               [({}, round(snap['totals'].get('pacing_wait_secs', 0.0), 3))])
+        metric('results_total', 'counter', 'Results by classification.',
+               [({'classification': c or 'unknown'}, n) for c, n in sorted(snap['classifications'].items(),
+                                                                          key=lambda i: str(i[0]))])
+        lines.append('# HELP mqtt_scanner_stage_latency_seconds Time spent per probe pipeline stage.')
+        lines.append('# TYPE mqtt_scanner_stage_latency_seconds summary')
+        for stage, (count, total, sample) in sorted(self.stages.totals().items(), key=lambda i: _stage_order(i[0])):
+            stage = _escape(stage)
+            for q in QUANTILES:
+                lines.append(f'mqtt_scanner_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{_seconds(_quantile(sample, q))}')
+            lines.append(f'mqtt_scanner_stage_latency_seconds_sum{{stage="{stage}"}} {_seconds(total)}')
+            lines.append(f'mqtt_scanner_stage_latency_seconds_count{{stage="{stage}"}} {count}')
+        for name, (kind, help_text, value) in (extra or {}).items():
+            metric(name, kind, help_text, [({}, value)])
+        return '\n'.join(lines) + '\n'
+
+
+def _pacing_counts(pacer):
+    stats = pacer.stats
+    return {'pacing_connects': stats['connects'], 'pacing_delayed': stats['delayed'],
+            'pacing_wait_secs': stats['wait_secs']}
+
+
+def _seconds(ms):
+    return 'NaN' if ms is None else round(ms / 1000, 6)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+scan_metrics = ScanMetrics()
@@ -0,0 +1,343 @@
+"""
+Asyncio-native MQTT 3.1.1 client used by the scanner probes.
+
+Speaks CONNECT/CONNACK, SUBSCRIBE/SUBACK, PUBLISH, PINGREQ/PINGRESP and
+DISCONNECT directly over asyncio streams, so thousands of probes can share a
+single event loop instead of each owning a paho network thread.
+"""
+import asyncio
+import itertools
+import os
+import secrets
+import socket
+import struct
+import time
+from collections import namedtuple
+
+from tls_context import tls_contexts
+
+# Packet types (fixed header, upper nibble)
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# CONNACK return codes (MQTT 3.1.1, section 3.2.2.3)
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_CREDENTIALS = 4
+CONNACK_NOT_AUTHORIZED = 5
+CONNACK_CODES = {
+    0: 'Connection Accepted',
+    1: 'Unacceptable protocol version',
+    2: 'Identifier rejected',
+    3: 'Server unavailable',
+    4: 'Bad user name or password',
+    5: 'Not authorized',
+}
+
+MAX_REMAINING_LENGTH = 268435455
+# A packet that has started arriving must finish within this many seconds
+PACKET_STALL_TIMEOUT = float(os.environ.get('SCAN_PACKET_STALL_TIMEOUT', 10))
+
+Message = namedtuple('Message', ['topic', 'payload', 'qos', 'retain'])
+
+
+class MqttProtocolError(Exception):
+    """Raised when the peer sends something that is not valid MQTT."""
+
+
+# --- Client identifiers ---
+
+_ID_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+_ID_COUNTER_WIDTH = 8
+_client_id_counter = itertools.count()  # next() on a count is atomic under the GIL
+_process_tag = None
+
+
+def _base36(value, width):
+    out = []
+    for _ in range(width):
+        value, digit = divmod(value, 36)
+        out.append(_ID_ALPHABET[digit])
+    return ''.join(reversed(out))
+
+
+def _new_process_tag():
+    global _process_tag
+    _process_tag = _base36(secrets.randbits(41), 8)
+
+
+_new_process_tag()
+if hasattr(os, 'register_at_fork'):
+    # A forked worker must not inherit its parent's tag (and counter position)
+    os.register_at_fork(after_in_child=_new_process_tag)
+
+
+def new_client_id(prefix='scanner'):
+    """
+    A client id no other probe uses: prefix + a random per-process tag + a
+    per-process counter, so ids never repeat within a process and differ
+    across processes and hosts. A broker disconnects the older session when
+    a second one connects with the same id, which is what time-based ids did
+    to concurrent probes. With the default prefix the id is 23 characters of
+    [0-9a-z], the most MQTT 3.1.1 requires every broker to accept.
+    """
+    count = next(_client_id_counter) % 36 ** _ID_COUNTER_WIDTH
+    return f'{prefix}{_process_tag}{_base36(count, _ID_COUNTER_WIDTH)}'
+
+
+# --- Packet encoding ---
+
+def encode_remaining_length(length):
+    if length < 0 or length > MAX_REMAINING_LENGTH:
+        raise ValueError(f"Invalid remaining length: {length}")
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def encode_string(value):
+    data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    return struct.pack('!H', len(data)) + data
+
+
+def _packet(packet_type, flags, body):
+    return bytes([(packet_type << 4) | flags]) + encode_remaining_length(len(body)) + body
+
+
+def build_connect(client_id, username=None, password=None, keepalive=10, clean_session=True):
+    flags = 0x02 if clean_session else 0x00
+    payload = encode_string(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += encode_string(username)
+        if password is not None:
+            flags |= 0x40
+            payload += encode_string(password)
+    variable_header = encode_string('MQTT') + bytes([4, flags]) + struct.pack('!H', keepalive)
+    return _packet(CONNECT, 0, variable_header + payload)
+
+
+def build_subscribe(packet_id, filters):
+    """filters: iterable of (topic_filter, qos)"""
+    body = struct.pack('!H', packet_id)
+    for topic_filter, qos in filters:
+        body += encode_string(topic_filter) + bytes([qos])
+    return _packet(SUBSCRIBE, 0x02, body)
+
+
+def build_puback(packet_type, packet_id):
+    flags = 0x02 if packet_type == PUBREL else 0
+    return _packet(packet_type, flags, struct.pack('!H', packet_id))
+
+
+def build_pingreq():
+    return _packet(PINGREQ, 0, b'')
+
+
+def build_disconnect():
+    return _packet(DISCONNECT, 0, b'')
+
+
+# --- Packet decoding ---
+
+async def _read_rest(reader, first):
+    multiplier, length = 1, 0
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MqttProtocolError("Malformed remaining length")
+    body = await reader.readexactly(length) if length else b''
+    return first >> 4, first & 0x0F, body
+
+
+async def read_packet(reader, timeout=None):
+    """
+    Read one packet; returns (packet_type, flags, body). Raises IncompleteReadError on EOF.
+
+    `timeout` only bounds the wait for the packet's first byte (asyncio.TimeoutError),
+    which consumes nothing when cancelled. Once a packet has started it is read to the
+    end, or the connection is given up after PACKET_STALL_TIMEOUT: cancelling halfway
+    would leave the stream out of step, with body bytes read as the next header.
+    """
+    if timeout is None:
+        first = (await reader.readexactly(1))[0]
+    else:
+        first = (await asyncio.wait_for(reader.readexactly(1), max(0.0, timeout)))[0]
+    try:
+        return await asyncio.wait_for(_read_rest(reader, first), PACKET_STALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ConnectionError(f"Broker stalled mid-packet for {PACKET_STALL_TIMEOUT}s") from None
+
+
+def parse_publish(flags, body):
+    """Returns (Message, packet_id or None)."""
+    qos = (flags >> 1) & 0x03
+    retain = bool(flags & 0x01)
+    if len(body) < 2:
+        raise MqttProtocolError("Truncated PUBLISH")
+    topic_len = struct.unpack('!H', body[:2])[0]
+    pos = 2 + topic_len
+    topic = body[2:pos].decode('utf-8', errors='replace')
+    packet_id = None
+    if qos:
+        packet_id = struct.unpack('!H', body[pos:pos + 2])[0]
+        pos += 2
+    return Message(topic, body[pos:], qos, retain), packet_id
+
+
+# --- Client session ---
+
+class MqttSession:
+    """
+    A single MQTT connection driven from the event loop.
+
+    Usage:
+        session = MqttSession(host, port, client_id, ssl_context=ctx)
+        await session.open(timeout=2)
+        rc = await session.connect(timeout=4)
+        await session.subscribe([('#', 0)])
+        msg = await session.next_message(timeout=1)   # None on timeout
+        await session.close()
+    """
+
+    def __init__(self, host, port, client_id, username=None, password=None,
+                 ssl_context=None, keepalive=10):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.ssl_context = ssl_context
+        self.keepalive = keepalive
+        self.reader = None
+        self.writer = None
+        self._next_packet_id = 1
+        self._last_sent = 0.0
+        self.last_received = None  # monotonic time of the last packet from the broker
+        self.connect_time = None
+        self.handshake_time = None
+        self.tls_resumed = None  # True when the broker resumed a cached TLS session (tls_context)
+
+    @property
+    def ssl_object(self):
+        return self.writer.get_extra_info('ssl_object') if self.writer else None
+
+    async def open(self, timeout, handshake_timeout=None):
+        """
+        Open the TCP connection and, if configured, run the TLS handshake on it.
+        `timeout` bounds the TCP connect, `handshake_timeout` the TLS handshake
+        (defaults to `timeout`). Sets self.connect_time / self.handshake_time.
+        The handshake offers the TLS session cached for this host and port, if any.
+        """
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        family, type_, proto, _canon, address = infos[0]
+
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            started = time.monotonic()
+            await asyncio.wait_for(loop.sock_connect(sock, address), timeout)
+            self.connect_time = time.monotonic() - started
+
+            started = time.monotonic()
+            with tls_contexts.resuming(self.host, self.port, self.ssl_context):
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        sock=sock,
+                        ssl=self.ssl_context,
+                        server_hostname=self.host if self.ssl_context else None,
+                    ),
+                    handshake_timeout or timeout,
+                )
+            if self.ssl_context:
+                self.handshake_time = time.monotonic() - started
+                self.tls_resumed = self.ssl_object.session_reused
+        except BaseException:
+            sock.close()
+            raise
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+        self._last_sent = time.monotonic()
+
+    async def connect(self, timeout):
+        """Send CONNECT and wait for CONNACK; returns the CONNACK return code."""
+        await self._send(build_connect(self.client_id, self.username, self.password, self.keepalive))
+        packet_type, _flags, body = await read_packet(self.reader, timeout)
+        self.last_received = time.monotonic()
+        if packet_type != CONNACK or len(body) < 2:
+            raise MqttProtocolError(f"Expected CONNACK, got packet type {packet_type}")
+        return body[1]
+
+    async def subscribe(self, filters):
+        packet_id = self._next_packet_id
+        self._next_packet_id = (self._next_packet_id % 65535) + 1
+        await self._send(build_subscribe(packet_id, filters))
+        return packet_id
+
+    async def next_message(self, timeout):
+        """
+        Wait up to `timeout` seconds for the next PUBLISH.
+        Returns a Message, or None if nothing arrived in time.
+        Control packets (SUBACK, PINGRESP, ...) are consumed transparently.
+        """
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self.keepalive and time.monotonic() - self._last_sent > self.keepalive / 2:
+                await self._send(build_pingreq())
+            try:
+                packet_type, flags, body = await read_packet(self.reader, remaining)
+            except asyncio.TimeoutError:
+                return None
+            self.last_received = time.monotonic()
+
+            if packet_type == PUBLISH:
+                message, packet_id = parse_publish(flags, body)
+                if message.qos == 1:
+                    await self._send(build_puback(PUBACK, packet_id))
+                elif message.qos == 2:
+                    await self._send(build_puback(PUBREC, packet_id))
+                return message
+            if packet_type == PUBREL and len(body) >= 2:
+                await self._send(build_puback(PUBCOMP, struct.unpack('!H', body[:2])[0]))
+            # SUBACK, PINGRESP and anything else need no action
+
+    async def close(self):
+        if self.writer is None:
+            return
+        if self.ssl_context:
+            # Only now: TLS 1.3 brokers send the session ticket after the handshake
+            tls_contexts.remember(self.host, self.port, self.ssl_context, self.ssl_object)
+        try:
+            if not self.writer.is_closing():
+                self.writer.write(build_disconnect())
+            self.writer.close()
+            await asyncio.wait_for(self.writer.wait_closed(), 1)
+        except Exception:
+            pass
+        finally:
+            self.writer = None
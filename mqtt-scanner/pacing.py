@@ -0,0 +1,153 @@
+"""
+Connection-rate pacing for scans.
+
+Concurrency caps (scheduler.py, sweep.py) bound how many connections are open,
+not how fast new ones are started: a /24 scan opens hundreds of connections in
+the first few milliseconds, which trips broker limits (mosquitto's
+max_connections, per-IP rate limits) and firewalls, and the probes that hit
+them come back as false "unreachable" results.
+
+A ConnectionPacer spaces out new connection attempts with two token buckets,
+one for the whole scan and one per destination subnet (/24 for IPv4, /64 for
+IPv6 by default). Each bucket allows `burst` attempts at once and refills at
+`rate` per second; a rate of 0 (or None) leaves that bucket unlimited. Callers
+await pacer.acquire(ip) right before connecting. The wait happens outside any
+connect/handshake timeout, so pacing slows a scan down but never makes a
+target look unreachable.
+
+Buckets are kept as a "theoretical arrival time" (GCRA) instead of a refill
+loop, so a pacer is just arithmetic under a lock: it has no tasks of its own
+and can be shared by the sweep and the probes of a scan.
+
+Usage:
+    pacer = ConnectionPacer(rate=200, burst=50, subnet_rate=20, subnet_burst=10)
+    await pacer.acquire(ip)     # returns the seconds waited
+    sock.connect(...)
+"""
+import asyncio
+import ipaddress
+import os
+import threading
+import time
+
+# Whole scan: new connection attempts per second, and how many may start at once
+CONNECT_RATE = float(os.environ.get('SCAN_CONNECT_RATE', 500))
+CONNECT_BURST = int(os.environ.get('SCAN_CONNECT_BURST', 100))
+# Per destination subnet; well under the brokers' max_connections (50) per burst
+SUBNET_CONNECT_RATE = float(os.environ.get('SCAN_SUBNET_CONNECT_RATE', 50))
+SUBNET_CONNECT_BURST = int(os.environ.get('SCAN_SUBNET_CONNECT_BURST', 25))
+SUBNET_PREFIX_V4 = int(os.environ.get('SCAN_PACING_PREFIX_V4', 24))
+SUBNET_PREFIX_V6 = int(os.environ.get('SCAN_PACING_PREFIX_V6', 64))
+# Idle subnet buckets are dropped once the table grows past this
+MAX_SUBNET_BUCKETS = 4096
+
+
+class TokenBucket:
+    """`burst` tokens refilled at `rate` per second, as a GCRA. Not locked; ConnectionPacer locks."""
+
+    __slots__ = ('rate', 'burst', 'interval', 'tolerance', 'tat')
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate or 0)
+        self.burst = max(1, int(burst or 1))
+        self.interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        self.tolerance = (self.burst - 1) * self.interval
+        self.tat = 0.0  # Theoretical arrival time of the next token
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def earliest(self, now):
+        """Earliest time (>= now) a token is available."""
+        return max(now, self.tat - self.tolerance)
+
+    def take(self, at):
+        """Spend a token at time `at` (no earlier than earliest())."""
+        self.tat = max(self.tat, at) + self.interval
+
+    def idle(self, now):
+        """Full again: dropping the bucket changes nothing."""
+        return self.tat <= now
+
+
+def subnet_of(ip, prefix_v4=SUBNET_PREFIX_V4, prefix_v6=SUBNET_PREFIX_V6):
+    """Pacing key for a destination: its subnet, or the name itself for hostnames."""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    prefix = prefix_v4 if addr.version == 4 else prefix_v6
+    return ipaddress.ip_network((addr, prefix), strict=False)
+
+
+class ConnectionPacer:
+    """Scan-wide and per-subnet token buckets for new connections; thread-safe."""
+
+    def __init__(self, rate=None, burst=None, subnet_rate=None, subnet_burst=None,
+                 prefix_v4=None, prefix_v6=None):
+        self.rate = float((CONNECT_RATE if rate is None else rate) or 0)
+        self.burst = burst or CONNECT_BURST
+        self.subnet_rate = float((SUBNET_CONNECT_RATE if subnet_rate is None else subnet_rate) or 0)
+        self.subnet_burst = subnet_burst or SUBNET_CONNECT_BURST
+        self.prefix_v4 = prefix_v4 or SUBNET_PREFIX_V4
+        self.prefix_v6 = prefix_v6 or SUBNET_PREFIX_V6
+        self._global = TokenBucket(self.rate, self.burst)
+        self._subnets = {}  # subnet -> TokenBucket
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'delayed': 0, 'wait_secs': 0.0, 'max_wait_secs': 0.0}
+
+    @property
+    def enabled(self):
+        return not self._global.unlimited or self.subnet_rate > 0
+
+    def _subnet_bucket(self, ip, now):
+        key = subnet_of(ip, self.prefix_v4, self.prefix_v6)
+        bucket = self._subnets.get(key)
+        if bucket is None:
+            if len(self._subnets) >= MAX_SUBNET_BUCKETS:
+                self._subnets = {k: b for k, b in self._subnets.items() if not b.idle(now)}
+            bucket = self._subnets[key] = TokenBucket(self.subnet_rate, self.subnet_burst)
+        return bucket
+
+    def reserve(self, ip):
+        """Book the next slot for a connection to `ip`; returns how long to wait for it (seconds)."""
+        with self._lock:
+            now = time.monotonic()
+            self.stats['connects'] += 1
+            if not self.enabled:
+                return 0.0
+            subnet = self._subnet_bucket(ip, now) if self.subnet_rate > 0 else None
+            # The first slot both buckets allow; taking it from both keeps them in step
+            at = self._global.earliest(now)
+            if subnet is not None:
+                at = max(at, subnet.earliest(now))
+                subnet.take(at)
+            self._global.take(at)
+            wait = at - now
+            if wait > 0:
+                self.stats['delayed'] += 1
+                self.stats['wait_secs'] += wait
+                self.stats['max_wait_secs'] = max(self.stats['max_wait_secs'], wait)
+            return wait
+
+    async def acquire(self, ip):
+        """Wait for this connection's slot; returns the seconds waited."""
+        wait = self.reserve(ip)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['subnets'] = len(self._subnets)
+        stats['wait_secs'] = round(stats['wait_secs'], 3)
+        stats['max_wait_secs'] = round(stats['max_wait_secs'], 3)
+        stats.update(rate=self.rate, burst=self.burst, subnet_rate=self.subnet_rate, subnet_burst=self.subnet_burst)
+        return stats
+
+    def describe(self):
+        def limit(rate, burst):
+            return f'{rate:g}/s burst {burst}' if rate > 0 else 'unlimited'
+        return f'scan {limit(self.rate, self.burst)}, per subnet {limit(self.subnet_rate, self.subnet_burst)}'
@@ -0,0 +1,140 @@
+"""
+Post-probe stages of a scan job: results flow through bounded queues into
+stages with their own worker threads, so enriching and persisting a result
+starts as soon as its probe finishes and never holds up the probe loop.
+
+    sweep -> probe          one event loop (run_scan: PortSweeper, ScanScheduler)
+          -> enrich         SCAN_ENRICH_WORKERS threads
+          -> persist        SCAN_PERSIST_WORKERS threads
+
+A stage's function returns the item for the next stage, or None to drop it.
+When a stage's queue is full, whoever feeds it blocks (backpressure reaches
+the probe loop instead of memory growing), so a scan's wall time is bounded
+by its slowest probe rather than probes plus post-processing.
+
+Fed from run_scan's event loop, use put_async: a full first queue then parks
+the probe worker that produced the result instead of the whole loop, whose
+in-flight probes would otherwise run into their own deadlines.
+
+Usage:
+    pipeline = ResultPipeline([Stage(STAGE_ENRICH, enrich, ENRICH_WORKERS), Stage(STAGE_PERSIST, persist)],
+                              timings=job.timings, on_output=job.record_result).start()
+    run_scan(..., on_result=pipeline.put_async)
+    pipeline.close()     # drains every stage, then joins the workers
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import scan_metrics, to_ms
+
+logger = logging.getLogger(__name__)
+
+ENRICH_WORKERS = int(os.environ.get('SCAN_ENRICH_WORKERS', 2))
+PERSIST_WORKERS = int(os.environ.get('SCAN_PERSIST_WORKERS', 1))
+# Items waiting per stage before the stage feeding it blocks
+STAGE_QUEUE_SIZE = int(os.environ.get('SCAN_STAGE_QUEUE_SIZE', 1000))
+
+_DONE = object()
+
+
+class Stage:
+    """One pipeline stage: `fn(item)` run by `workers` threads off a bounded queue."""
+
+    def __init__(self, name, fn, workers=1, queue_size=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=queue_size or STAGE_QUEUE_SIZE)
+        self.stats = {'processed': 0, 'dropped': 0, 'failed': 0, 'busy_secs': 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, key, busy):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats['busy_secs'] += busy
+
+
+class ResultPipeline:
+    """
+    Runs items through `stages` in order and hands what comes out of the last
+    one to `on_output` (called from that stage's worker threads). Each stage's
+    processing time is added to the item's own timings (item['timings'][name],
+    in ms), to `timings` (a metrics.StageTimings) and to metrics.scan_metrics.
+    """
+
+    def __init__(self, stages, timings=None, on_output=None):
+        self.stages = list(stages)
+        self.timings = timings
+        self.on_output = on_output
+        self._threads = []
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(stage, next_stage),
+                                          name=f'pipeline-{stage.name}-{n}', daemon=True)
+                thread.start()
+                self._threads.append((stage, thread))
+        return self
+
+    def put(self, item):
+        """Hand an item to the first stage; blocks while that stage's queue is full. Not for event loops."""
+        self.stages[0].queue.put(item)
+
+    async def put_async(self, item):
+        """put() for coroutines: waits for room in the first stage's queue without blocking the loop."""
+        first = self.stages[0].queue
+        try:
+            first.put_nowait(item)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, first.put, item)
+
+    def _work(self, stage, next_stage):
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                return
+            started = time.monotonic()
+            try:
+                out = stage.fn(item)
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed for {item.get('ip')}:{item.get('port')}: {e}",
+                             exc_info=True)
+                stage._count('failed', time.monotonic() - started)
+                continue
+            busy = time.monotonic() - started
+            ms = to_ms(busy)
+            if out is None:
+                stage._count('dropped', busy)
+                continue
+            stage._count('processed', busy)
+            out.setdefault('timings', {})[stage.name] = ms
+            if self.timings is not None:
+                self.timings.add_stage(stage.name, ms)
+            scan_metrics.stages.add_stage(stage.name, ms)
+            if next_stage is not None:
+                next_stage.queue.put(out)
+            elif self.on_output is not None:
+                try:
+                    self.on_output(out)
+                except Exception as e:
+                    logger.error(f"Pipeline output callback failed: {e}")
+
+    def close(self):
+        """Let every stage finish what is queued (in stage order), then stop its workers."""
+        for stage in self.stages:
+            for _ in range(stage.workers):
+                stage.queue.put(_DONE)
+            for owner, thread in self._threads:
+                if owner is stage:
+                    thread.join()
+
+    def stats(self):
+        return {stage.name: {**stage.stats, 'busy_secs': round(stage.stats['busy_secs'], 3),
+                             'queue_depth': stage.queue.qsize(), 'workers': stage.workers}
+                for stage in self.stages}
@@ -0,0 +1,276 @@
+"""
+Persistent result store (SQLite) for scan results.
+
+Every scan appends its rows under its own scan_id, so concurrent scans never
+overwrite each other and history is kept. The columns queries filter on
+(scan, host/port, classification, risk level, timestamp) are real indexed
+columns; the full result row is kept as JSON and only decoded for the rows a
+query actually returns. Reads page by row id (keyset), so a page costs the
+same at row 10 as at row 10 million.
+
+Usage:
+    store = ResultStore()
+    with store.writer(scan_id, target) as w:
+        for row in rows:
+            w.add(row)            # written in batches of STORE_BATCH_SIZE
+    rows, next_cursor = store.query(classification='open_or_auth_ok', limit=100)
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from scan_diff import findings_digest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.environ.get(
+    'SCAN_RESULTS_DB', os.path.join(os.path.dirname(__file__), 'storage', 'scan_results.sqlite3')
+)
+STORE_BATCH_SIZE = int(os.environ.get('SCAN_STORE_BATCH_SIZE', 500))
+MAX_PAGE_SIZE = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    scan_id      TEXT PRIMARY KEY,
+    target       TEXT,
+    started_at   REAL NOT NULL,
+    finished_at  REAL,
+    result_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    scan_id        TEXT NOT NULL,
+    ip             TEXT NOT NULL,
+    port           INTEGER NOT NULL,
+    classification TEXT,
+    risk_level     TEXT,
+    tls            INTEGER,
+    timestamp      TEXT,
+    digest         TEXT,
+    row            TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_scan_host ON results (scan_id, ip, port);
+CREATE INDEX IF NOT EXISTS idx_results_scan ON results (scan_id, id);
+CREATE INDEX IF NOT EXISTS idx_results_host ON results (ip, port);
+CREATE INDEX IF NOT EXISTS idx_results_classification ON results (classification, id);
+CREATE INDEX IF NOT EXISTS idx_results_risk ON results (risk_level, id);
+CREATE INDEX IF NOT EXISTS idx_results_timestamp ON results (timestamp);
+"""
+
+# Query filter name -> SQL condition on the results table
+_FILTERS = {
+    'scan_id': 'scan_id = ?',
+    'ip': 'ip = ?',
+    'port': 'port = ?',
+    'classification': 'classification = ?',
+    'risk_level': 'risk_level = ?',
+    'since': 'timestamp >= ?',
+    'until': 'timestamp < ?',
+}
+
+
+class ResultStore:
+    """SQLite-backed, append-only store of scan result rows; safe to share between threads."""
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {r['name'] for r in conn.execute('PRAGMA table_info(results)')}
+            if 'digest' not in columns:
+                # Stores created before scan diffs; old rows get their digest computed when diffed
+                conn.execute('ALTER TABLE results ADD COLUMN digest TEXT')
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections must not be shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')  # Readers never block the scan writers
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # --- Writing ---
+
+    def writer(self, scan_id, target=None):
+        return ResultWriter(self, scan_id, target)
+
+    def _begin_scan(self, scan_id, target):
+        with self._conn() as conn:
+            conn.execute('INSERT OR IGNORE INTO scans (scan_id, target, started_at) VALUES (?, ?, ?)',
+                         (scan_id, str(target) if target is not None else None, time.time()))
+
+    def _append(self, scan_id, rows):
+        records = [
+            (scan_id, row.get('ip'), int(row.get('port') or 0), row.get('classification'),
+             row.get('risk_level'), 1 if row.get('tls') else 0, row.get('timestamp'),
+             findings_digest(row), json.dumps(row, default=str))
+            for row in rows
+        ]
+        with self._conn() as conn:
+            conn.executemany(
+                'INSERT INTO results (scan_id, ip, port, classification, risk_level, tls, timestamp, digest, row) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+            conn.execute('UPDATE scans SET result_count = result_count + ? WHERE scan_id = ?',
+                         (len(records), scan_id))
+
+    def _finish_scan(self, scan_id):
+        with self._conn() as conn:
+            conn.execute('UPDATE scans SET finished_at = ? WHERE scan_id = ?', (time.time(), scan_id))
+
+    # --- Reading ---
+
+    def latest_scan_id(self):
+        """Most recently finished scan (what the old single CSV report held)."""
+        row = self._conn().execute(
+            'SELECT scan_id FROM scans WHERE finished_at IS NOT NULL '
+            'ORDER BY finished_at DESC LIMIT 1').fetchone()
+        return row['scan_id'] if row else None
+
+    def latest_result(self, ip, port):
+        """The most recently stored row for ip:port across all scans (with its scan_id), or None."""
+        record = self._conn().execute(
+            'SELECT scan_id, row FROM results WHERE ip = ? AND port = ? ORDER BY id DESC LIMIT 1',
+            (ip, int(port))).fetchone()
+        if record is None:
+            return None
+        row = json.loads(record['row'])
+        row['scan_id'] = record['scan_id']
+        return row
+
+    def latest_results(self, ips, ports, chunk_size=400):
+        """
+        latest_result() for every ip x port at once: {(ip, port): row} for the pairs
+        that have a stored row. `ips` is any iterable; it is read in chunks, one
+        query per chunk, so a large range costs a few queries instead of one per pair.
+        """
+        ports = [int(p) for p in ports]
+        port_marks = ','.join('?' * len(ports))
+        latest = {}
+        ips = iter(ips)
+        while True:
+            chunk = [str(ip) for _, ip in zip(range(chunk_size), ips)]
+            if not chunk:
+                return latest
+            records = self._conn().execute(
+                f'SELECT scan_id, ip, port, row FROM results WHERE id IN ('
+                f'SELECT MAX(id) FROM results WHERE ip IN ({",".join("?" * len(chunk))}) '
+                f'AND port IN ({port_marks}) GROUP BY ip, port)', (*chunk, *ports))
+            for record in records:
+                row = json.loads(record['row'])
+                row['scan_id'] = record['scan_id']
+                latest[(record['ip'], record['port'])] = row
+
+    def scan(self, scan_id):
+        row = self._conn().execute(
+            'SELECT scan_id, target, started_at, finished_at, result_count FROM scans WHERE scan_id = ?',
+            (scan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def scan_digests(self, scan_id):
+        """
+        Yield ((ip, port), digest, row_id) for every target of a scan, in (ip, port)
+        order, reading only the index and digest columns (see scan_diff.py).
+        If a target was stored twice in the scan, only its last row is yielded.
+        """
+        cursor = self._conn().execute(
+            'SELECT id, ip, port, digest FROM results WHERE scan_id = ? ORDER BY ip, port, id', (scan_id,))
+        pending = None
+        for record in cursor:
+            key = (record['ip'], record['port'])
+            if pending is not None and pending[0] != key:
+                yield pending
+            digest = record['digest'] or findings_digest(self.row(record['id']))
+            pending = (key, digest, record['id'])
+        if pending is not None:
+            yield pending
+
+    def row(self, row_id):
+        record = self._conn().execute('SELECT row FROM results WHERE id = ?', (row_id,)).fetchone()
+        return json.loads(record['row']) if record else None
+
+    def scans(self, limit=50):
+        rows = self._conn().execute(
+            'SELECT scan_id, target, started_at, finished_at, result_count FROM scans '
+            'ORDER BY started_at DESC LIMIT ?', (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def query(self, limit=500, cursor=None, **filters):
+        """
+        Rows matching `filters` (see _FILTERS; None values are ignored), oldest
+        first, at most `limit` of them, starting after row id `cursor`.
+        Returns (rows, next_cursor); next_cursor is None on the last page.
+        """
+        conditions, params = [], []
+        for name, value in filters.items():
+            if name not in _FILTERS:
+                raise ValueError(f"Unknown filter: {name}")
+            if value is not None:
+                conditions.append(_FILTERS[name])
+                params.append(value)
+        if cursor is not None:
+            conditions.append('id > ?')
+            params.append(int(cursor))
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        sql = 'SELECT id, scan_id, row FROM results'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id LIMIT ?'
+        fetched = self._conn().execute(sql, params + [limit + 1]).fetchall()
+
+        rows = []
+        for record in fetched[:limit]:
+            row = json.loads(record['row'])
+            row['scan_id'] = record['scan_id']
+            rows.append(row)
+        next_cursor = fetched[limit - 1]['id'] if len(fetched) > limit else None
+        return rows, next_cursor
+
+
+class ResultWriter:
+    """Buffers rows for one scan and appends them to the store in batches."""
+
+    def __init__(self, store, scan_id, target=None, batch_size=None):
+        self.store = store
+        self.scan_id = scan_id
+        self.batch_size = batch_size or STORE_BATCH_SIZE
+        self.written = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        store._begin_scan(scan_id, target)
+
+    def add(self, row):
+        with self._lock:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        self.store._append(self.scan_id, batch)
+        self.written += len(batch)
+
+    def close(self):
+        self.flush()
+        self.store._finish_scan(self.scan_id)
+        logger.info(f"Stored {self.written} results for scan {self.scan_id}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Changed-findings report between two stored scans.
+
+Every stored row carries a digest of its findings (the fields below, hashed
+when the row is written), so two scans are compared by walking both in
+(ip, port) order side by side, a single merge pass, and only the rows whose
+digests differ are decoded. Changes are yielded as they are found; unchanged
+targets cost one digest comparison each.
+
+Usage:
+    for change in diff_scans(store, old_scan_id, new_scan_id):
+        ...
+    python scan_diff.py OLD_SCAN_ID [NEW_SCAN_ID] [--db PATH]   # NDJSON on stdout
+"""
+import argparse
+import hashlib
+import json
+import sys
+from collections import Counter
+
+CLOSED = 'closed_or_unreachable'
+# New/removed topics listed per change; the count is always exact
+MAX_LISTED_TOPICS = 50
+
+
+def findings(row):
+    """The parts of a stored row a diff reports on."""
+    return {
+        'classification': row.get('classification'),
+        'risk_level': row.get('risk_level'),
+        'tls': bool(row.get('tls')),
+        'anonymous': bool(row.get('anonymous_allowed')),
+        'cert_fingerprint': row.get('cert_fingerprint'),
+        'cert_expired': bool(row.get('cert_expired')),
+        'topics': sorted({p.get('topic') for p in row.get('publishers') or [] if p.get('topic')}),
+    }
+
+
+def findings_digest(row):
+    """Stable 128-bit digest of findings(row), stored with the row."""
+    encoded = json.dumps(findings(row), sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def _topic_change(kind, topics):
+    return {'type': kind, 'count': len(topics), 'topics': topics[:MAX_LISTED_TOPICS]}
+
+
+def compare_findings(old, new):
+    """List of finding changes between two findings() dicts (either may be None)."""
+    changes = []
+    if old is None:
+        if new['classification'] != CLOSED:
+            changes.append({'type': 'new_service', 'classification': new['classification']})
+        old = {'classification': None, 'risk_level': None, 'tls': new['tls'], 'anonymous': False,
+               'cert_fingerprint': None, 'cert_expired': False, 'topics': []}
+    elif new is None:
+        if old['classification'] != CLOSED:
+            changes.append({'type': 'service_gone', 'classification': old['classification']})
+        return changes
+    else:
+        if old['classification'] != new['classification']:
+            changes.append({'type': 'classification_changed',
+                            'from': old['classification'], 'to': new['classification']})
+        if old['risk_level'] != new['risk_level']:
+            changes.append({'type': 'risk_changed', 'from': old['risk_level'], 'to': new['risk_level']})
+        if old['tls'] != new['tls']:
+            changes.append({'type': 'tls_enabled' if new['tls'] else 'tls_disabled'})
+        if old['cert_fingerprint'] and new['cert_fingerprint'] and old['cert_fingerprint'] != new['cert_fingerprint']:
+            changes.append({'type': 'cert_changed', 'from': old['cert_fingerprint'], 'to': new['cert_fingerprint']})
+
+    if new['anonymous'] and not old['anonymous']:
+        changes.append({'type': 'anonymous_access_new'})
+    elif old['anonymous'] and not new['anonymous']:
+        changes.append({'type': 'anonymous_access_closed'})
+    if new['cert_expired'] and not old['cert_expired']:
+        changes.append({'type': 'cert_expired'})
+
+    old_topics, new_topics = set(old['topics']), set(new['topics'])
+    added = sorted(new_topics - old_topics)
+    removed = sorted(old_topics - new_topics)
+    if added:
+        changes.append(_topic_change('topics_new', added))
+    if removed:
+        changes.append(_topic_change('topics_gone', removed))
+    return changes
+
+
+def _merge(old_iter, new_iter):
+    """Yield (key, old_entry, new_entry) over two (ip, port)-ordered streams."""
+    old_entry, new_entry = next(old_iter, None), next(new_iter, None)
+    while old_entry is not None or new_entry is not None:
+        if new_entry is None or (old_entry is not None and old_entry[0] < new_entry[0]):
+            yield old_entry[0], old_entry, None
+            old_entry = next(old_iter, None)
+        elif old_entry is None or new_entry[0] < old_entry[0]:
+            yield new_entry[0], None, new_entry
+            new_entry = next(new_iter, None)
+        else:
+            yield old_entry[0], old_entry, new_entry
+            old_entry, new_entry = next(old_iter, None), next(new_iter, None)
+
+
+def diff_scans(store, old_scan_id, new_scan_id, stats=None):
+    """
+    Yield one change record per host:port whose findings differ between the two
+    scans: {'ip', 'port', 'change': 'added'|'removed'|'changed', 'findings': [...]}.
+    Targets that are closed in one scan and absent from the other are not reported.
+    If `stats` (a Counter) is given it receives compared/changed totals and a
+    count per finding type.
+    """
+    stats = stats if stats is not None else Counter()
+    for (ip, port), old, new in _merge(store.scan_digests(old_scan_id), store.scan_digests(new_scan_id)):
+        stats['compared'] += 1
+        if old is not None and new is not None and old[1] == new[1]:
+            continue
+        old_findings = findings(store.row(old[2])) if old else None
+        new_findings = findings(store.row(new[2])) if new else None
+        changes = compare_findings(old_findings, new_findings)
+        if not changes:
+            continue
+        stats['changed'] += 1
+        stats.update(c['type'] for c in changes)
+        yield {
+            'ip': ip,
+            'port': port,
+            'change': 'added' if old is None else 'removed' if new is None else 'changed',
+            'findings': changes,
+        }
+
+
+def main():
+    from result_store import ResultStore
+
+    parser = argparse.ArgumentParser(description='Changed findings between two stored scans, as NDJSON.')
+    parser.add_argument('old_scan_id')
+    parser.add_argument('new_scan_id', nargs='?', help='default: the most recently finished scan')
+    parser.add_argument('--db', help='result store path (default SCAN_RESULTS_DB)')
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    new_scan_id = args.new_scan_id or store.latest_scan_id()
+    stats = Counter()
+    for change in diff_scans(store, args.old_scan_id, new_scan_id, stats):
+        sys.stdout.write(json.dumps(change) + '\n')
+    sys.stdout.write(json.dumps({'type': 'summary', 'old_scan_id': args.old_scan_id,
+                                 'new_scan_id': new_scan_id, **stats}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
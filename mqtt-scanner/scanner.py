@@ -1,10 +1,23 @@
+import os
 import ssl
-import socket, time, datetime
-from paho.mqtt import client as mqtt_client
-import threading # Added for concurrent listening
+import socket, struct, time, datetime
 import logging
-import hashlib
-from collections import defaultdict
+import asyncio
+import inspect
+from itertools import islice
+from scheduler import ScanScheduler
+from sweep import PortSweeper, check_port, PORT_OPEN, PORT_CLOSED
+from targets import TargetSet, parse_ports
+from detect import PROTO_TLS, PROTO_HTTP, port_hint, resolve_protocol
+from mqtt_probe import MqttSession, MqttProtocolError, CONNACK_ACCEPTED, CONNACK_BAD_CREDENTIALS, CONNACK_NOT_AUTHORIZED, new_client_id
+from capture import ProbeCapture
+from tls_analysis import new_cert_analysis, assess_ssl_object, cert_info_from_analysis, cert_cache
+from tls_context import tls_contexts
+from pacing import ConnectionPacer
+from timeouts import AdaptiveTimeouts
+from incremental import STATUS_REUSED, STATUS_CONFIRMED, STATUS_CHANGED, INCREMENTAL_LOOKUP_WINDOW
+from metrics import (StageTimings, scan_metrics, elapsed_ms, to_ms, STAGE_SWEEP, STAGE_PORT_CHECK, STAGE_TCP_CONNECT,
+                     STAGE_TLS_HANDSHAKE, STAGE_TLS_ASSESS, STAGE_CONNACK, STAGE_LISTEN, STAGE_TOTAL, STAGE_PACING)
 
 # Configure logging for DevSecOps
 logging.basicConfig(
@@ -13,128 +26,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-COMMON_PORTS = [1883, 8883]
-TIMEOUT = 2
-LISTEN_DURATION = 5 # Seconds to listen for published messages
-
-# --- Store captured messages globally (or pass through context) ---
-# Simple approach for demonstration; consider thread-safe structures for production
-captured_messages = {} # Key: (host, port), Value: list of (topic, client_id_approx)
-capture_lock = threading.Lock()
-
-# Track publishers and subscribers per broker
-broker_clients = {} # Key: (host, port), Value: {'publishers': set(), 'subscribers': set(), 'topics': dict}
-clients_lock = threading.Lock()
-
-def analyze_tls_certificate(host, port, timeout=3):
+# Default port set; a scan can pass its own (see run_scan / parse_ports)
+COMMON_PORTS = parse_ports(os.environ.get('SCAN_PORTS', '1883,8883'))
+TIMEOUT = 2  # TCP connect; with AdaptiveTimeouts only until the subnet's round trips are measured
+CONNACK_WAIT = 4  # Seconds to wait for CONNACK in scan probes; likewise adapted per subnet
+LISTEN_DURATION = 5 # Seconds to listen for published messages (upper bound in adaptive mode)
+
+# --- Listen window ---
+# 'adaptive' ends the window once the retained burst after SUBSCRIBE has been
+# delivered and the broker has been quiet for LISTEN_QUIET_SECS; 'fixed' always
+# listens for the full duration (legacy behaviour).
+LISTEN_MODE_ADAPTIVE = 'adaptive'
+LISTEN_MODE_FIXED = 'fixed'
+LISTEN_MODE = os.environ.get('SCAN_LISTEN_MODE', LISTEN_MODE_ADAPTIVE)
+LISTEN_MIN_SECS = float(os.environ.get('SCAN_LISTEN_MIN_SECS', 0.5))     # Never stop earlier than this
+LISTEN_QUIET_SECS = float(os.environ.get('SCAN_LISTEN_QUIET_SECS', 1.0)) # Silence that ends the window
+LISTEN_MESSAGE_CAP = int(os.environ.get('SCAN_LISTEN_MESSAGE_CAP', 2000)) # Stop after this many messages
+
+# Scans with at least this many (ip, port) pairs get an async TCP sweep first and
+# only open ports are probed; smaller scans let the probe's own connect be the check
+SWEEP_MIN_TARGETS = int(os.environ.get('SCAN_SWEEP_MIN_TARGETS', 32))
+
+# Why a listen window ended (reported as result['listen']['end_reason'])
+LISTEN_END_QUIET = 'quiet'
+LISTEN_END_MAX = 'max_reached'
+LISTEN_END_CAP = 'message_cap'
+LISTEN_END_DISCONNECT = 'disconnected'
+LISTEN_END_PROTOCOL_ERROR = 'protocol_error'
+
+def analyze_tls_certificate(host, port, timeout=3, use_cache=True):
     """
     Enhanced TLS/SSL certificate analysis for DevSecOps.
     Returns detailed certificate information including security assessment.
+
+    Always completes a handshake; the assessment is reused from
+    tls_analysis.cert_cache only if the endpoint still presents the same
+    certificate (SHA-256 fingerprint), TLS version and cipher. Scan probes
+    don't call this, they assess the certificate from their MQTT session's
+    handshake instead.
     """
-    cert_analysis = {
-        'has_tls': False,
-        'cert_valid': False,
-        'cert_details': {},
-        'security_issues': [],
-        'security_score': 0,
-        'error': None
-    }
+    cert_analysis = new_cert_analysis()
 
     try:
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
+        context = tls_contexts.context()
 
         with socket.create_connection((host, port), timeout=timeout) as sock:
-            with context.wrap_socket(sock, server_hostname=host) as ssock:
-                cert_analysis['has_tls'] = True
-
-                # Get certificate in both formats
-                cert_dict = ssock.getpeercert()
-                der_cert = ssock.getpeercert(binary_form=True)
-
-                if cert_dict:
-                    # Extract detailed certificate information
-                    subject = dict(x[0] for x in cert_dict.get('subject', []))
-                    issuer = dict(x[0] for x in cert_dict.get('issuer', []))
-
-                    cert_analysis['cert_details'] = {
-                        'subject': subject,
-                        'issuer': issuer,
-                        'common_name': subject.get('commonName', 'N/A'),
-                        'organization': subject.get('organizationName', 'N/A'),
-                        'valid_from': cert_dict.get('notBefore'),
-                        'valid_to': cert_dict.get('notAfter'),
-                        'serial_number': cert_dict.get('serialNumber'),
-                        'version': cert_dict.get('version'),
-                        'tls_version': ssock.version(),
-                        'cipher': ssock.cipher()
-                    }
-
-                    # Security Assessment
-                    security_score = 100
-
-                    # Check if self-signed
-                    if subject == issuer:
-                        cert_analysis['security_issues'].append('Self-signed certificate detected')
-                        cert_analysis['cert_details']['self_signed'] = True
-                        security_score -= 30
-                    else:
-                        cert_analysis['cert_details']['self_signed'] = False
-
-                    # Check expiration
-                    try:
-                        from datetime import datetime
-                        not_after = datetime.strptime(cert_dict.get('notAfter'), '%b %d %H:%M:%S %Y %Z')
-                        not_before = datetime.strptime(cert_dict.get('notBefore'), '%b %d %H:%M:%S %Y %Z')
-                        now = datetime.utcnow()
-
-                        if now > not_after:
-                            cert_analysis['security_issues'].append('Certificate expired')
-                            cert_analysis['cert_details']['expired'] = True
-                            security_score -= 50
-                        elif now < not_before:
-                            cert_analysis['security_issues'].append('Certificate not yet valid')
-                            cert_analysis['cert_details']['not_yet_valid'] = True
-                            security_score -= 40
-                        else:
-                            cert_analysis['cert_valid'] = True
-                            cert_analysis['cert_details']['expired'] = False
-
-                            # Check if expiring soon (within 30 days)
-                            days_until_expiry = (not_after - now).days
-                            if days_until_expiry < 30:
-                                cert_analysis['security_issues'].append(f'Certificate expires in {days_until_expiry} days')
-                                security_score -= 10
-
-                            cert_analysis['cert_details']['days_until_expiry'] = days_until_expiry
-                    except Exception as date_error:
-                        logger.warning(f"Error parsing certificate dates: {date_error}")
-
-                    # Check cipher strength
-                    cipher_info = ssock.cipher()
-                    if cipher_info:
-                        cipher_name = cipher_info[0]
-                        if any(weak in cipher_name.upper() for weak in ['DES', 'RC4', 'MD5', 'NULL']):
-                            cert_analysis['security_issues'].append(f'Weak cipher detected: {cipher_name}')
-                            security_score -= 20
-
-                    # Check TLS version
-                    tls_version = ssock.version()
-                    if tls_version in ['SSLv2', 'SSLv3', 'TLSv1', 'TLSv1.1']:
-                        cert_analysis['security_issues'].append(f'Outdated TLS version: {tls_version}')
-                        security_score -= 25
-
-                    # Calculate fingerprint
-                    if der_cert:
-                        cert_analysis['cert_details']['fingerprint_sha256'] = hashlib.sha256(der_cert).hexdigest()
-                        cert_analysis['cert_details']['fingerprint_sha1'] = hashlib.sha1(der_cert).hexdigest()
-
-                        # Store PEM for reference
-                        pem_cert = ssl.DER_cert_to_PEM_cert(der_cert)
-                        cert_analysis['cert_details']['pem_snippet'] = pem_cert[:500]
-
-                    cert_analysis['security_score'] = max(0, security_score)
+            with tls_contexts.resuming(host, port, context):
+                ssock = context.wrap_socket(sock, server_hostname=host)
+            with ssock:
+                if use_cache:
+                    assess_ssl_object(ssock, cert_analysis, host, port)
+                else:
+                    assess_ssl_object(ssock, cert_analysis)
+                tls_contexts.remember(host, port, context, ssock)
 
     except ssl.SSLError as e:
         cert_analysis['error'] = f'SSL error: {str(e)}'
@@ -161,19 +105,21 @@ def categorize_outcome(result):
     tls_error = result.get('tls_analysis', {}).get('error') if result.get('tls_analysis') else None
     requires_auth = result.get('security_assessment', {}).get('requires_auth', False)
 
-    # Connected (1883) - plaintext connection
-    if port == 1883 and classification == 'open_or_auth_ok':
+    is_tls = result.get('tls', port == 8883)
+
+    # Connected (1883) - plaintext connection, on whatever port it was found
+    if not is_tls and classification == 'open_or_auth_ok':
         return (
-            "Connected (1883)",
+            f"Connected ({port})",
             "Broker accepts connection on plaintext port",
-            "Successful MQTT connect on port 1883",
+            f"Successful MQTT connect on port {port}",
             "High risk, traffic is unencrypted and may allow eavesdropping"
         )
 
     # Connected (8883) - TLS connection
-    if port == 8883 and classification == 'open_or_auth_ok' and has_tls_analysis:
+    if is_tls and classification == 'open_or_auth_ok' and has_tls_analysis:
         return (
-            "Connected (8883)",
+            f"Connected ({port})" if port == 8883 else f"Connected ({port}, TLS)",
             "Broker accepts connection over TLS",
             "Successful TLS handshake and MQTT connect",
             "Potentially safer, must still verify certificate and auth"
@@ -215,6 +161,15 @@ def categorize_outcome(result):
             "Target cannot be reached for further testing"
         )
 
+    # Non-MQTT service (HTTP/WebSocket listener)
+    if classification == 'non_mqtt_service':
+        return (
+            "Non-MQTT Service",
+            "Port is open but speaks another protocol",
+            f"Protocol detection: {result.get('protocol')}",
+            "Possible MQTT over WebSockets endpoint, verify manually"
+        )
+
     # Unknown/Other
     return (
         "Unknown",
@@ -223,7 +178,109 @@ def categorize_outcome(result):
         "Requires manual investigation"
     )
 
-def try_mqtt_connect(host, port, use_tls=False, username=None, password=None, wait_secs=6):
+def _is_auth_failure(rc):
+    return rc in (CONNACK_BAD_CREDENTIALS, CONNACK_NOT_AUTHORIZED)
+
+async def _listen(session, on_message, max_secs, mode=None):
+    """
+    Feed messages from `session` to `on_message` until the listen window ends.
+
+    Fixed mode listens for `max_secs`. Adaptive mode stops once nothing has
+    arrived for LISTEN_QUIET_SECS (retained messages are sent straight after
+    SUBACK, so an idle broker goes quiet almost immediately), but never before
+    LISTEN_MIN_SECS and never after `max_secs`; it also stops after
+    LISTEN_MESSAGE_CAP messages. Returns a summary dict with the end_reason;
+    if the broker dropped the session mid-window, 'disconnect' says when and how,
+    and if it sent a packet that could not be parsed, 'protocol_error' does.
+    """
+    mode = mode or LISTEN_MODE
+    adaptive = mode != LISTEN_MODE_FIXED
+    started = time.monotonic()
+    hard_end = started + max_secs
+    min_end = started + min(LISTEN_MIN_SECS, max_secs)
+    last_message = started
+    messages = retained = 0
+    end_reason = LISTEN_END_MAX
+    disconnect = protocol_error = None
+
+    while True:
+        now = time.monotonic()
+        deadline = hard_end
+        if adaptive:
+            deadline = min(hard_end, max(min_end, last_message + LISTEN_QUIET_SECS))
+        if now >= deadline:
+            if deadline < hard_end:
+                end_reason = LISTEN_END_QUIET
+            break
+        try:
+            msg = await session.next_message(deadline - now)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            end_reason = LISTEN_END_DISCONNECT
+            disconnect = {
+                'after_secs': round(time.monotonic() - started, 3),
+                'messages_before': messages,
+                'cause': 'connection_reset' if isinstance(e, ConnectionResetError) else 'closed_by_broker',
+            }
+            break
+        except (MqttProtocolError, struct.error) as e:
+            # The stream is out of step after a malformed packet; keep what arrived before it
+            end_reason = LISTEN_END_PROTOCOL_ERROR
+            protocol_error = {
+                'after_secs': round(time.monotonic() - started, 3),
+                'messages_before': messages,
+                'error': str(e) if isinstance(e, MqttProtocolError) else f'truncated packet ({e})',
+            }
+            break
+        if msg is None:
+            continue # Deadline reached; the check at the top decides why
+        messages += 1
+        retained += msg.retain
+        last_message = time.monotonic()
+        on_message(msg)
+        if adaptive and messages >= LISTEN_MESSAGE_CAP:
+            end_reason = LISTEN_END_CAP
+            break
+
+    summary = {
+        'mode': LISTEN_MODE_ADAPTIVE if adaptive else LISTEN_MODE_FIXED,
+        'end_reason': end_reason,
+        'duration': round(time.monotonic() - started, 3),
+        'messages': messages,
+        'retained_messages': retained,
+    }
+    if disconnect is not None:
+        summary['disconnect'] = disconnect
+    if protocol_error is not None:
+        summary['protocol_error'] = protocol_error
+    return summary
+
+async def async_try_mqtt_connect(host, port, use_tls=None, username=None, password=None, wait_secs=6,
+                                 listen_secs=None, capture_all=True, listen_mode=None, pacer=None, timeouts=None):
+    """
+    Probe one broker over a single connection: one TCP connect, at most one TLS
+    handshake (whose certificate and cipher feed tls_analysis/cert_info), one
+    MQTT session subscribed to # and $SYS/#, and one listen window that fills
+    publishers, topics_discovered and broker_info together.
+
+    use_tls: True/False as detected for this port; None falls back to the
+    port hint (detect.TLS_PORT_HINTS).
+
+    `listen_secs` (default LISTEN_DURATION) is the longest the window may run;
+    with listen_mode 'adaptive' (the default, see LISTEN_MODE) it usually ends
+    much sooner, see _listen().
+
+    result['timings'] has the milliseconds spent in each stage the probe
+    reached (metrics.STAGE_*). TLS probes also get result['tls_session']
+    ({'resumed': bool}): whether the broker resumed the session cached from
+    an earlier connection (tls_context.py).
+
+    pacer (a pacing.ConnectionPacer) holds the connect back until its slot;
+    the wait counts towards no timeout. timeouts (a timeouts.AdaptiveTimeouts)
+    turns the TCP connect timeout (TIMEOUT) and the CONNACK wait (wait_secs)
+    into deadlines learnt for the host's subnet, and learns from this probe;
+    the deadlines used are reported in result['deadlines'].
+    """
+    is_tls = port_hint(port) == PROTO_TLS if use_tls is None else bool(use_tls)
     result = {
         'ip': host,
         'port': port,
@@ -237,200 +294,135 @@ def try_mqtt_connect(host, port, use_tls=False, username=None, password=None, wa
         'security_assessment': {
             'anonymous_allowed': False,
             'requires_auth': False,
-            'port_type': 'insecure' if port == 1883 else 'secure'
+            'port_type': 'secure' if is_tls else 'insecure'
         }
     }
-    client = None
-    client_id = f"scanner-{int(time.time())}" # Use this client_id
-
-    # Track message statistics
-    message_stats = defaultdict(lambda: {'count': 0, 'publishers': set(), 'last_payload_size': 0})
+    session = None
+    client_id = new_client_id()  # Unique per probe, so concurrent probes never take over each other's session
+    listen_secs = LISTEN_DURATION if listen_secs is None else listen_secs
+    result['tls'] = is_tls
+    timings = result['timings'] = {}
 
-    # Add TLS analysis for secure ports
-    if use_tls or port == 8883:
-        logger.info(f"Analyzing TLS certificate for {host}:{port}")
-        result['tls_analysis'] = analyze_tls_certificate(host, port)
+    capture = ProbeCapture(host, port, capture_all=capture_all)
 
     try:
-        # Handle both paho-mqtt v1.x and v2.x compatibility
-        try:
-            # Try paho-mqtt 2.x style first
-            client = mqtt_client.Client(client_id=client_id, callback_api_version=mqtt_client.CallbackAPIVersion.VERSION2)
-        except (AttributeError, TypeError):
-            # Fall back to paho-mqtt 1.x style
-            client = mqtt_client.Client(client_id=client_id)
-
-        if username:
-            client.username_pw_set(username, password)
-
-        if use_tls or port == 8883:
+        ssl_context = None
+        if is_tls:
             logger.info(f"Setting up TLS for {host}:{port}")
-            try:
-                ctx = ssl.create_default_context()
-                ctx.check_hostname = False
-                ctx.verify_mode = ssl.CERT_NONE
-                client.tls_set_context(ctx)
-                logger.info(f"TLS context set for {host}:{port}")
-            except AttributeError:
-                # Fallback for older paho-mqtt versions
-                try:
-                    client.tls_set(cert_reqs=ssl.CERT_NONE)
-                    client.tls_insecure_set(True)
-                    logger.info(f"TLS set (legacy mode) for {host}:{port}")
-                except Exception as tls_e:
-                    logger.error(f"TLS setup failed for {host}:{port}: {tls_e}")
-            except Exception as tls_e:
-                logger.error(f"TLS context setup failed for {host}:{port}: {tls_e}")
+            ssl_context = tls_contexts.context()  # Shared; offers the session cached for host:port
+            result['tls_analysis'] = new_cert_analysis()
+
+        session = MqttSession(host, port, client_id, username=username, password=password,
+                              ssl_context=ssl_context, keepalive=10)
+        if pacer is not None:
+            timings[STAGE_PACING] = to_ms(await pacer.acquire(host))
+        connect_timeout, connack_timeout = TIMEOUT, wait_secs
+        if timeouts is not None:
+            connect_timeout = timeouts.connect_timeout(host, TIMEOUT)
+            connack_timeout = timeouts.connack_timeout(host, wait_secs)
+            result['deadlines'] = {'connect': round(connect_timeout, 3), 'connack': round(connack_timeout, 3)}
+        try:
+            await session.open(timeout=connect_timeout, handshake_timeout=wait_secs)
+        except (ssl.SSLError, asyncio.TimeoutError) as tls_e:
+            if is_tls and session.connect_time is not None:
+                # TCP worked but the handshake did not
+                result['tls_analysis']['error'] = f'SSL error: {tls_e}' if isinstance(tls_e, ssl.SSLError) else 'Handshake timeout'
+                result['cert_info'] = cert_info_from_analysis(result['tls_analysis'])
+            raise
+        finally:
+            if session.connect_time is not None:
+                timings[STAGE_TCP_CONNECT] = to_ms(session.connect_time)
+                if timeouts is not None:
+                    timeouts.observe_connect(host, session.connect_time)
+            if session.handshake_time is not None:
+                timings[STAGE_TLS_HANDSHAKE] = to_ms(session.handshake_time)
+
+        if is_tls:
+            result['tls_session'] = {'resumed': session.tls_resumed}
+            # Certificate, protocol and cipher come from this session's own handshake
+            # (a resumed handshake still carries the certificate)
+            started = time.monotonic()
+            assess_ssl_object(session.ssl_object, result['tls_analysis'], host=host, port=port)
+            result['cert_info'] = cert_info_from_analysis(result['tls_analysis'])
+            timings[STAGE_TLS_ASSESS] = elapsed_ms(started)
+        else:
+            result['cert_info'] = {'error': 'Not a TLS port'}
 
         connected = False
         last_rc = None
         connect_error = None
-        sys_clients_detected = set()
-
-        def on_connect(c, userdata, flags, rc, properties=None):
-            nonlocal connected, last_rc, connect_error
-            last_rc = rc
-            # Handle both numeric and string return codes (paho-mqtt v1 vs v2)
-            rc_value = rc if isinstance(rc, int) else str(rc)
-            is_success = (rc == 0 or rc_value == 0 or str(rc_value).lower() == "success")
-            is_auth_failure = (rc == 5 or rc_value == 5 or "not authorized" in str(rc_value).lower() or "authoris" in str(rc_value).lower())
-
-            if is_success:
-                connected = True
-                # Check if anonymous connection succeeded
-                if username is None:
-                    result['security_assessment']['anonymous_allowed'] = True
-                    logger.warning(f"[SECURITY] Anonymous access allowed on {host}:{port}")
-                else:
-                    result['security_assessment']['requires_auth'] = True
-
-                # Register ourselves as a subscriber
-                result['subscribers'].append({
-                    'client_id': client_id,
-                    'note': 'Scanner client (this connection)'
-                })
 
-                try:
-                    # Subscribe to all topics upon successful connection
-                    c.subscribe("#", qos=0)
-                    # Subscribe to $SYS topics to detect other clients
-                    c.subscribe("$SYS/broker/clients/#", qos=0)
-                    c.subscribe("$SYS/broker/subscriptions/#", qos=0)
-                    logger.info(f"[{host}:{port}] Successfully subscribed to # and $SYS topics")
-                except Exception as sub_e:
-                    logger.error(f"[{host}:{port}] Error subscribing: {sub_e}")
+        started = time.monotonic()
+        try:
+            last_rc = await session.connect(timeout=connack_timeout)
+            if timeouts is not None:
+                timeouts.observe_connack(host, time.monotonic() - started)
+        except asyncio.TimeoutError:
+            pass # No CONNACK within the deadline
+        timings[STAGE_CONNACK] = elapsed_ms(started)
+
+        if last_rc == CONNACK_ACCEPTED:
+            connected = True
+            # Check if anonymous connection succeeded
+            if username is None:
+                result['security_assessment']['anonymous_allowed'] = True
+                logger.warning(f"[SECURITY] Anonymous access allowed on {host}:{port}")
             else:
-                connect_error = f"Connection failed with code {rc}"
-                if is_auth_failure:
-                    result['security_assessment']['requires_auth'] = True
-                    logger.info(f"[{host}:{port}] Authentication required (rc={rc})")
-
-        def on_message(c, userdata, msg):
-            nonlocal sys_clients_detected
-            try:
-                topic = msg.topic
-                payload = msg.payload.decode('utf-8', errors='replace')
-
-                # Track topics and messages
-                message_stats[topic]['count'] += 1
-                message_stats[topic]['last_payload_size'] = len(msg.payload)
-
-                # Detect publishers from $SYS topics
-                if topic.startswith('$SYS/broker/clients/'):
-                    # Extract client ID from $SYS topics
-                    parts = topic.split('/')
-                    if len(parts) >= 4:
-                        client_info = parts[3]
-                        sys_clients_detected.add(client_info)
-                        logger.debug(f"Detected client from $SYS: {client_info}")
-
-                # Track regular topics (non-$SYS)
-                if not topic.startswith('$SYS/'):
-                    publisher_info = {
-                        'topic': topic,
-                        'payload': payload[:500],  # Store actual payload (first 500 chars)
-                        'payload_size': len(msg.payload),
-                        'qos': msg.qos,
-                        'retained': msg.retain,
-                        'message_count': 1,
-                        'client_id_note': 'Unknown - MQTT v3.x limitation'
-                    }
-
-                    # Store unique topics
-                    if topic not in result['topics_discovered']:
-                        result['topics_discovered'][topic] = {
-                            'first_seen': datetime.datetime.utcnow().isoformat(),
-                            'message_count': 0,
-                            'publishers': []
-                        }
-
-                    result['topics_discovered'][topic]['message_count'] += 1
-
-                    # Update existing publisher info or add new one
-                    existing_pub = None
-                    for pub in result['publishers']:
-                        if pub['topic'] == topic:
-                            existing_pub = pub
-                            break
-
-                    if existing_pub:
-                        # Update existing publisher with latest payload
-                        existing_pub['payload'] = payload[:500]
-                        existing_pub['message_count'] = existing_pub.get('message_count', 0) + 1
-                        existing_pub['payload_size'] = len(msg.payload)
-                    else:
-                        # Add new publisher
-                        result['publishers'].append(publisher_info)
-                        logger.info(f"[{host}:{port}] Detected publisher on topic: {topic}")
-
-                # Store in global captured_messages for compatibility
-                key = (host, port)
-                with capture_lock:
-                    if key not in captured_messages:
-                        captured_messages[key] = []
-                    msg_info = {'topic': topic, 'payload': payload[:100]}
-                    if msg_info not in captured_messages[key]:
-                        captured_messages[key].append(msg_info)
-
-            except Exception as msg_e:
-                logger.error(f"Error processing message on {host}:{port}: {msg_e}")
-
-        client.on_connect = on_connect
-        client.on_message = on_message # Add message callback
-
-        # Blocking connect might time out before on_connect is called if server is slow/unresponsive
-        # Use connect_async and loop_start for better handling
-        client.connect(host, port, keepalive=10) # Use keepalive > listen duration
-        client.loop_start()
-
-        # Wait for connection or timeout
-        connect_timeout = time.time() + wait_secs
-        while time.time() < connect_timeout and not connected and connect_error is None:
-            time.sleep(0.1)
+                result['security_assessment']['requires_auth'] = True
+
+            # Register ourselves as a subscriber
+            result['subscribers'].append({
+                'client_id': client_id,
+                'note': 'Scanner client (this connection)'
+            })
+
+            # Subscribe to all topics, plus $SYS for broker info and other clients
+            await session.subscribe([('#', 0), ('$SYS/#', 0)])
+            logger.info(f"[{host}:{port}] Successfully subscribed to # and $SYS/#")
+        elif last_rc is not None:
+            connect_error = f"Connection failed with code {last_rc}"
+            if _is_auth_failure(last_rc):
+                result['security_assessment']['requires_auth'] = True
+                logger.info(f"[{host}:{port}] Authentication required (rc={last_rc})")
 
         if connected:
             result['result'] = 'connected'
             result['classification'] = 'open_or_auth_ok'
 
-            # Listen for messages for a specified duration
-            listen_end_time = time.time() + LISTEN_DURATION
-            while time.time() < listen_end_time:
-                time.sleep(0.2)
+            def on_message(msg):
+                try:
+                    capture.add(msg)
+                except Exception as msg_e:
+                    logger.error(f"Error processing message on {host}:{port}: {msg_e}")
+
+            started = time.monotonic()
+            result['listen'] = await _listen(session, on_message, listen_secs, listen_mode)
+            timings[STAGE_LISTEN] = elapsed_ms(started)
+            if result['listen']['end_reason'] == LISTEN_END_DISCONNECT:
+                # Our id is unique, so this is the broker's doing: another client taking over
+                # the session, a connection limit or an ACL, not one of our own probes
+                disconnect = result['listen']['disconnect']
+                logger.warning(f"[{host}:{port}] Broker dropped session {client_id} {disconnect['after_secs']}s "
+                               f"into the listen window ({disconnect['cause']}, "
+                               f"{disconnect['messages_before']} messages received)")
+            elif result['listen']['end_reason'] == LISTEN_END_PROTOCOL_ERROR:
+                protocol_error = result['listen']['protocol_error']
+                logger.warning(f"[{host}:{port}] Malformed packet {protocol_error['after_secs']}s into the listen "
+                               f"window ({protocol_error['error']}, {protocol_error['messages_before']} messages received)")
 
             # Add detected $SYS clients to subscribers list
-            for client_info in sys_clients_detected:
+            for client_info in capture.sys_clients:
                 if client_info != client_id:  # Don't include ourselves
                     result['subscribers'].append({
                         'client_id': client_info,
                         'detected_via': '$SYS topics'
                     })
 
-            # Retrieve captured messages for this host/port (for backward compatibility)
-            key = (host, port)
-            with capture_lock:
-                if key in captured_messages:
-                    # Already stored in result['publishers'], just clean up
-                    del captured_messages[key]
+            # publishers, topics_discovered, broker_info and the capture counters
+            capture.finish(result)
+            if result['capture']['sampled']:
+                logger.info(f"[{host}:{port}] Topic capture sampled: kept {result['capture']['topics_kept']} "
+                            f"of ~{result['capture']['topics_seen']} topics")
 
             # Generate security summary
             result['security_summary'] = generate_security_summary(result, port, username)
@@ -440,15 +432,11 @@ def try_mqtt_connect(host, port, use_tls=False, username=None, password=None, wa
             if connect_error:
                 result['result'] += f' ({connect_error})'
             if last_rc is not None:
-                # Handle both numeric and string return codes
-                rc_value = last_rc if isinstance(last_rc, int) else str(last_rc)
-                is_auth_failure = (last_rc == 5 or rc_value == 5 or "not authorized" in str(rc_value).lower() or "authoris" in str(rc_value).lower())
-
-                result['classification'] = 'not_authorized' if is_auth_failure else 'not_authorized_or_unreachable'
+                result['classification'] = 'not_authorized' if _is_auth_failure(last_rc) else 'not_authorized_or_unreachable'
             else:
                  result['classification'] = 'connect_timeout_or_unreachable' # More specific if no RC received
 
-    except socket.timeout:
+    except (socket.timeout, asyncio.TimeoutError):
         result['result'] = 'error:socket_timeout'
         result['classification'] = 'closed_or_unreachable'
     except ConnectionRefusedError:
@@ -468,29 +456,28 @@ def try_mqtt_connect(host, port, use_tls=False, username=None, password=None, wa
         else:
             result['classification'] = 'closed_or_unreachable'
     finally:
-        try:
-            if client is not None:
-                client.loop_stop()
-                client.disconnect()
-        except: pass
+        if session is not None:
+            await session.close()
 
     # Log security findings
     if result.get('security_assessment', {}).get('anonymous_allowed'):
         logger.warning(f"[SECURITY RISK] {host}:{port} allows anonymous access")
-    if port == 1883 and result.get('classification') == 'open_or_auth_ok':
+    if not is_tls and result.get('classification') == 'open_or_auth_ok':
         logger.warning(f"[SECURITY RISK] {host}:{port} using insecure port (no TLS)")
 
     # Add outcome categorization
-    outcome_label, meaning, evidence, security_implication = categorize_outcome(result)
-    result['outcome'] = {
-        'label': outcome_label,
-        'meaning': meaning,
-        'evidence_signal': evidence,
-        'security_implication': security_implication
-    }
+    result['outcome'] = build_outcome(result)
 
     return result
 
+def try_mqtt_connect(host, port, use_tls=None, username=None, password=None, wait_secs=6,
+                     listen_secs=None, capture_all=True, listen_mode=None, pacer=None, timeouts=None):
+    """Blocking wrapper around async_try_mqtt_connect for scripts and single-host callers."""
+    return asyncio.run(async_try_mqtt_connect(host, port, use_tls=use_tls, username=username,
+                                              password=password, wait_secs=wait_secs,
+                                              listen_secs=listen_secs, capture_all=capture_all,
+                                              listen_mode=listen_mode, pacer=pacer, timeouts=timeouts))
+
 def generate_security_summary(result, port, username):
     """
     Generate a security summary for DevSecOps reporting.
@@ -502,8 +489,8 @@ def generate_security_summary(result, port, username):
     }
 
     # Check port security
-    if port == 1883:
-        summary['issues'].append('Using insecure port (1883) - no encryption')
+    if not result.get('tls'):
+        summary['issues'].append(f'Using insecure port ({port}) - no encryption')
         summary['recommendations'].append('Migrate to port 8883 with TLS/SSL')
         summary['risk_level'] = 'HIGH'
 
@@ -523,8 +510,8 @@ def generate_security_summary(result, port, username):
     if tls_analysis and tls_analysis.get('cert_details', {}).get('self_signed'):
         summary['recommendations'].append('Use certificates signed by a trusted CA')
 
-    # Check for exposed topics
-    topics_count = len(result.get('topics_discovered', {}))
+    # Check for exposed topics (topics_seen counts topics beyond the capture sample too)
+    topics_count = result.get('capture', {}).get('topics_seen', len(result.get('topics_discovered', {})))
     if topics_count > 0:
         summary['issues'].append(f'{topics_count} active topics detected')
         summary['recommendations'].append('Review topic ACLs and implement proper authorization')
@@ -537,120 +524,372 @@ def generate_security_summary(result, port, username):
     return summary
 
 
-def scan_ip(ip, creds=None):
-    results = []
-    for p in COMMON_PORTS:
-        s = None # Initialize s
-        try:
-            # Quick check if port is open before attempting MQTT connection
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(TIMEOUT)
-            s.connect((ip, p))
-            s.close() # Port is open, proceed with MQTT connect attempt
-
-            is_tls = (p == 8883)
-            # First try anonymous (no creds)
-            res = try_mqtt_connect(ip, p, use_tls=is_tls, wait_secs=4)
-
-            # If anonymous failed and creds provided, try with credentials
-            # Only retry if the failure seems auth-related or requires TLS negotiation that might succeed with creds
-            retry_needed = res['classification'] in ['not_authorized', 'tls_or_ssl_error', 'not_authorized_or_unreachable', 'connect_timeout_or_unreachable']
-
-            if retry_needed and creds:
-                print(f"Retrying {ip}:{p} with credentials...")
-                res_with_creds = try_mqtt_connect(ip, p, use_tls=is_tls, username=creds.get('user'), password=creds.get('pass'), wait_secs=4)
-                # Prefer positive result or more specific error
-                if res_with_creds['classification'] == 'open_or_auth_ok' or res['classification'] == 'unknown':
-                     res = res_with_creds
-                # If both failed, keep the potentially more informative error (e.g., specific auth failure over timeout)
-                elif res_with_creds['classification'] != 'unknown' and res['classification'].endswith('_unreachable'):
-                    res = res_with_creds
-
-            results.append(res)
-
-        except (socket.timeout, ConnectionRefusedError, OSError):
-             # Port is closed or unreachable at TCP level
-            res = {'ip':ip, 'port':p, 'result':'closed_or_unreachable', 'classification':'closed_or_unreachable', 'timestamp': datetime.datetime.utcnow().isoformat(), 'publishers': []}
-            # Add outcome categorization
-            outcome_label, meaning, evidence, security_implication = categorize_outcome(res)
-            res['outcome'] = {
-                'label': outcome_label,
-                'meaning': meaning,
-                'evidence_signal': evidence,
-                'security_implication': security_implication
-            }
-            results.append(res)
-        except Exception as general_e: # Catch any other unexpected error during the port check phase
-            print(f"Unexpected error checking port {ip}:{p} - {general_e}")
-            res = {'ip':ip, 'port':p, 'result':f'error_port_check:{str(general_e)}', 'classification':'error', 'timestamp': datetime.datetime.utcnow().isoformat(), 'publishers': []}
-            # Add outcome categorization
-            outcome_label, meaning, evidence, security_implication = categorize_outcome(res)
-            res['outcome'] = {
-                'label': outcome_label,
-                'meaning': meaning,
-                'evidence_signal': evidence,
-                'security_implication': security_implication
-            }
-            results.append(res)
-        finally:
-             if s: # Ensure socket is closed if it was opened
-                 try: s.close()
-                 except: pass
-    return results
-
-def run_scan(target, creds=None):
-    ips = []
-    # Basic IP/CIDR handling (only /24 for demo)
-    if '/' in target:
-        try:
-            base, cidr = target.split('/')
-            parts = base.split('.')
-            if cidr == '24' and len(parts) == 4:
-                prefix = '.'.join(parts[:3])
-                # Limit scan range for demo purposes (e.g., first 10 IPs)
-                # ips = [f"{prefix}.{i}" for i in range(1, 11)] # Scan .1 to .10
-                ips = [f"{prefix}.{i}" for i in range(1, 255)] # Full /24 scan
-            else:
-                 ips = [base] # Treat invalid CIDR as single IP
-        except:
-             ips = [target] # Fallback if parsing fails
-    else:
-        ips = [target]
-
-    print(f"Scanning {len(ips)} IP(s)... Target: {target}")
-    all_results = []
-    # --- Optional: Use threading for faster scanning ---
-    threads = []
-    results_list = [] # Shared list for thread results
-
-    def scan_worker(ip, creds, results_container):
-        try:
-            res = scan_ip(ip, creds)
-            results_container.extend(res)
-        except Exception as e:
-            print(f"Error scanning {ip}: {e}")
+def build_outcome(res):
+    outcome_label, meaning, evidence, security_implication = categorize_outcome(res)
+    return {
+        'label': outcome_label,
+        'meaning': meaning,
+        'evidence_signal': evidence,
+        'security_implication': security_implication
+    }
+
+async def async_scan_port(ip, p, creds=None, listen_secs=None, capture_all=True, listen_mode=None,
+                          protocol=None, pacer=None, timeouts=None):
+    """
+    Probe a single (ip, port) pair.
 
-    for ip in ips:
-        thread = threading.Thread(target=scan_worker, args=(ip, creds, results_list))
-        threads.append(thread)
-        thread.start()
+    protocol is the detect.PROTO_* found by the sweep. Without it, one
+    connect checks the port and detects TLS vs plaintext first, so a closed
+    port costs one failed connect and an open one is probed once, in the
+    right mode, whatever its number.
 
-    for thread in threads:
-        thread.join() # Wait for all threads to complete
+    pacer (a pacing.ConnectionPacer) paces every connection the probe opens:
+    the port check and each MQTT connect attempt. timeouts (a
+    timeouts.AdaptiveTimeouts) sets their connect and CONNACK deadlines.
+    """
+    started = time.monotonic()
+    timings = {}
+    try:
+        if protocol is None:
+            if pacer is not None:
+                timings[STAGE_PACING] = to_ms(await pacer.acquire(ip))
+            check_started = time.monotonic()
+            check = await check_port(ip, p, TIMEOUT, detect=True, timeouts=timeouts)
+            timings[STAGE_PORT_CHECK] = elapsed_ms(check_started)
+            if check.state != PORT_OPEN:
+                return _timed(_swept_port_result(check), timings, started)
+            protocol = check.protocol
+        if protocol == PROTO_HTTP:
+            return _timed(_non_mqtt_result(ip, p, protocol), timings, started)
+        is_tls = resolve_protocol(protocol, p) == PROTO_TLS
+        # First try anonymous (no creds)
+        res = await async_try_mqtt_connect(ip, p, use_tls=is_tls, wait_secs=CONNACK_WAIT,
+                                           listen_secs=listen_secs, capture_all=capture_all, listen_mode=listen_mode,
+                                           pacer=pacer, timeouts=timeouts)
+
+        # If anonymous failed and creds provided, try with credentials
+        # Only retry if the failure seems auth-related or requires TLS negotiation that might succeed with creds
+        retry_needed = res['classification'] in ['not_authorized', 'tls_or_ssl_error', 'not_authorized_or_unreachable', 'connect_timeout_or_unreachable']
+
+        if retry_needed and creds:
+            print(f"Retrying {ip}:{p} with credentials...")
+            res_with_creds = await async_try_mqtt_connect(ip, p, use_tls=is_tls, username=creds.get('user'), password=creds.get('pass'), wait_secs=CONNACK_WAIT,
+                                                          listen_secs=listen_secs, capture_all=capture_all, listen_mode=listen_mode,
+                                                          pacer=pacer, timeouts=timeouts)
+            # Prefer positive result or more specific error
+            if res_with_creds['classification'] == 'open_or_auth_ok' or res['classification'] == 'unknown':
+                 res = res_with_creds
+            # If both failed, keep the potentially more informative error (e.g., specific auth failure over timeout)
+            elif res_with_creds['classification'] != 'unknown' and res['classification'].endswith('_unreachable'):
+                res = res_with_creds
+
+        res['protocol'] = protocol  # As detected on the wire; 'unknown' means the port hint decided
+        return _timed(res, timings, started)
+
+    except Exception as general_e: # Catch any unexpected error outside the probe's own handling
+        print(f"Unexpected error checking port {ip}:{p} - {general_e}")
+        res = {'ip':ip, 'port':p, 'result':f'error_port_check:{str(general_e)}', 'classification':'error', 'timestamp': datetime.datetime.utcnow().isoformat(), 'publishers': []}
+        # Add outcome categorization
+        res['outcome'] = build_outcome(res)
+        return _timed(res, timings, started)
+
+def _timed(res, timings, started):
+    """Merge the port check's timings into the probe's and add the total for the pair."""
+    merged = {**timings, **res.get('timings', {}), STAGE_TOTAL: elapsed_ms(started)}
+    if STAGE_PACING in timings and STAGE_PACING in res.get('timings', {}):
+        merged[STAGE_PACING] = round(timings[STAGE_PACING] + res['timings'][STAGE_PACING], 1)
+    res['timings'] = merged
+    return res
+
+def scan_port(ip, p, creds=None, listen_secs=None, capture_all=True, listen_mode=None, pacer=None, timeouts=None):
+    return asyncio.run(async_scan_port(ip, p, creds, listen_secs=listen_secs, capture_all=capture_all,
+                                       listen_mode=listen_mode, pacer=pacer, timeouts=timeouts))
+
+async def async_scan_ip(ip, creds=None, listen_secs=None, capture_all=True, listen_mode=None, ports=None,
+                        pacer=None, timeouts=None):
+    """
+    Probe every port of one address at once; connections are paced (default: a
+    ConnectionPacer()) and their deadlines adapted (default: AdaptiveTimeouts()).
+    Pass the same timeouts to consecutive calls to carry what was learnt over.
+    """
+    pacer = pacer if pacer is not None else ConnectionPacer()
+    timeouts = timeouts if timeouts is not None else AdaptiveTimeouts()
+    return list(await asyncio.gather(*(
+        async_scan_port(ip, p, creds, listen_secs=listen_secs, capture_all=capture_all, listen_mode=listen_mode,
+                        pacer=pacer, timeouts=timeouts)
+        for p in (ports or COMMON_PORTS)
+    )))
+
+def scan_ip(ip, creds=None, listen_secs=None, capture_all=True, listen_mode=None, ports=None, pacer=None,
+            timeouts=None):
+    return asyncio.run(async_scan_ip(ip, creds, listen_secs=listen_secs, capture_all=capture_all,
+                                     listen_mode=listen_mode, ports=ports, pacer=pacer, timeouts=timeouts))
+
+def _swept_port_result(sweep_res):
+    """Result for a port the sweep found closed or filtered; no probe is run for it."""
+    ip, port = sweep_res.ip, sweep_res.port
+    is_tls = port_hint(port) == PROTO_TLS
+    res = {
+        'ip': ip,
+        'port': port,
+        'result': ('error:connection_refused' if sweep_res.state == PORT_CLOSED
+                   else f'error:socket_error:{sweep_res.error}' if sweep_res.error else 'error:socket_timeout'),
+        'classification': 'closed_or_unreachable',
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'publishers': [],
+        'subscribers': [],
+        'topics_discovered': {},
+        'tls_analysis': None,
+        'tls': is_tls,
+        'security_assessment': {
+            'anonymous_allowed': False,
+            'requires_auth': False,
+            'port_type': 'secure' if is_tls else 'insecure'
+        },
+        'sweep': {'state': sweep_res.state, 'rtt_ms': round(sweep_res.rtt * 1000, 1)},
+    }
+    if sweep_res.error:
+        res['sweep']['error'] = sweep_res.error
+    res['outcome'] = build_outcome(res)
+    return res
+
+def _non_mqtt_result(ip, port, protocol):
+    """Result for an open port whose detected protocol the MQTT probe cannot speak (e.g. HTTP/WebSockets)."""
+    res = {
+        'ip': ip,
+        'port': port,
+        'result': f'detected:{protocol}',
+        'classification': 'non_mqtt_service',
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'publishers': [],
+        'subscribers': [],
+        'topics_discovered': {},
+        'tls_analysis': None,
+        'tls': False,
+        'protocol': protocol,
+        'security_assessment': {
+            'anonymous_allowed': False,
+            'requires_auth': False,
+            'port_type': 'insecure'
+        },
+    }
+    res['outcome'] = build_outcome(res)
+    return res
 
-    # --- Original sequential scan ---
-    # for ip in ips:
-    #     print(f"Scanning {ip}...")
-    #     all_results.extend(scan_ip(ip, creds))
+def _incremental_tasks(tasks, previous, checks):
+    """
+    Incremental scans: pass every pair on, remembering what it was before in `checks`.
+    Previous results are looked up a window of INCREMENTAL_LOOKUP_WINDOW pairs at a
+    time, just ahead of the pairs being handed out.
+    """
+    tasks = iter(tasks)
+    while True:
+        window = list(islice(tasks, INCREMENTAL_LOOKUP_WINDOW))
+        if not window:
+            return
+        previous.prefetch(window)
+        for ip, port in window:
+            checks[(ip, port)] = previous.recent(ip, port)
+            yield ip, port
+
+async def _incremental_probe(probe, previous, ip, port, protocol, prev, status):
+    """
+    Probe one pair of an incremental scan. Without a recent previous result it is
+    probed in full; with one, a short probe (no listen window) decides whether the
+    previous result still holds or the pair has changed and needs the full probe.
+    """
+    if prev is None:
+        return previous.annotate(await probe(ip, port, protocol), status)
+
+    quick = await probe(ip, port, protocol, listen_secs=0)
+    if previous.reusable(prev):
+        # Closed or non-MQTT before: the short probe was one connect (plus detection)
+        if previous.still_negative(prev, quick):
+            return previous.carry_forward(prev, STATUS_REUSED, checked=True)
+        if quick.get('classification') != 'open_or_auth_ok':
+            return previous.annotate(quick, STATUS_CHANGED, prev, checked=True)
+        return previous.annotate(await probe(ip, port, protocol), STATUS_CHANGED, prev)
+    same = previous.matches(prev, quick)
+    if quick.get('classification') != 'open_or_auth_ok':
+        # Nothing is listened to without a session, so the short probe is already a full one
+        return previous.annotate(quick, STATUS_CONFIRMED if same else STATUS_CHANGED, prev, checked=True)
+    if same:
+        return previous.carry_forward(prev, STATUS_CONFIRMED, checked=True)
+    return previous.annotate(await probe(ip, port, protocol), STATUS_CHANGED, prev)
+
+def expand_targets(target, exclude=None, allow_files=True):
+    """
+    Parse a scan target (IPs, CIDRs, ranges, hostnames, @files; see targets.py)
+    into a lazy TargetSet. Raises ValueError for specs that cannot be parsed.
+    An already parsed TargetSet is returned unchanged.
+    """
+    if isinstance(target, TargetSet):
+        return target
+    return TargetSet(target, exclude=exclude, allow_files=allow_files)
 
-    print(f"Scan complete. Found {len(results_list)} results.")
-    return results_list # Return results from threads
+def run_scan(target, creds=None, max_concurrency=None, per_host_limit=None, on_result=None,
+             listen_secs=None, capture_all_topics=True, listen_mode=None, sweep=None, exclude=None, ports=None,
+             keep_results=True, previous=None, timings=None, pacer=None, timeouts=None):
+    """
+    Scan every (ip, port) pair of `target` through a bounded worker pool.
+
+    target is a target spec string or TargetSet; addresses are generated lazily
+    as the scheduler pulls them, so large ranges start probing immediately.
+    exclude is a spec of addresses to leave out. ports is the port list (or
+    comma separated string) to probe on every address, default COMMON_PORTS;
+    each open port is checked for TLS vs plaintext on the wire.
+
+    max_concurrency caps the number of probes in flight across all hosts,
+    per_host_limit caps probes against a single host. on_result, if given,
+    is called with each per-port result as soon as it completes, on the
+    scan's event loop: it must not block. It may be a coroutine function
+    (e.g. pipeline.ResultPipeline.put_async) to apply backpressure; the
+    worker that produced the result awaits it while the other probes run on.
+    listen_secs / capture_all_topics / listen_mode are passed through to each probe.
+
+    sweep: run the async TCP port sweep first and only probe open ports
+    (default: when the scan has at least SWEEP_MIN_TARGETS pairs). Closed and
+    filtered ports still produce a result, straight from the sweep.
+
+    keep_results=False hands results to on_result only and returns an empty
+    list, so memory does not grow with the size of the range.
+
+    previous (an incremental.PreviousResults) makes the scan incremental:
+    targets whose recent previous result still holds are not probed again
+    in full, see incremental.py.
+
+    timings (a metrics.StageTimings) receives every result's stage timings
+    (result['timings']) and the sweep's connect times; a summary is printed
+    at the end. All of it also feeds metrics.scan_metrics (GET /metrics).
+
+    pacer (a pacing.ConnectionPacer) caps the rate of new connections, scan
+    wide and per destination subnet, across the sweep and the probes; the
+    default ConnectionPacer() takes its limits from SCAN_CONNECT_RATE and
+    friends. ConnectionPacer(rate=0, subnet_rate=0) turns pacing off.
+
+    timeouts (a timeouts.AdaptiveTimeouts, default a new one per scan) learns
+    round trips per subnet from the sweep and the probes and derives their
+    connect and CONNACK deadlines from them, so dead addresses in a fast
+    subnet are given up on quickly and slow links get more time.
+    """
+    ips = expand_targets(target, exclude=exclude)
+    ports = parse_ports(ports) if ports else COMMON_PORTS
+    print(f"Scanning {len(ips)} IP(s)... Target: {ips.spec}")
+    results_list = []
+    result_count = 0
+    cut_short = 0  # Listen windows the broker ended by dropping the session
+    tls_handshakes = tls_resumed = 0
+    timings = timings if timings is not None else StageTimings()
+    pacer = pacer if pacer is not None else ConnectionPacer()
+    timeouts = timeouts if timeouts is not None else AdaptiveTimeouts()
+    started = time.monotonic()
+
+    def collect(res):
+        nonlocal result_count, cut_short, tls_handshakes, tls_resumed
+        result_count += 1
+        if (res.get('listen') or {}).get('end_reason') == LISTEN_END_DISCONNECT:
+            cut_short += 1
+        if res.get('tls_session'):
+            tls_handshakes += 1
+            tls_resumed += bool(res['tls_session']['resumed'])
+        # Before on_result: stages after the probe (see pipeline.py) record their own timings
+        timings.add(res.get('timings'))
+        scan_metrics.record(res)
+        if keep_results:
+            results_list.append(res)
+        if on_result is not None:
+            return on_result(res)  # The scheduler awaits it if it is awaitable
+        return None
+
+    async def deliver(res):
+        delivered = collect(res)
+        if inspect.isawaitable(delivered):
+            await delivered
+
+    tasks = ((ip, p) for ip in ips for p in ports)
+    checks = {}  # (ip, port) -> (recent previous result, status) for pairs in flight, incremental scans only
+    if previous is not None:
+        tasks = _incremental_tasks(tasks, previous, checks)
+
+    async def probe(ip, port, protocol=None, listen_secs=listen_secs):
+        return await async_scan_port(ip, port, creds, listen_secs=listen_secs,
+                                     capture_all=capture_all_topics, listen_mode=listen_mode,
+                                     protocol=protocol, pacer=pacer, timeouts=timeouts)
+
+    async def worker(ip, port, protocol=None):
+        if previous is None:
+            return await probe(ip, port, protocol)
+        prev, status = checks.pop((ip, port))
+        return await _incremental_probe(probe, previous, ip, port, protocol, prev, status)
+
+    if sweep is None:
+        sweep = len(ips) * len(ports) >= SWEEP_MIN_TARGETS
+    sweeper = PortSweeper(ports_per_host=len(ports), detect=True, pacer=pacer, timeouts=timeouts) if sweep else None
+
+    async def open_ports():
+        # Sweep results stream in as connects finish; open ports go straight to the probe stage
+        async for sweep_res in sweeper.sweep(tasks):
+            timings.add_stage(STAGE_SWEEP, to_ms(sweep_res.rtt))
+            scan_metrics.stages.add_stage(STAGE_SWEEP, to_ms(sweep_res.rtt))
+            if sweep_res.state == PORT_OPEN:
+                yield sweep_res.ip, sweep_res.port, sweep_res.protocol
+            elif previous is not None:
+                prev, status = checks.pop((sweep_res.ip, sweep_res.port))
+                swept = _swept_port_result(sweep_res)
+                if prev is not None and previous.reusable(prev) and previous.still_negative(prev, swept):
+                    # Closed before and the sweep's connect says it still is
+                    await deliver(previous.carry_forward(prev, STATUS_REUSED, checked=True))
+                else:
+                    await deliver(previous.annotate(swept, STATUS_CHANGED if prev else status, prev))
+            else:
+                await deliver(_swept_port_result(sweep_res))
+
+    # Every probe runs on this one event loop; the scheduler caps how many are in flight
+    scheduler = ScanScheduler(worker, max_concurrency=max_concurrency, per_host_limit=per_host_limit)
+    with scan_metrics.tracking(scheduler, pacer):
+        asyncio.run(scheduler.run(open_ports() if sweeper else tasks, on_result=collect))
+
+    if sweeper:
+        stats = sweeper.stats
+        print(f"Sweep: {stats['open']} open, {stats['closed']} closed, {stats['filtered']} filtered "
+              f"({stats['errors']} local errors, {sweeper.hosts_per_second():.1f} hosts/s).")
+    print(f"Scan complete. Found {result_count} results in {time.monotonic() - started:.1f}s "
+          f"({scheduler.throughput():.1f} probes/s, concurrency={scheduler.max_concurrency}).")
+    stage_summary = timings.summary()
+    if stage_summary:
+        print("Stage latency (ms): " + "; ".join(
+            f"{stage} p50={s['p50']} p95={s['p95']} p99={s['p99']} max={s['max']}" for stage, s in stage_summary.items()))
+    if pacer.enabled:
+        stats = pacer.summary()
+        print(f"Pacing ({pacer.describe()}): {stats['connects']} connects, {stats['delayed']} delayed, "
+              f"{stats['wait_secs']:.1f}s waited in total (max {stats['max_wait_secs']:.2f}s).")
+    stats = timeouts.summary()
+    if stats['connect_adapted'] or stats['connack_adapted']:
+        print(f"Adaptive timeouts: {stats['subnets']} subnet(s) measured; "
+              f"{stats['connect_adapted']} of {stats['connect_adapted'] + stats['connect_default']} connect and "
+              f"{stats['connack_adapted']} of {stats['connack_adapted'] + stats['connack_default']} CONNACK "
+              f"deadlines from RTT estimates.")
+    if cut_short:
+        print(f"{cut_short} listen window(s) cut short by the broker dropping the session.")
+    if previous is not None:
+        stats = previous.stats
+        print(f"Incremental: {stats['reused']} reused, {stats['confirmed']} confirmed, {stats['changed']} changed, "
+              f"{stats['new']} new, {stats['stale']} stale.")
+    if tls_handshakes:
+        print(f"TLS: {tls_handshakes} handshake(s), {tls_resumed} resumed "
+              f"({tls_resumed / tls_handshakes * 100:.0f}%).")
+    cache_stats = cert_cache.metrics()
+    if cache_stats['hits'] or cache_stats['misses']:
+        print(f"TLS cert cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+              f"{cache_stats['entries']} entries.")
+    return results_list
 
 if __name__ == '__main__':
     # Example usage: Scan localhost, provide credentials
     scan_results = run_scan('127.0.0.1', creds={'user':'testuser','pass':'testpass'})
     import json
     print(json.dumps(scan_results, indent=2))
-    # Example usage: Scan a /24 subnet (adjust range in run_scan if needed)
-    # scan_results_subnet = run_scan('192.168.1.0/24')
+    # Example usage: Scan a /16 minus one /24, or a last-octet range
+    # scan_results_subnet = run_scan('192.168.0.0/16', exclude='192.168.5.0/24')
+    # scan_results_range = run_scan('192.168.1.10-50')
     # print(json.dumps(scan_results_subnet, indent=2))
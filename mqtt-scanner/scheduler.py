@@ -0,0 +1,146 @@
+"""
+Bounded worker-pool scheduler for scan tasks.
+
+Tasks are (ip, port) pairs pulled from a bounded queue by a fixed number of
+workers, so the number of in-flight probes never exceeds the global cap no
+matter how large the target range is. A per-host cap stops a single broker
+from being hit by every worker at once.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Global cap on concurrent probes across all hosts (probes are coroutines, not threads)
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('SCAN_MAX_CONCURRENCY', 256))
+# Cap on concurrent probes against a single host
+DEFAULT_PER_HOST_LIMIT = int(os.environ.get('SCAN_PER_HOST_LIMIT', 2))
+# Queue slots per worker; the producer blocks once the queue is full (backpressure)
+QUEUE_SLOTS_PER_WORKER = 4
+
+
+class ScanScheduler:
+    """
+    Runs `worker(ip, port)` coroutines with a global and a per-host concurrency cap.
+
+    Usage:
+        scheduler = ScanScheduler(worker, max_concurrency=64, per_host_limit=2)
+        await scheduler.run(tasks, on_result=callback)
+    """
+
+    def __init__(self, worker, max_concurrency=None, per_host_limit=None, queue_size=None):
+        self.worker = worker
+        self.max_concurrency = max(1, int(max_concurrency or DEFAULT_MAX_CONCURRENCY))
+        self.per_host_limit = max(1, int(per_host_limit or DEFAULT_PER_HOST_LIMIT))
+        self.queue_size = queue_size or self.max_concurrency * QUEUE_SLOTS_PER_WORKER
+
+        self._host_slots = {}  # ip -> [semaphore, users]
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'in_flight': 0,
+            'queue_depth': 0,
+            'started_at': None,
+            'finished_at': None,
+        }
+
+    def _acquire_host(self, ip):
+        slot = self._host_slots.get(ip)
+        if slot is None:
+            slot = self._host_slots[ip] = [asyncio.Semaphore(self.per_host_limit), 0]
+        slot[1] += 1
+        return slot[0]
+
+    def _release_host(self, ip):
+        slot = self._host_slots.get(ip)
+        if slot is None:
+            return
+        slot[1] -= 1
+        if slot[1] <= 0:
+            # Drop idle hosts so the table stays as small as the in-flight set
+            del self._host_slots[ip]
+
+    async def _worker_loop(self, queue, on_result):
+        while True:
+            task = await queue.get()
+            self.stats['queue_depth'] = queue.qsize()
+            if task is None:
+                queue.task_done()
+                return
+
+            ip, port = task[0], task[1]
+            host_sem = self._acquire_host(ip)
+            try:
+                async with host_sem:
+                    self.stats['in_flight'] += 1
+                    try:
+                        result = await self.worker(*task)
+                        self.stats['completed'] += 1
+                    except Exception as e:
+                        logger.error(f"Error scanning {ip}:{port}: {e}")
+                        self.stats['failed'] += 1
+                        result = None
+                    finally:
+                        self.stats['in_flight'] -= 1
+
+                if result is not None and on_result is not None:
+                    try:
+                        delivered = on_result(result)
+                        if inspect.isawaitable(delivered):
+                            # Backpressure: this worker waits, the loop (and other probes) keep running
+                            await delivered
+                    except Exception as cb_e:
+                        logger.error(f"Result callback failed for {ip}:{port}: {cb_e}")
+            finally:
+                self._release_host(ip)
+                queue.task_done()
+
+    async def _submit(self, queue, task):
+        await queue.put(task)
+        self.stats['submitted'] += 1
+        self.stats['queue_depth'] = queue.qsize()
+
+    async def run(self, tasks, on_result=None):
+        """
+        Feed `tasks` (any iterable or async iterable of (ip, port, *extra)) through the
+        worker pool; each task is passed to the worker as its positional arguments.
+        Blocks the producer while the queue is full, so memory stays bounded.
+        on_result(result) may return an awaitable (e.g. be a coroutine function);
+        the worker awaits it before taking its next task.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.stats['started_at'] = time.time()
+        workers = [
+            asyncio.create_task(self._worker_loop(queue, on_result))
+            for _ in range(self.max_concurrency)
+        ]
+
+        try:
+            if hasattr(tasks, '__aiter__'):
+                async for task in tasks:
+                    await self._submit(queue, task)
+            else:
+                for task in tasks:
+                    await self._submit(queue, task)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                if not w.done():
+                    w.cancel()
+            self.stats['finished_at'] = time.time()
+
+        return self.stats
+
+    def throughput(self):
+        """Completed tasks per second over the lifetime of the last run."""
+        started = self.stats['started_at']
+        if not started:
+            return 0.0
+        elapsed = (self.stats['finished_at'] or time.time()) - started
+        return self.stats['completed'] / elapsed if elapsed > 0 else 0.0
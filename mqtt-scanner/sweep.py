@@ -0,0 +1,215 @@
+"""
+Asynchronous TCP port sweep, run ahead of the MQTT probe stage.
+
+Every (ip, port) pair gets one non-blocking connect with its own deadline;
+thousands of attempts share one event loop, so a large range of mostly dead
+addresses costs roughly one SWEEP_TIMEOUT per batch instead of one per host.
+Results are yielded as attempts finish, so open ports can be probed while
+the sweep is still running. With detection on, each open port's connection
+is reused to tell TLS from plaintext (see detect.py) before it is closed.
+"""
+import asyncio
+import errno
+import logging
+import os
+import socket
+import time
+from collections import namedtuple
+from detect import detect_on_socket
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Per-attempt connect deadline (seconds)
+SWEEP_TIMEOUT = float(os.environ.get('SCAN_SWEEP_TIMEOUT', 1.5))
+# Upper bound on simultaneous connect attempts (further capped by the fd limit)
+SWEEP_MAX_IN_FLIGHT = int(os.environ.get('SCAN_SWEEP_MAX_IN_FLIGHT', 10000))
+# File descriptors kept back for the probe stage, Flask, logging, ...
+FD_HEADROOM = 256
+
+PORT_OPEN = 'open'
+PORT_CLOSED = 'closed'      # RST: host is up, nothing listening
+PORT_FILTERED = 'filtered'  # No answer before the deadline, or unreachable
+
+# Connect errors that are the network's answer about the target; any other OSError is a local
+# failure (EMFILE, ENOBUFS, EADDRNOTAVAIL, ...) and says nothing about the port
+UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN, errno.ENETDOWN, errno.ETIMEDOUT}
+
+# protocol: detect.PROTO_* for open ports when detection ran, else None
+# error: why the attempt failed locally (reported as filtered), else None
+SweepResult = namedtuple('SweepResult', ['ip', 'port', 'state', 'rtt', 'protocol', 'error'], defaults=(None, None))
+
+
+def fd_budget():
+    """How many sockets the sweep may hold open, given RLIMIT_NOFILE."""
+    if resource is None:
+        return SWEEP_MAX_IN_FLIGHT
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and (hard == resource.RLIM_INFINITY or soft < hard):
+        # Large sweeps need far more than the usual 1024; raise the soft limit if allowed
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return SWEEP_MAX_IN_FLIGHT
+    return max(1, soft - FD_HEADROOM)
+
+
+if hasattr(asyncio, 'timeout'):
+    async def _connect(loop, sock, address, timeout):
+        # asyncio.timeout (3.11+) avoids the extra task wait_for creates per attempt
+        async with asyncio.timeout(timeout):
+            await loop.sock_connect(sock, address)
+else:
+    async def _connect(loop, sock, address, timeout):
+        await asyncio.wait_for(loop.sock_connect(sock, address), timeout)
+
+
+async def check_port(ip, port, timeout=SWEEP_TIMEOUT, detect=False, pacer=None, timeouts=None):
+    """
+    One non-blocking connect attempt; returns a SweepResult. detect: also classify
+    open ports as TLS/plaintext. pacer (a pacing.ConnectionPacer) delays the attempt
+    until its slot; the wait is not part of the timeout or the rtt.
+    timeouts (a timeouts.AdaptiveTimeouts) replaces `timeout` with the deadline
+    learnt for the address's subnet, and learns from this attempt's rtt.
+    """
+    if pacer is not None:
+        await pacer.acquire(ip)
+    if timeouts is not None:
+        timeout = timeouts.connect_timeout(ip, timeout)
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    started = time.monotonic()
+    sock = protocol = error = None
+    try:
+        try:
+            # Inside the try: running out of descriptors must fail this address, not the sweep
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            await _connect(loop, sock, (ip, port), timeout)
+            state = PORT_OPEN
+        except ConnectionRefusedError:
+            state = PORT_CLOSED
+        except asyncio.TimeoutError:
+            state = PORT_FILTERED
+        except OSError as e:
+            # A reset during connect means closed, unreachable means filtered
+            if e.errno == errno.ECONNRESET:
+                state = PORT_CLOSED
+            else:
+                state = PORT_FILTERED
+                if e.errno not in UNREACHABLE_ERRNOS:
+                    error = errno.errorcode.get(e.errno) or type(e).__name__
+                    logger.debug(f"Connect to {ip}:{port} failed locally: {e}")
+        rtt = time.monotonic() - started
+        if timeouts is not None and state != PORT_FILTERED:
+            # SYN-ACK or RST: either way a full round trip
+            timeouts.observe_connect(ip, rtt)
+        if state == PORT_OPEN and detect:
+            protocol = await detect_on_socket(sock)
+    finally:
+        if sock is not None:
+            sock.close()
+    return SweepResult(ip, port, state, rtt, protocol, error)
+
+
+class PortSweeper:
+    """
+    Sweeps (ip, port) pairs with a bounded number of connects in flight.
+
+    pacer (a pacing.ConnectionPacer) spaces out the connect attempts; attempts
+    waiting for their slot count as in flight but hold no socket yet.
+    timeouts (a timeouts.AdaptiveTimeouts) shortens or stretches each attempt's
+    deadline to what its subnet's round trips suggest, `timeout` until measured.
+
+    Usage:
+        sweeper = PortSweeper(timeout=1.5)
+        async for res in sweeper.sweep(pairs):
+            if res.state == PORT_OPEN: ...
+        print(sweeper.hosts_per_second())
+    """
+
+    def __init__(self, timeout=None, max_in_flight=None, ports_per_host=1, detect=False, pacer=None,
+                 timeouts=None):
+        self.timeout = timeout or SWEEP_TIMEOUT
+        self.detect = detect
+        self.pacer = pacer
+        self.timeouts = timeouts
+        self.max_in_flight = max(1, min(int(max_in_flight or SWEEP_MAX_IN_FLIGHT), fd_budget()))
+        self.ports_per_host = max(1, ports_per_host)
+        self._ports_seen = {}  # ip -> ports finished so far
+        self.stats = {
+            'attempted': 0,
+            'open': 0,
+            'closed': 0,
+            'filtered': 0,
+            'errors': 0,      # Filtered because of a local failure (see SweepResult.error)
+            'hosts_done': 0,
+            'in_flight': 0,
+            'started_at': None,
+            'finished_at': None,
+        }
+
+    def _record(self, res):
+        self.stats[res.state] += 1
+        self.stats['errors'] += res.error is not None
+        seen = self._ports_seen.get(res.ip, 0) + 1
+        if seen >= self.ports_per_host:
+            self._ports_seen.pop(res.ip, None)
+            self.stats['hosts_done'] += 1
+        else:
+            self._ports_seen[res.ip] = seen
+
+    async def sweep(self, pairs):
+        """
+        Async generator: yields a SweepResult per pair, in completion order.
+        `pairs` is any iterable of (ip, port); it is consumed lazily.
+        """
+        self.stats['started_at'] = time.time()
+        pairs = iter(pairs)
+        pending = set()
+        finished = asyncio.Queue()  # Tasks land here as they complete; no rescans of `pending`
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_in_flight:
+                    pair = next(pairs, None)
+                    if pair is None:
+                        exhausted = True
+                        break
+                    task = asyncio.ensure_future(check_port(pair[0], pair[1], self.timeout, self.detect, self.pacer,
+                                                          self.timeouts))
+                    task.add_done_callback(finished.put_nowait)
+                    pending.add(task)
+                    self.stats['attempted'] += 1
+                self.stats['in_flight'] = len(pending)
+                if not pending:
+                    break
+
+                task = await finished.get()
+                pending.discard(task)
+                res = task.result()
+                self._record(res)
+                yield res
+        finally:
+            for task in pending:
+                task.cancel()
+            self.stats['in_flight'] = 0
+            self.stats['finished_at'] = time.time()
+            logger.info(f"Port sweep: {self.stats['attempted']} attempts, {self.stats['open']} open, "
+                        f"{self.stats['closed']} closed, {self.stats['filtered']} filtered "
+                        f"({self.stats['errors']} local errors, {self.hosts_per_second():.1f} hosts/s)")
+
+    def hosts_per_second(self):
+        """Fully swept hosts per second over the lifetime of the last sweep."""
+        started = self.stats['started_at']
+        if not started:
+            return 0.0
+        elapsed = (self.stats['finished_at'] or time.time()) - started
+        return self.stats['hosts_done'] / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,242 @@
+"""
+Scan target and port list parsing, with lazy target expansion.
+
+A target spec is a comma/whitespace separated list of:
+    192.168.1.10            single address (IPv4 or IPv6)
+    10.0.0.0/16, fd00::/120 CIDR networks (network/broadcast excluded, like ipaddress.hosts())
+    192.168.1.10-50         last-octet range
+    10.0.0.5-10.0.1.20      full range (IPv4 or IPv6)
+    broker.example.com      hostname (every address it resolves to)
+    @targets.txt            file with one spec per line, '#' starts a comment
+
+Specs are reduced to integer intervals up front (exclusions and overlaps are
+subtracted there), so the size of the target set is known immediately and
+iteration yields addresses one at a time without ever materialising them.
+"""
+import bisect
+import ipaddress
+import logging
+import os
+import re
+import socket
+
+logger = logging.getLogger(__name__)
+
+# Refuse target sets larger than this (a /8); IPv6 /64s are not enumerable anyway
+MAX_TARGET_ADDRESSES = int(os.environ.get('SCAN_MAX_TARGET_ADDRESSES', 1 << 24))
+
+# Refuse port lists longer than this; each port multiplies the number of probes
+MAX_PORTS = int(os.environ.get('SCAN_MAX_PORTS', 1024))
+
+_SPLIT_RE = re.compile(r'[\s,]+')
+
+
+def _split_specs(text):
+    return [token for token in _SPLIT_RE.split(text or '') if token]
+
+
+def _merge(intervals):
+    """Sort and merge overlapping/adjacent (start, end) intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _add_interval(covered, start, end):
+    """
+    Add [start, end] to `covered` (merged, sorted; updated in place) and return
+    the pieces of it that were not covered before. Bisects to the first interval
+    that can touch [start, end], so adding in address order costs O(log n).
+    """
+    lo = bisect.bisect_right(covered, (start, start)) - 1
+    if lo < 0 or covered[lo][1] < start - 1:
+        lo += 1
+    pieces = []
+    cursor = start
+    merged_start, merged_end = start, end
+    hi = lo
+    while hi < len(covered) and covered[hi][0] <= end + 1:
+        c_start, c_end = covered[hi]
+        if c_start > cursor:
+            pieces.append((cursor, c_start - 1))
+        cursor = max(cursor, c_end + 1)
+        merged_start, merged_end = min(merged_start, c_start), max(merged_end, c_end)
+        hi += 1
+    if cursor <= end:
+        pieces.append((cursor, end))
+    covered[lo:hi] = [(merged_start, merged_end)]
+    return pieces
+    if cursor <= end:
+        pieces.append((cursor, end))
+    return pieces
+
+
+def _network_interval(network):
+    """Usable host interval of a network, matching ipaddress.hosts()."""
+    first, last = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4 and network.prefixlen < 31:
+        return first + 1, last - 1
+    if network.version == 6 and network.prefixlen < 127:
+        return first + 1, last  # Subnet-Router anycast address
+    return first, last
+
+
+def _resolve(hostname):
+    try:
+        infos = socket.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError(f"Cannot resolve target '{hostname}': {e}")
+    addresses = []
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+def _parse_range(token):
+    """'a.b.c.d-e' or 'start-end'; returns (version, start, end) or None if not a range."""
+    left, _sep, right = token.partition('-')
+    try:
+        start = ipaddress.ip_address(left)
+    except ValueError:
+        return None  # e.g. a hostname containing '-'
+    if right.isdigit() and start.version == 4:
+        last = int(right)
+        if last > 255:
+            raise ValueError(f"Invalid range '{token}'")
+        end = ipaddress.IPv4Address((int(start) & 0xFFFFFF00) | last)
+    else:
+        try:
+            end = ipaddress.ip_address(right)
+        except ValueError:
+            raise ValueError(f"Invalid range '{token}'")
+        if end.version != start.version:
+            raise ValueError(f"Range '{token}' mixes IPv4 and IPv6")
+    if int(end) < int(start):
+        raise ValueError(f"Range '{token}' ends before it starts")
+    return start.version, int(start), int(end)
+
+
+def _parse_spec(token, allow_files, depth=0):
+    """Returns a list of (version, start, end) intervals for one spec token."""
+    if token.startswith('@'):
+        if not allow_files:
+            raise ValueError("Target files are not allowed here")
+        if depth:
+            raise ValueError("Target files cannot include other target files")
+        path = token[1:]
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = [line.split('#', 1)[0] for line in f]
+        except OSError as e:
+            raise ValueError(f"Cannot read target file '{path}': {e}")
+        intervals = []
+        for line in lines:
+            for sub in _split_specs(line):
+                intervals.extend(_parse_spec(sub, allow_files, depth + 1))
+        return intervals
+
+    if '/' in token:
+        try:
+            network = ipaddress.ip_network(token, strict=False)
+        except ValueError as e:
+            raise ValueError(f"Invalid network '{token}': {e}")
+        if network.num_addresses > MAX_TARGET_ADDRESSES:
+            raise ValueError(f"Network '{token}' is larger than {MAX_TARGET_ADDRESSES} addresses")
+        return [(network.version,) + _network_interval(network)]
+
+    try:
+        address = ipaddress.ip_address(token)
+        return [(address.version, int(address), int(address))]
+    except ValueError:
+        pass
+
+    if '-' in token:
+        parsed = _parse_range(token)
+        if parsed:
+            return [parsed]
+
+    return [(a.version, int(a), int(a)) for a in _resolve(token)]
+
+
+def parse_ports(ports):
+    """
+    Port list from a list of ints or a spec like '1883,8883,8884' / '8000-8010'.
+    Returns the ports in order, without duplicates; raises ValueError on bad input.
+    """
+    tokens = _split_specs(ports) if isinstance(ports, str) else list(ports or [])
+    result, seen = [], set()
+    for token in tokens:
+        first, _sep, last = str(token).partition('-')
+        try:
+            start, end = int(first), int(last or first)
+        except ValueError:
+            raise ValueError(f"Invalid port '{token}'")
+        if not 1 <= start <= end <= 65535:
+            raise ValueError(f"Invalid port '{token}'")
+        if end - start >= MAX_PORTS:
+            raise ValueError(f"More than {MAX_PORTS} ports requested")
+        for port in range(start, end + 1):
+            if port not in seen:
+                seen.add(port)
+                result.append(port)
+    if len(result) > MAX_PORTS:
+        raise ValueError(f"More than {MAX_PORTS} ports requested")
+    if not result:
+        raise ValueError("No ports given")
+    return result
+
+
+class TargetSet:
+    """
+    Parsed scan targets. Parsing (and hostname resolution) happens in the
+    constructor and raises ValueError for bad specs; iteration is lazy and
+    yields each address as a string exactly once, in spec order.
+
+    Usage:
+        targets = TargetSet('10.0.0.0/16, broker.local', exclude='10.0.5.0/24')
+        print(len(targets))
+        for ip in targets: ...
+    """
+
+    def __init__(self, target, exclude=None, allow_files=True):
+        self.spec = target
+        specs = _split_specs(target) if isinstance(target, str) else list(target or [])
+        excludes = _split_specs(exclude) if isinstance(exclude, str) else list(exclude or [])
+        if not specs:
+            raise ValueError("No scan target given")
+
+        excluded = {4: [], 6: []}
+        for token in excludes:
+            for version, start, end in _parse_spec(token, allow_files):
+                excluded[version].append((start, end))
+        covered = {4: _merge(excluded[4]), 6: _merge(excluded[6])}
+
+        # Each interval minus everything already covered (exclusions, earlier specs)
+        self._blocks = []
+        self._count = 0
+        for token in specs:
+            for version, start, end in _parse_spec(token, allow_files):
+                for piece in _add_interval(covered[version], start, end):
+                    self._blocks.append((version,) + piece)
+                    self._count += piece[1] - piece[0] + 1
+                if self._count > MAX_TARGET_ADDRESSES:
+                    raise ValueError(f"Target set is larger than {MAX_TARGET_ADDRESSES} addresses")
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for version, start, end in self._blocks:
+            make = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+            for value in range(start, end + 1):
+                yield str(make(value))
+
+    def __repr__(self):
+        return f"TargetSet({self.spec!r}, {self._count} addresses)"
@@ -0,0 +1,137 @@
+"""
+RTT-adaptive connect and CONNACK deadlines.
+
+Fixed deadlines are wrong in both directions: on a LAN, where brokers answer
+a connect in well under 5 ms, a 2 s connect timeout makes every dead address
+cost hundreds of times what it needs to; across a slow link the same value
+times out live brokers.
+
+AdaptiveTimeouts learns as the scan goes. Every answered TCP connect (SYN-ACK
+or RST) is a round-trip sample, every CONNACK a sample of how long brokers
+take to answer CONNECT. Samples are kept per destination subnet (the pacing
+subnets, /24 and /64 by default) as a smoothed mean and deviation (the
+SRTT/RTTVAR estimator of RFC 6298), and a deadline is
+
+    clamp((srtt + max(granularity, 4 * rttvar)) * SCAN_RTT_TIMEOUT_FACTOR, floor, ceiling)
+
+A subnet with fewer than SCAN_RTT_MIN_SAMPLES samples keeps the caller's fixed
+default, so nothing is cut short before it has been measured, and subnets
+never borrow each other's estimates: a fast subnet in the same scan must not
+shorten the deadline for a slow one, whose SYN-ACKs would then never arrive
+in time to correct it.
+
+Usage:
+    timeouts = AdaptiveTimeouts()
+    deadline = timeouts.connect_timeout(ip, default=TIMEOUT)
+    ... connect ...
+    timeouts.observe_connect(ip, rtt_secs)
+"""
+import os
+import threading
+
+from pacing import subnet_of
+
+RTT_MIN_SAMPLES = int(os.environ.get('SCAN_RTT_MIN_SAMPLES', 3))
+# Headroom over the RFC 6298 timeout, which is tuned for retransmits, not one-shot probes
+RTT_TIMEOUT_FACTOR = float(os.environ.get('SCAN_RTT_TIMEOUT_FACTOR', 3))
+CONNECT_TIMEOUT_MIN = float(os.environ.get('SCAN_CONNECT_TIMEOUT_MIN', 0.25))
+CONNECT_TIMEOUT_MAX = float(os.environ.get('SCAN_CONNECT_TIMEOUT_MAX', 10))
+# Brokers may run CONNECT through an auth backend; keep the CONNACK floor generous
+CONNACK_TIMEOUT_MIN = float(os.environ.get('SCAN_CONNACK_TIMEOUT_MIN', 1))
+CONNACK_TIMEOUT_MAX = float(os.environ.get('SCAN_CONNACK_TIMEOUT_MAX', 15))
+CLOCK_GRANULARITY = 0.01
+
+KIND_CONNECT = 'connect'
+KIND_CONNACK = 'connack'
+
+
+class RttEstimate:
+    """Smoothed round-trip time and deviation (RFC 6298, section 2). Not locked; AdaptiveTimeouts locks."""
+
+    __slots__ = ('srtt', 'rttvar', 'samples')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def add(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.samples += 1
+
+    def rto(self):
+        return self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)
+
+
+class AdaptiveTimeouts:
+    """Per-subnet connect and CONNACK deadlines derived from measured latencies; thread-safe."""
+
+    def __init__(self, min_samples=None, factor=None, connect_bounds=None, connack_bounds=None,
+                 prefix_v4=None, prefix_v6=None):
+        self.min_samples = max(1, min_samples or RTT_MIN_SAMPLES)
+        self.factor = factor or RTT_TIMEOUT_FACTOR
+        self.bounds = {KIND_CONNECT: connect_bounds or (CONNECT_TIMEOUT_MIN, CONNECT_TIMEOUT_MAX),
+                       KIND_CONNACK: connack_bounds or (CONNACK_TIMEOUT_MIN, CONNACK_TIMEOUT_MAX)}
+        self.prefixes = {k: v for k, v in (('prefix_v4', prefix_v4), ('prefix_v6', prefix_v6)) if v}
+        self._estimates = {}  # (kind, subnet) -> RttEstimate
+        self._lock = threading.Lock()
+        self.stats = {f'{kind}_{key}': 0 for kind in self.bounds for key in ('samples', 'adapted', 'default')}
+
+    def _key(self, kind, ip):
+        return kind, subnet_of(ip, **self.prefixes)
+
+    def observe(self, kind, ip, secs):
+        if secs is None or secs < 0:
+            return
+        key = self._key(kind, ip)
+        with self._lock:
+            estimate = self._estimates.get(key)
+            if estimate is None:
+                estimate = self._estimates[key] = RttEstimate()
+            estimate.add(secs)
+            self.stats[f'{kind}_samples'] += 1
+
+    def timeout(self, kind, ip, default):
+        """Deadline (seconds) for the next `kind` wait against `ip`; `default` until its subnet is measured."""
+        key = self._key(kind, ip)
+        with self._lock:
+            estimate = self._estimates.get(key)
+            if estimate is None or estimate.samples < self.min_samples:
+                self.stats[f'{kind}_default'] += 1
+                return default
+            self.stats[f'{kind}_adapted'] += 1
+            rto = estimate.rto()
+        floor, ceiling = self.bounds[kind]
+        return min(ceiling, max(floor, rto * self.factor))
+
+    def connect_timeout(self, ip, default):
+        return self.timeout(KIND_CONNECT, ip, default)
+
+    def connack_timeout(self, ip, default):
+        return self.timeout(KIND_CONNACK, ip, default)
+
+    def observe_connect(self, ip, secs):
+        self.observe(KIND_CONNECT, ip, secs)
+
+    def observe_connack(self, ip, secs):
+        self.observe(KIND_CONNACK, ip, secs)
+
+    def estimates(self):
+        """{subnet: {kind: {'srtt_ms', 'rttvar_ms', 'samples'}}} for subnets with samples."""
+        with self._lock:
+            items = [(kind, subnet, e.srtt, e.rttvar, e.samples) for (kind, subnet), e in self._estimates.items()]
+        out = {}
+        for kind, subnet, srtt, rttvar, samples in items:
+            out.setdefault(str(subnet), {})[kind] = {'srtt_ms': round(srtt * 1000, 2),
+                                                     'rttvar_ms': round(rttvar * 1000, 2), 'samples': samples}
+        return out
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['subnets'] = len({subnet for _kind, subnet in self._estimates})
+        return stats
@@ -0,0 +1,379 @@
+"""
+TLS certificate decoding and security assessment.
+
+The scanner connects with verification disabled (it has to reach brokers with
+self-signed certificates), and in that mode ssl.getpeercert() returns an empty
+dict. The leaf certificate is therefore decoded from its DER bytes here, into
+the same shape getpeercert() would have produced, so the assessment works the
+same no matter which connection captured the certificate.
+
+Analyses are cached per (host, port) in cert_cache, shared by every scan and
+job in the process. Every lookup comes from a completed handshake, whether a
+probe's own or analyze_tls_certificate's, and reuses the cached analysis only
+if the SHA-256 fingerprint, TLS version and cipher still match: a rotated
+certificate is assessed again even within the TTL.
+"""
+import copy
+import datetime
+import hashlib
+import logging
+import os
+import ssl
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CERT_DATE_FORMAT = '%b %d %H:%M:%S %Y %Z'
+WEAK_CIPHER_MARKERS = ['DES', 'RC4', 'MD5', 'NULL']
+OUTDATED_TLS_VERSIONS = ['SSLv2', 'SSLv3', 'TLSv1', 'TLSv1.1']
+
+# Seconds a cached analysis stays usable. Also bounds how stale the
+# date-derived fields (expired, days_until_expiry) can get.
+CERT_CACHE_TTL = float(os.environ.get('SCAN_CERT_CACHE_TTL', 3600))
+CERT_CACHE_SIZE = int(os.environ.get('SCAN_CERT_CACHE_SIZE', 4096))
+
+# X.520 attribute OIDs, named the way ssl.getpeercert() names them
+_NAME_OIDS = {
+    '2.5.4.3': 'commonName',
+    '2.5.4.4': 'surname',
+    '2.5.4.5': 'serialNumber',
+    '2.5.4.6': 'countryName',
+    '2.5.4.7': 'localityName',
+    '2.5.4.8': 'stateOrProvinceName',
+    '2.5.4.9': 'streetAddress',
+    '2.5.4.10': 'organizationName',
+    '2.5.4.11': 'organizationalUnitName',
+    '2.5.4.12': 'title',
+    '2.5.4.42': 'givenName',
+    '1.2.840.113549.1.9.1': 'emailAddress',
+    '0.9.2342.19200300.100.1.25': 'domainComponent',
+}
+
+
+# --- Minimal DER reader (just enough of X.509 for the fields we report) ---
+
+def _read_tlv(data, pos):
+    """Returns (tag, value_start, value_end) for the TLV at `pos`."""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num_bytes = length & 0x7F
+        length = int.from_bytes(data[pos:pos + num_bytes], 'big')
+        pos += num_bytes
+    return tag, pos, pos + length
+
+
+def _children(data, start, end):
+    pos = start
+    while pos < end:
+        tag, vstart, vend = _read_tlv(data, pos)
+        yield tag, vstart, vend
+        pos = vend
+
+
+def _decode_oid(raw):
+    first = raw[0]
+    parts = [str(first // 40), str(first % 40)]
+    value = 0
+    for byte in raw[1:]:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(str(value))
+            value = 0
+    return '.'.join(parts)
+
+
+def _decode_string(tag, raw):
+    if tag == 0x1E:  # BMPString
+        return raw.decode('utf-16-be', errors='replace')
+    return raw.decode('utf-8', errors='replace')
+
+
+def _decode_name(data, start, end):
+    """Name -> getpeercert-style tuple of RDN tuples."""
+    rdns = []
+    for _set_tag, set_start, set_end in _children(data, start, end):
+        rdn = []
+        for _seq_tag, seq_start, seq_end in _children(data, set_start, set_end):
+            (oid_tag, oid_start, oid_end), (val_tag, val_start, val_end) = list(_children(data, seq_start, seq_end))[:2]
+            oid = _decode_oid(data[oid_start:oid_end])
+            rdn.append((_NAME_OIDS.get(oid, oid), _decode_string(val_tag, data[val_start:val_end])))
+        rdns.append(tuple(rdn))
+    return tuple(rdns)
+
+
+def _decode_time(tag, raw):
+    text = raw.decode('ascii').rstrip('Z')
+    if tag == 0x17:  # UTCTime, YYMMDDHHMM[SS]
+        year = int(text[:2])
+        text = ('19' if year >= 50 else '20') + text
+    fmt = '%Y%m%d%H%M%S' if len(text) >= 14 else '%Y%m%d%H%M'
+    value = datetime.datetime.strptime(text[:14], fmt)
+    # Same layout as ssl.getpeercert(): 'Oct 22 16:33:12 2026 GMT'
+    return f"{value.strftime('%b')} {value.day:>2} {value.strftime('%H:%M:%S %Y')} GMT"
+
+
+def decode_der_certificate(der_cert):
+    """
+    Decode a DER certificate into the dict layout of ssl.getpeercert().
+    Returns {} if the certificate cannot be parsed.
+    """
+    try:
+        _tag, cert_start, cert_end = _read_tlv(der_cert, 0)
+        _tag, tbs_start, tbs_end = next(_children(der_cert, cert_start, cert_end))
+        fields = list(_children(der_cert, tbs_start, tbs_end))
+
+        version = 1
+        if fields[0][0] == 0xA0:  # [0] EXPLICIT version
+            _vtag, vstart, vend = _read_tlv(der_cert, fields[0][1])
+            version = int.from_bytes(der_cert[vstart:vend], 'big') + 1
+            fields = fields[1:]
+
+        serial = der_cert[fields[0][1]:fields[0][2]].hex().upper().lstrip('0') or '0'
+        issuer = _decode_name(der_cert, fields[2][1], fields[2][2])
+        (nb_tag, nb_start, nb_end), (na_tag, na_start, na_end) = list(_children(der_cert, fields[3][1], fields[3][2]))
+        subject = _decode_name(der_cert, fields[4][1], fields[4][2])
+
+        return {
+            'subject': subject,
+            'issuer': issuer,
+            'version': version,
+            'serialNumber': serial,
+            'notBefore': _decode_time(nb_tag, der_cert[nb_start:nb_end]),
+            'notAfter': _decode_time(na_tag, der_cert[na_start:na_end]),
+        }
+    except Exception as e:
+        logger.warning(f"Could not decode DER certificate: {e}")
+        return {}
+
+
+# --- Assessment ---
+
+def new_cert_analysis():
+    return {
+        'has_tls': False,
+        'cert_valid': False,
+        'cert_details': {},
+        'security_issues': [],
+        'security_score': 0,
+        'error': None
+    }
+
+
+def assess_certificate(cert_dict, der_cert, tls_version, cipher_info, cert_analysis=None):
+    """
+    Fill a cert_analysis dict (see new_cert_analysis) from an established TLS
+    connection's peer certificate, protocol version and cipher.
+    `cert_dict` may be empty; it is then decoded from `der_cert`.
+    """
+    cert_analysis = cert_analysis or new_cert_analysis()
+    cert_analysis['has_tls'] = True
+
+    if not cert_dict and der_cert:
+        cert_dict = decode_der_certificate(der_cert)
+    if not cert_dict:
+        return cert_analysis
+
+    # Extract detailed certificate information
+    subject = dict(x[0] for x in cert_dict.get('subject', []))
+    issuer = dict(x[0] for x in cert_dict.get('issuer', []))
+
+    cert_analysis['cert_details'] = {
+        'subject': subject,
+        'issuer': issuer,
+        'common_name': subject.get('commonName', 'N/A'),
+        'organization': subject.get('organizationName', 'N/A'),
+        'valid_from': cert_dict.get('notBefore'),
+        'valid_to': cert_dict.get('notAfter'),
+        'serial_number': cert_dict.get('serialNumber'),
+        'version': cert_dict.get('version'),
+        'tls_version': tls_version,
+        'cipher': cipher_info
+    }
+
+    # Security Assessment
+    security_score = 100
+
+    # Check if self-signed
+    if subject == issuer:
+        cert_analysis['security_issues'].append('Self-signed certificate detected')
+        cert_analysis['cert_details']['self_signed'] = True
+        security_score -= 30
+    else:
+        cert_analysis['cert_details']['self_signed'] = False
+
+    # Check expiration
+    try:
+        not_after = datetime.datetime.strptime(cert_dict.get('notAfter'), CERT_DATE_FORMAT)
+        not_before = datetime.datetime.strptime(cert_dict.get('notBefore'), CERT_DATE_FORMAT)
+        now = datetime.datetime.utcnow()
+
+        if now > not_after:
+            cert_analysis['security_issues'].append('Certificate expired')
+            cert_analysis['cert_details']['expired'] = True
+            security_score -= 50
+        elif now < not_before:
+            cert_analysis['security_issues'].append('Certificate not yet valid')
+            cert_analysis['cert_details']['not_yet_valid'] = True
+            security_score -= 40
+        else:
+            cert_analysis['cert_valid'] = True
+            cert_analysis['cert_details']['expired'] = False
+
+            # Check if expiring soon (within 30 days)
+            days_until_expiry = (not_after - now).days
+            if days_until_expiry < 30:
+                cert_analysis['security_issues'].append(f'Certificate expires in {days_until_expiry} days')
+                security_score -= 10
+
+            cert_analysis['cert_details']['days_until_expiry'] = days_until_expiry
+    except Exception as date_error:
+        logger.warning(f"Error parsing certificate dates: {date_error}")
+
+    # Check cipher strength
+    if cipher_info:
+        cipher_name = cipher_info[0]
+        if any(weak in cipher_name.upper() for weak in WEAK_CIPHER_MARKERS):
+            cert_analysis['security_issues'].append(f'Weak cipher detected: {cipher_name}')
+            security_score -= 20
+
+    # Check TLS version
+    if tls_version in OUTDATED_TLS_VERSIONS:
+        cert_analysis['security_issues'].append(f'Outdated TLS version: {tls_version}')
+        security_score -= 25
+
+    # Calculate fingerprint
+    if der_cert:
+        cert_analysis['cert_details']['fingerprint_sha256'] = hashlib.sha256(der_cert).hexdigest()
+        cert_analysis['cert_details']['fingerprint_sha1'] = hashlib.sha1(der_cert).hexdigest()
+
+        # Store PEM for reference
+        pem_cert = ssl.DER_cert_to_PEM_cert(der_cert)
+        cert_analysis['cert_details']['pem_snippet'] = pem_cert[:500]
+
+    cert_analysis['security_score'] = max(0, security_score)
+    return cert_analysis
+
+
+def assess_ssl_object(ssl_obj, cert_analysis=None, host=None, port=None):
+    """
+    assess_certificate() for a connected ssl.SSLSocket / ssl.SSLObject.
+    With host and port, the analysis goes through cert_cache: an unchanged
+    certificate on the same endpoint is not decoded or assessed again.
+    """
+    der_cert = ssl_obj.getpeercert(binary_form=True)
+    tls_version = ssl_obj.version()
+    cipher_info = ssl_obj.cipher()
+    use_cache = host is not None and port is not None and der_cert
+    if use_cache:
+        fingerprint = hashlib.sha256(der_cert).hexdigest()
+        cached = cert_cache.get(host, port, fingerprint, tls_version, cipher_info)
+        if cached is not None:
+            if cert_analysis is None:
+                return cached
+            cert_analysis.update(cached)
+            return cert_analysis
+
+    cert_analysis = assess_certificate(
+        ssl_obj.getpeercert(), der_cert, tls_version, cipher_info, cert_analysis=cert_analysis,
+    )
+    if use_cache:
+        cert_cache.put(host, port, cert_analysis)
+    return cert_analysis
+
+
+class CertAnalysisCache:
+    """
+    TTL + LRU cache of cert_analysis dicts keyed by (host, port); thread-safe.
+
+    get() takes the fingerprint, TLS version and cipher of the session at hand
+    and only hits if they match what was assessed. Entries are copied in and
+    out, so callers may mutate what they get back.
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = CERT_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max(1, max_entries or CERT_CACHE_SIZE)
+        self._entries = OrderedDict()  # (host, port) -> (stored_at, fingerprint, tls_version, cipher, analysis)
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'fingerprint_changes': 0,  # Entry found but the endpoint now presents another certificate/cipher
+            'evictions': 0,
+        }
+
+    def get(self, host, port, fingerprint, tls_version=None, cipher_info=None):
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            stored_at, cached_fp, cached_version, cached_cipher, analysis = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            if (fingerprint, tls_version, tuple(cipher_info or ())) != (cached_fp, cached_version, cached_cipher):
+                del self._entries[key]
+                self.stats['fingerprint_changes'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return copy.deepcopy(analysis)
+
+    def put(self, host, port, cert_analysis):
+        """Cache an assessed cert_analysis; it is validated by its own fingerprint, TLS version and cipher."""
+        details = cert_analysis.get('cert_details') or {}
+        if not details.get('fingerprint_sha256'):
+            return
+        entry = (time.monotonic(), details['fingerprint_sha256'], details.get('tls_version'),
+                 tuple(details.get('cipher') or ()), copy.deepcopy(cert_analysis))
+        with self._lock:
+            self._entries[(host, port)] = entry
+            self._entries.move_to_end((host, port))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                ttl_seconds=self.ttl,
+                hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else None,
+            )
+
+
+# Shared by every scan and job in the process
+cert_cache = CertAnalysisCache()
+
+
+def cert_info_from_analysis(cert_analysis):
+    """Project a cert_analysis onto the flat cert_info layout used by the API/CSV."""
+    details = (cert_analysis or {}).get('cert_details') or {}
+    pem = details.get('pem_snippet')
+    return {
+        'subject': details.get('subject'),
+        'issuer': details.get('issuer'),
+        'valid_from': details.get('valid_from'),
+        'valid_to': details.get('valid_to'),
+        'serial_number': details.get('serial_number'),
+        'version': details.get('version'),
+        'pem_snippet': pem.strip() if pem else None,
+        'error': (cert_analysis or {}).get('error'),
+    }
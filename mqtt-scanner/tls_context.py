@@ -0,0 +1,169 @@
+"""
+Process-wide TLS client contexts and session resumption.
+
+Every TLS connection the scanner makes gets its SSLContext from
+tls_contexts.context(profile): one context per TlsProfile (verification,
+client certificate, minimum version), built on first use and shared from
+then on, instead of a new create_default_context() per connection.
+
+The factory also keeps the last TLS session (ticket) per (profile, host,
+port). The next connection to the same endpoint, later in the scan or in the
+next scheduled scan, offers it and the broker can resume instead of running
+a full handshake. asyncio has no way to pass a session to open_connection(),
+so contexts come from a small SSLContext subclass that takes the session
+from a context variable: `with tls_contexts.resuming(host, port, ctx): ...`.
+Resumed handshakes still carry the certificate, so assessment is unchanged.
+
+Usage:
+    ctx = tls_contexts.context()                      # no verification (scanner default)
+    with tls_contexts.resuming(host, port, ctx):
+        reader, writer = await asyncio.open_connection(host, port, ssl=ctx)
+    ...                                               # after some traffic (TLS 1.3 tickets)
+    tls_contexts.remember(host, port, ctx, writer.get_extra_info('ssl_object'))
+"""
+import contextvars
+import os
+import ssl
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+TLS_SESSION_CACHE_SIZE = int(os.environ.get('SCAN_TLS_SESSION_CACHE_SIZE', 4096))
+# Upper bound on how long a session is offered; the server's ticket lifetime applies as well
+TLS_SESSION_MAX_AGE = int(os.environ.get('SCAN_TLS_SESSION_MAX_AGE', 3600))
+TLS_RESUMPTION = os.environ.get('SCAN_TLS_RESUMPTION', '1').lower() not in ('0', 'false', 'no')
+
+TlsProfile = namedtuple('TlsProfile', ['verify', 'certfile', 'keyfile', 'min_version'],
+                        defaults=(False, None, None, None))
+NO_VERIFY = TlsProfile()
+
+_offered_session = contextvars.ContextVar('offered_tls_session', default=None)
+
+
+class _ResumingContext(ssl.SSLContext):
+    """SSLContext whose client connections offer the session set by TlsContextFactory.resuming()."""
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = _offered_session.get()
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True,
+                    server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = _offered_session.get()
+        return super().wrap_socket(sock, server_side, do_handshake_on_connect, suppress_ragged_eofs,
+                                   server_hostname, session)
+
+
+def _build_context(profile):
+    ctx = _ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+    if profile.verify:
+        ctx.load_default_certs()
+    else:
+        # Scanned (and monitored) brokers are often self-signed; the certificate is assessed, not trusted
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    if profile.certfile:
+        ctx.load_cert_chain(profile.certfile, profile.keyfile)
+    if profile.min_version:
+        ctx.minimum_version = ssl.TLSVersion[profile.min_version]
+    return ctx
+
+
+class TlsContextFactory:
+    """Shared contexts per TlsProfile plus an LRU cache of resumable sessions; thread-safe."""
+
+    def __init__(self, max_sessions=None, max_age=None, resumption=None):
+        self.max_sessions = max(1, max_sessions or TLS_SESSION_CACHE_SIZE)
+        self.max_age = TLS_SESSION_MAX_AGE if max_age is None else max_age
+        self.resumption = TLS_RESUMPTION if resumption is None else resumption
+        self._contexts = {}   # profile -> context
+        self._profiles = {}   # id(context) -> profile
+        self._sessions = OrderedDict()  # (profile, host, port) -> SSLSession
+        self._lock = threading.Lock()
+        self.stats = {'handshakes': 0, 'resumed': 0, 'offered': 0}
+
+    def context(self, profile=None):
+        profile = profile or NO_VERIFY
+        with self._lock:
+            ctx = self._contexts.get(profile)
+            if ctx is None:
+                ctx = self._contexts[profile] = _build_context(profile)
+                self._profiles[id(ctx)] = profile
+            return ctx
+
+    def _key(self, host, port, ctx):
+        # Contexts built elsewhere (or None for plaintext) take no part in resumption
+        profile = self._profiles.get(id(ctx)) if ctx is not None else None
+        return None if profile is None else (profile, host, int(port))
+
+    def session(self, host, port, ctx):
+        """A still valid session for this endpoint, or None."""
+        key = self._key(host, port, ctx)
+        if not self.resumption or key is None:
+            return None
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            expires = session.time + min(session.timeout, self.max_age)
+            if time.time() >= expires:
+                del self._sessions[key]
+                return None
+            self._sessions.move_to_end(key)
+            return session
+
+    @contextmanager
+    def resuming(self, host, port, ctx):
+        """Connections opened with `ctx` inside this block offer the endpoint's cached session."""
+        session = self.session(host, port, ctx)
+        if session is not None:
+            with self._lock:
+                self.stats['offered'] += 1
+        token = _offered_session.set(session)
+        try:
+            yield session
+        finally:
+            _offered_session.reset(token)
+
+    def remember(self, host, port, ctx, ssl_obj):
+        """
+        Count a completed handshake and keep its session for the next connection.
+        Call once the connection has carried some traffic: TLS 1.3 tickets arrive
+        after the handshake.
+        """
+        if ssl_obj is None or not isinstance(ctx, _ResumingContext):
+            return
+        reused = ssl_obj.session_reused
+        with self._lock:
+            self.stats['handshakes'] += 1
+            self.stats['resumed'] += bool(reused)
+        session = ssl_obj.session
+        if not self.resumption or session is None or not (session.has_ticket or session.id):
+            return
+        key = self._key(host, port, ctx)
+        if key is None:
+            return
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['sessions'] = len(self._sessions)
+            stats['contexts'] = len(self._contexts)
+        stats['full_handshakes'] = stats['handshakes'] - stats['resumed']
+        stats['resumption_rate'] = round(stats['resumed'] / stats['handshakes'], 3) if stats['handshakes'] else None
+        return stats
+
+
+tls_contexts = TlsContextFactory()
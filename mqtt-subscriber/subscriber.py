@@ -4,14 +4,21 @@ MQTT Subscriber Tool
 Subscribe to MQTT topics and monitor messages
 """
 
+import os
+import sys
 import paho.mqtt.client as mqtt
-import json
 import time
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mqtt-scanner'))
+from message_log import MessageLogWriter
+
 class MQTTSubscriber:
-    def __init__(self):
-        self.messages = []
+    def __init__(self, capture_dir=None):
+        # Messages are streamed to a binary capture (mqtt-scanner/message_log.py) as they arrive
+        self.capture_dir = capture_dir or f"mqtt_messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.log = None
+        self.source = ''
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -25,17 +32,9 @@ class MQTTSubscriber:
     def on_message(self, client, userdata, msg):
         timestamp = datetime.now()
         topic = msg.topic
-        payload = msg.payload.decode('utf-8', errors='ignore')
-        
-        message_data = {
-            'timestamp': timestamp.isoformat(),
-            'topic': topic,
-            'payload': payload,
-            'qos': msg.qos,
-            'retain': msg.retain
-        }
-        
-        self.messages.append(message_data)
+        if self.log is not None:
+            self.log.write(msg, timestamp.timestamp(), source=self.source)
+        payload = msg.payload.decode('utf-8', errors='replace')
         
         # Print message
         print(f"📥 [{timestamp.strftime('%H:%M:%S')}] {topic}")
@@ -47,6 +46,10 @@ class MQTTSubscriber:
         """Start monitoring MQTT messages"""
         print(f"Starting MQTT subscriber on {host}:{port}")
         
+        self.source = f"{host}:{port}"
+        if self.log is None:
+            self.log = MessageLogWriter(self.capture_dir)
+        
         client = mqtt.Client()
         client.on_connect = self.on_connect
         client.on_message = self.on_message
@@ -75,14 +78,16 @@ class MQTTSubscriber:
             client.disconnect()
         except Exception as e:
             print(f"❌ Error: {e}")
+            self.save_messages()
     
     def save_messages(self):
-        """Save captured messages to file"""
-        if self.messages:
-            filename = f"mqtt_messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(filename, 'w') as f:
-                json.dump(self.messages, f, indent=2)
-            print(f"💾 Saved {len(self.messages)} messages to {filename}")
+        """Close the capture (writes its index); replay with mqtt-scanner/message_log.py"""
+        if self.log is None:
+            return
+        self.log.close()
+        if self.log.written:
+            print(f"💾 Saved {self.log.written} messages to {self.capture_dir}/")
+        self.log = None
 
 if __name__ == "__main__":
     subscriber = MQTTSubscriber()
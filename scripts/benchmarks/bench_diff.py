@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Scan diff benchmark.
+
+Writes two synthetic scans of the same targets (default 200k rows each) to a
+throwaway result store, with a small fraction of targets changed in the
+second (anonymous access opened, certificate replaced or expired, new topics,
+classification flips, targets added/removed), then diffs them with
+scan_diff.diff_scans and reports rows/s and the change counts.
+
+Usage: python bench_diff.py [--rows 200000] [--changed 0.01]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+from result_store import ResultStore
+from scan_diff import diff_scans
+
+
+def make_row(i):
+    ip = f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+    port = 8883 if i % 2 else 1883
+    row = {'ip': ip, 'port': port, 'result': 'error:connection_refused', 'classification': 'closed_or_unreachable',
+           'risk_level': None, 'tls': port == 8883, 'publishers': [], 'timestamp': '2026-01-01T00:00:00'}
+    if i % 5 == 0:
+        row.update(result='connected', classification='open_or_auth_ok', risk_level='MEDIUM',
+                   cert_fingerprint=f'{i:064x}' if row['tls'] else None,
+                   publishers=[{'topic': f'site/{i}/temp', 'payload': '21.5'}])
+    return row
+
+
+def mutate(row, rng):
+    row = dict(row)
+    kind = rng.randrange(4)
+    if kind == 0:
+        row.update(classification='open_or_auth_ok', anonymous_allowed=True, risk_level='CRITICAL')
+    elif kind == 1:
+        row.update(cert_fingerprint=f'{rng.getrandbits(256):064x}', cert_expired=rng.random() < 0.5)
+    elif kind == 2:
+        row['publishers'] = list(row['publishers']) + [{'topic': f'new/{rng.random()}', 'payload': '1'}]
+    else:
+        row.update(classification='not_authorized', risk_level='LOW')
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--changed', type=float, default=0.01, help='fraction of targets changed')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+    started = time.perf_counter()
+    with store.writer('old') as old, store.writer('new') as new:
+        for i in range(args.rows):
+            row = make_row(i)
+            if i % 1000 != 999:      # a few targets only in the new scan
+                old.add(row)
+            if i % 1000 != 500:      # and a few only in the old one
+                new.add(mutate(row, rng) if rng.random() < args.changed else row)
+    print(f"wrote 2x{args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+    stats = Counter()
+    started = time.perf_counter()
+    changes = sum(1 for _ in diff_scans(store, 'old', 'new', stats))
+    elapsed = time.perf_counter() - started
+    print(f"diff: compared={stats['compared']}  changes={changes}  time={elapsed:.2f}s  "
+          f"rows/s={stats['compared'] / elapsed:,.0f}")
+    print({k: v for k, v in stats.items() if k not in ('compared', 'changed')})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Message handler micro-benchmark.
+
+Feeds synthetic PUBLISH messages (default 100k) through the same per-message
+path a probe's listen window uses (ProbeCapture.add, then finish) and reports
+messages/s, topics kept vs. estimated and captured payload bytes for a few
+topic-count shapes, from a handful of hot topics up to one topic per message.
+
+Usage: python bench_handler.py [--messages 100000] [--topics 10 1000 10000 100000] [--max-topics N]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+from capture import ProbeCapture
+from mqtt_probe import Message
+
+
+def make_messages(count, topics):
+    payload = b'{"temperature": 21.5, "humidity": 40, "device": "sensor"}'
+    messages = []
+    for i in range(count):
+        if i % 10 == 0:
+            topic = f'$SYS/broker/clients/client-{i % 50}'
+        else:
+            topic = f'site/{i % topics // 100}/device/{i % topics}'
+        messages.append(Message(topic, payload, 0, i < topics))
+    return messages
+
+
+def bench(messages, max_topics=None, capture_all=True):
+    capture = ProbeCapture('127.0.0.1', 1883, capture_all=capture_all, max_topics=max_topics)
+    started = time.perf_counter()
+    for msg in messages:
+        capture.add(msg)
+    result = capture.finish({})
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--topics', type=int, nargs='*', default=[10, 1000, 10000, 100000])
+    parser.add_argument('--max-topics', type=int, default=None, help='topic cap (default SCAN_CAPTURE_MAX_TOPICS)')
+    args = parser.parse_args()
+
+    # "Detected publisher" is logged at INFO once per new topic; keep it out of the timing
+    logging.getLogger('capture').setLevel(logging.WARNING)
+
+    for topics in args.topics:
+        messages = make_messages(args.messages, topics)
+        elapsed, result = bench(messages, max_topics=args.max_topics)
+        stats = result['capture']
+        print(f"topics={topics:>6}  messages={len(messages)}  time={elapsed:6.3f}s  "
+              f"msgs/s={len(messages) / elapsed:10.0f}  kept={stats['topics_kept']}  "
+              f"seen~{stats['topics_seen']}  evicted={stats['topics_evicted']}  "
+              f"payload_bytes={stats['payload_bytes']}")
+
+
+if __name__ == '__main__':
+    main()
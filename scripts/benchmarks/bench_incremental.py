@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Incremental rescan benchmark.
+
+Scans a small stand-in fleet (plaintext brokers, TLS brokers and addresses
+with nothing listening) through /api/scan twice: a full scan, then an
+"incremental": true rescan of the same, unchanged fleet. Reports the wall
+time of both and how the rescan handled each target (reused, confirmed,
+changed, new, stale). Results go to a throwaway SQLite store.
+
+Usage: python bench_incremental.py [--plain 20] [--tls 10] [--closed 30] [--listen 3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+import fake_broker
+
+RETAINED = {'sensors/dht': b'{"t":21.5,"h":40}', '$SYS/broker/clients/connected': b'3'}
+
+
+def start_farm(plain, tls):
+    ready = threading.Event()
+
+    def serve():
+        async def main():
+            await fake_broker.start_brokers(plain, 1883, retained=RETAINED)
+            await fake_broker.start_brokers(tls, 8883, retained=RETAINED,
+                                            ssl_context=fake_broker.self_signed_context())
+            ready.set()
+            await asyncio.Event().wait()
+        asyncio.run(main())
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plain', type=int, default=20, help='plaintext brokers on :1883')
+    parser.add_argument('--tls', type=int, default=10, help='TLS brokers on :8883')
+    parser.add_argument('--closed', type=int, default=30, help='addresses with nothing listening')
+    parser.add_argument('--listen', type=int, default=3, help='listen_duration sent to /api/scan')
+    args = parser.parse_args()
+
+    os.environ.setdefault('MAX_SCANS_PER_WINDOW', '1000')
+    os.environ['SCAN_RESULTS_DB'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    import app
+
+    total = args.plain + args.tls + args.closed
+    addresses = [f'127.0.2.{i}' for i in range(1, total + 1)]
+    start_farm(addresses[:args.plain], addresses[args.plain:args.plain + args.tls])
+    client = app.app.test_client()
+    headers = {'X-API-KEY': app.FLASK_API_KEY}
+    target = f'127.0.2.1-{total}'
+
+    for label, incremental in (('full', False), ('incremental', True)):
+        started = time.perf_counter()
+        resp = client.post('/api/scan', headers=headers, json={
+            'target': target, 'ports': [1883, 8883], 'listen_duration': args.listen,
+            'capture_all_topics': True, 'wait': True, 'incremental': incremental,
+        })
+        elapsed = time.perf_counter() - started
+        results = resp.get_json()['results']
+        statuses = Counter((r.get('incremental') or {}).get('status', '-') for r in results)
+        publishers = sum(len(r.get('publishers') or []) for r in results)
+        print(f"{label:>11}  time={elapsed:6.2f}s  results={len(results)}  publishers={publishers}  "
+              f"statuses={dict(statuses)}")
+
+
+if __name__ == '__main__':
+    main()
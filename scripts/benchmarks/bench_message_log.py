@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Message capture benchmark.
+
+Writes synthetic traffic (default 500k messages over 2k topics from 4 brokers,
+mixed text and binary payloads) to a message_log capture and, for comparison,
+as the JSON lines the monitor used to write (base64 for binary payloads).
+Reports write rate and bytes on disk for both, then the time for a full
+replay, a single-topic query, a wildcard query and a seek to a one-minute
+window near the end of the capture.
+
+Usage: python bench_message_log.py [--messages 500000] [--topics 2000]
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+from message_log import MessageLogReader, MessageLogWriter
+from mqtt_probe import Message
+
+
+def make_messages(count, topics, rng):
+    names = [f'site{i % 50}/dev{i}/{rng.choice(["temp", "rh", "state", "raw"])}' for i in range(topics)]
+    for i in range(count):
+        topic = names[rng.randrange(topics)]
+        if topic.endswith('raw'):
+            payload = rng.randbytes(32)
+        else:
+            payload = f'{{"v": {rng.uniform(0, 100):.2f}, "seq": {i}}}'.encode()
+        yield f'10.0.0.{i % 4 + 1}:1883', Message(topic, payload, i % 2, i % 97 == 0)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path))
+
+
+def timed(label, fn):
+    started = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {count:>9} msgs  {elapsed * 1000:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--topics', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    traffic = list(make_messages(args.messages, args.topics, rng))
+    t0 = 1_700_000_000.0
+    root = tempfile.mkdtemp()
+
+    started = time.perf_counter()
+    with open(os.path.join(root, 'messages.jsonl'), 'w', encoding='utf-8') as f:
+        for i, (source, msg) in enumerate(traffic):
+            record = {'ts': datetime.datetime.utcfromtimestamp(t0 + i * 0.01).isoformat(), 'broker': source,
+                      'topic': msg.topic, 'qos': msg.qos, 'retain': msg.retain}
+            try:
+                record['payload'] = msg.payload.decode('utf-8')
+            except UnicodeDecodeError:
+                record['payload_b64'] = base64.b64encode(msg.payload).decode('ascii')
+            f.write(json.dumps(record) + '\n')
+    json_elapsed = time.perf_counter() - started
+    json_size = os.path.getsize(os.path.join(root, 'messages.jsonl'))
+
+    capture = os.path.join(root, 'capture')
+    started = time.perf_counter()
+    with MessageLogWriter(capture, max_bytes=16 * 1024 * 1024, segments=1000) as log:
+        for i, (source, msg) in enumerate(traffic):
+            log.write(msg, t0 + i * 0.01, source=source)
+    bin_elapsed = time.perf_counter() - started
+    bin_size = dir_size(capture)
+
+    print(f"jsonl   write {args.messages / json_elapsed:>10,.0f} msg/s  {json_size / 1e6:8.1f} MB")
+    print(f"binary  write {args.messages / bin_elapsed:>10,.0f} msg/s  {bin_size / 1e6:8.1f} MB (with index)")
+
+    topic = traffic[-1][1].topic
+    end = t0 + args.messages * 0.01
+    with MessageLogReader(capture) as reader:
+        timed('full replay', lambda: sum(1 for _ in reader.replay()))
+        timed(f'topic {topic}', lambda: sum(1 for _ in reader.replay(topic=topic)))
+        timed('wildcard site7/+/temp', lambda: sum(1 for _ in reader.replay(topic='site7/+/temp')))
+        timed('seek 60s window at end', lambda: sum(1 for _ in reader.replay(since=end - 120, until=end - 60)))
+
+
+if __name__ == '__main__':
+    main()
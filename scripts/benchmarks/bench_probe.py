@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Per-broker probe cost benchmark.
+
+Runs /api/scan (through the Flask test client, wait mode) against a plaintext
+and a TLS stand-in broker and reports, per broker: wall time, number of TCP
+connections the broker accepted, and whether certificate, CONNACK, $SYS and
+topic data all came back from that single pass.
+
+Usage: python bench_probe.py [--listen 3] [--listen-mode adaptive|fixed] [--rounds 3]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+import fake_broker
+
+RETAINED = {'sensors/dht': b'{"t":21.5,"h":40}', '$SYS/broker/clients/connected': b'3'}
+BROKERS = [
+    ('127.0.0.41', 1883, None),
+    ('127.0.0.42', 8883, 'tls'),
+]
+
+
+def start_farm():
+    ready = threading.Event()
+
+    def serve():
+        async def main():
+            for addr, port, mode in BROKERS:
+                ctx = fake_broker.self_signed_context() if mode == 'tls' else None
+                await fake_broker.start_brokers([addr], port, retained=RETAINED, ssl_context=ctx)
+            ready.set()
+            await asyncio.Event().wait()
+        asyncio.run(main())
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', type=int, default=3, help='listen_duration sent to /api/scan')
+    parser.add_argument('--listen-mode', default='adaptive', choices=['adaptive', 'fixed'])
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MAX_SCANS_PER_WINDOW', '1000')
+    import app
+    start_farm()
+    client = app.app.test_client()
+    headers = {'X-API-KEY': app.FLASK_API_KEY}
+
+    for addr, port, mode in BROKERS:
+        timings = []
+        for _ in range(args.rounds):
+            before = fake_broker.connection_counts[(addr, port)]
+            started = time.perf_counter()
+            resp = client.post('/api/scan', headers=headers, json={
+                'target': addr, 'listen_duration': args.listen, 'listen_mode': args.listen_mode,
+                'capture_all_topics': True, 'wait': True,
+            })
+            timings.append(time.perf_counter() - started)
+            connections = fake_broker.connection_counts[(addr, port)] - before
+
+        row = next(r for r in resp.get_json()['results'] if r['port'] == port)
+        cert = (row.get('cert_info') or {}).get('subject')
+        listen = row.get('listen') or {}
+        print(f"{mode or 'plain':>5} {addr}:{port}  median={statistics.median(timings):5.2f}s  "
+              f"connections/scan={connections}  classification={row['classification']}  "
+              f"cert_subject={'yes' if cert else 'no'}  sys_topics={row.get('sys_topic_count')}  "
+              f"regular_topics={row.get('regular_topic_count')}  "
+              f"listen={listen.get('duration')}s/{listen.get('end_reason')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Scheduler throughput benchmark.
+
+Starts stand-in brokers on a slice of 127.0.0.0/8 and scans a /22 and a /20
+through ScanScheduler, reporting overall throughput, per-second completion
+rate spread and the peak number of live threads.
+
+Usage: python bench_scheduler.py [--density 16] [--listen 0.5] [--concurrency 128]
+"""
+import argparse
+import asyncio
+import ipaddress
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+import scanner
+from scheduler import ScanScheduler
+from fake_broker import start_brokers
+
+BROKER_PORT = 1883
+
+
+def bench_range(cidr, args):
+    hosts = [str(ip) for ip in ipaddress.ip_network(cidr).hosts()]
+    broker_hosts = hosts[::args.density]
+    completions = []
+    peak_threads = 0
+
+    async def run():
+        nonlocal peak_threads
+        servers = await start_brokers(broker_hosts, BROKER_PORT)
+
+        async def worker(ip, port):
+            return await scanner.async_scan_port(ip, port, None)
+
+        def on_result(_res):
+            nonlocal peak_threads
+            completions.append(time.time())
+            peak_threads = max(peak_threads, threading.active_count())
+
+        scheduler = ScanScheduler(worker, max_concurrency=args.concurrency,
+                                  per_host_limit=args.per_host)
+        try:
+            await scheduler.run(((ip, BROKER_PORT) for ip in hosts), on_result=on_result)
+        finally:
+            for s in servers:
+                s.close()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    elapsed = scheduler.stats['finished_at'] - scheduler.stats['started_at']
+
+    # Completions per one-second bucket, ignoring the partial first/last buckets
+    start = scheduler.stats['started_at']
+    buckets = {}
+    for t in completions:
+        buckets[int(t - start)] = buckets.get(int(t - start), 0) + 1
+    rates = [buckets.get(i, 0) for i in range(1, max(buckets or [0]))] or [len(completions)]
+
+    print(f"{cidr:>16}  tasks={len(hosts):>5}  brokers={len(broker_hosts):>4}  "
+          f"time={elapsed:6.2f}s  throughput={scheduler.throughput():7.1f}/s  "
+          f"per-sec min/avg/max={min(rates)}/{sum(rates) / len(rates):.0f}/{max(rates)}  "
+          f"peak_threads={peak_threads}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--density', type=int, default=16, help='one stand-in broker every N hosts')
+    parser.add_argument('--listen', type=float, default=0.5, help='LISTEN_DURATION override (seconds)')
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--per-host', type=int, default=2)
+    parser.add_argument('ranges', nargs='*', default=['127.10.0.0/22', '127.20.0.0/20'])
+    args = parser.parse_args()
+
+    scanner.LISTEN_DURATION = args.listen
+    for cidr in args.ranges:
+        bench_range(cidr, args)
+
+
+if __name__ == '__main__':
+    main()
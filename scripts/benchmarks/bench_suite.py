@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Scanner benchmark suite against a local broker farm (see broker_farm.py).
+
+Runs three scenarios over the same farm of stand-in brokers (anonymous,
+auth-required, TLS, slow CONNACK, black hole, high message rate):
+
+    run_scan   one scan of every farm address on 1883 and 8883
+    scan_ip    scan_ip() of one address per variant, one after the other
+    api_scan   POST /api/scan with "wait": true through the Flask test client
+               (results go to a throwaway SQLite store)
+
+and reports, per scenario: wall time, probes/s, probe latency percentiles
+(result['timings']['total'], or per call for scan_ip), outcomes per variant,
+peak RSS and peak thread count. The farm runs on one extra thread of this
+process, so RSS and threads include it (a constant offset).
+
+--json writes the numbers to a file; --baseline compares against such a file
+and prints the change, so regressions show up as numbers.
+
+Usage: python bench_suite.py [--per-variant 8] [--listen 1] [--scenario run_scan]
+                             [--json out.json] [--baseline previous.json]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+# Before app is imported: keep benchmark rows out of the real result store
+os.environ.setdefault('SCAN_RESULTS_DB', os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+
+from broker_farm import BrokerFarm, CREDENTIALS, VARIANTS
+from metrics import StageTimings, STAGE_TOTAL
+
+SCENARIOS = ('run_scan', 'scan_ip', 'api_scan')
+CREDS = {'user': CREDENTIALS[0], 'pass': CREDENTIALS[1]}
+
+
+def _proc_status():
+    """(rss bytes, OS threads) of this process."""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['Threads'])
+    except (OSError, KeyError, ValueError):
+        # Not Linux: peak RSS so far and Python threads only
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, threading.active_count()
+
+
+class ResourceSampler:
+    """Samples RSS and thread count every `interval` seconds while in use; keeps the peaks."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.rss_start, self.threads_start = _proc_status()
+        self.rss_peak, self.threads_peak = self.rss_start, self.threads_start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss, threads = _proc_status()
+            self.rss_peak = max(self.rss_peak, rss)
+            self.threads_peak = max(self.threads_peak, threads - 1)  # Not counting the sampler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _latency(timings):
+    stats = timings.summary().get(STAGE_TOTAL, {})
+    return {k: stats.get(k) for k in ('p50', 'p95', 'p99', 'max')}
+
+
+def _outcomes(farm, results):
+    by_variant = defaultdict(Counter)
+    for res in results:
+        by_variant[farm.variant_of(res.get('ip'))][res.get('classification')] += 1
+    return {variant: dict(counts) for variant, counts in by_variant.items()}
+
+
+def bench_run_scan(farm, args):
+    from scanner import run_scan
+    timings = StageTimings()
+    results = run_scan(farm.target, creds=CREDS, ports=farm.ports, listen_secs=args.listen, timings=timings)
+    return results, _latency(timings)
+
+
+def bench_scan_ip(farm, args):
+    from scanner import scan_ip, parse_ports
+    results, calls = [], StageTimings()
+    for addrs in farm.addresses.values():
+        started = time.monotonic()
+        results += scan_ip(addrs[0], CREDS, listen_secs=args.listen, ports=parse_ports(farm.ports))
+        calls.add_stage(STAGE_TOTAL, round((time.monotonic() - started) * 1000, 1))
+    return results, _latency(calls)
+
+
+def bench_api_scan(farm, args):
+    import app
+    client = app.app.test_client()
+    client.application.logger.setLevel('WARNING')
+    response = client.post('/api/scan', headers={'X-API-KEY': app.FLASK_API_KEY}, json={
+        'target': farm.target, 'ports': farm.ports, 'creds': CREDS, 'wait': True,
+        'listen_duration': args.listen, 'capture_all_topics': True,
+    })
+    body = response.get_json()
+    if response.status_code != 200:
+        raise RuntimeError(f"/api/scan answered {response.status_code}: {body}")
+    status = app.scan_jobs.get(body['job_id']).to_status()
+    stats = status['timings'].get(STAGE_TOTAL, {})
+    return body['results'], {k: stats.get(k) for k in ('p50', 'p95', 'p99', 'max')}
+
+
+BENCHES = {'run_scan': bench_run_scan, 'scan_ip': bench_scan_ip, 'api_scan': bench_api_scan}
+
+
+def run_scenario(name, farm, args):
+    with ResourceSampler() as sampler:
+        started = time.monotonic()
+        results, latency = BENCHES[name](farm, args)
+        elapsed = time.monotonic() - started
+    return {
+        'results': len(results),
+        'wall_secs': round(elapsed, 3),
+        'probes_per_sec': round(len(results) / elapsed, 2) if elapsed else None,
+        'latency_ms': latency,
+        'peak_rss_mb': round(sampler.rss_peak / 2 ** 20, 1),
+        'rss_growth_mb': round((sampler.rss_peak - sampler.rss_start) / 2 ** 20, 1),
+        'peak_threads': sampler.threads_peak,
+        'outcomes': _outcomes(farm, results),
+    }
+
+
+def _change(old, new):
+    if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old:
+        return ''
+    return f' ({(new - old) / old * 100:+.0f}%)'
+
+
+def report(name, numbers, baseline=None):
+    base = (baseline or {}).get(name, {})
+    lat, base_lat = numbers['latency_ms'], base.get('latency_ms', {})
+    print(f"\n== {name}: {numbers['results']} results")
+    print(f"  wall       {numbers['wall_secs']:.2f}s{_change(base.get('wall_secs'), numbers['wall_secs'])}"
+          f"   probes/s {numbers['probes_per_sec']}{_change(base.get('probes_per_sec'), numbers['probes_per_sec'])}")
+    print("  latency ms " + "  ".join(f"{k}={lat[k]}{_change(base_lat.get(k), lat[k])}" for k in lat))
+    print(f"  peak RSS   {numbers['peak_rss_mb']} MB{_change(base.get('peak_rss_mb'), numbers['peak_rss_mb'])}"
+          f" (+{numbers['rss_growth_mb']} MB)   peak threads {numbers['peak_threads']}"
+          f"{_change(base.get('peak_threads'), numbers['peak_threads'])}")
+    for variant, counts in sorted(numbers['outcomes'].items(), key=lambda i: str(i[0])):
+        print(f"  {str(variant):<10} {counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--per-variant', type=int, default=8, help='brokers per variant')
+    parser.add_argument('--variant', action='append', choices=list(VARIANTS), help='default: all')
+    parser.add_argument('--listen', type=float, default=1, help='listen window upper bound (seconds)')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: all')
+    parser.add_argument('--json', help='write the numbers to this file')
+    parser.add_argument('--baseline', help='compare against a file written by --json')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    farm = BrokerFarm(args.per_variant, args.variant).start()
+    print(f"Farm: {len(farm.addresses)} variants x {args.per_variant} brokers, target {farm.target}")
+    numbers = {}
+    try:
+        for name in args.scenario or SCENARIOS:
+            numbers[name] = run_scenario(name, farm, args)
+    finally:
+        farm.stop()
+    for name, values in numbers.items():
+        report(name, values, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(numbers, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Port-sweep throughput benchmark.
+
+Starts stand-in brokers on a slice of 127.0.0.0/8, sweeps every host x port
+pair of the given ranges with PortSweeper and reports hosts/s and the
+open/closed/filtered split. Pass --full to run the whole scan (sweep + MQTT
+probe of the open ports) through scanner.run_scan instead.
+
+Usage: python bench_sweep.py [--density 64] [--in-flight 10000] [--full] [ranges ...]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-scanner'))
+
+import scanner
+from sweep import PortSweeper
+from targets import TargetSet
+from fake_broker import start_brokers
+
+PORTS = scanner.COMMON_PORTS
+
+
+def start_farm(broker_hosts):
+    ready = threading.Event()
+
+    def serve():
+        async def main():
+            await start_brokers(broker_hosts, 1883)
+            ready.set()
+            await asyncio.Event().wait()
+        asyncio.run(main())
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+
+
+def bench_range(cidr, args):
+    hosts = list(TargetSet(cidr))
+    start_farm(hosts[::args.density])
+
+    started = time.perf_counter()
+    if args.full:
+        results = scanner.run_scan(cidr, sweep=True)
+        elapsed = time.perf_counter() - started
+        probed = sum(1 for r in results if 'sweep' not in r)
+        print(f"{cidr:>16}  full scan  results={len(results)}  probed={probed}  time={elapsed:6.2f}s")
+        return
+
+    sweeper = PortSweeper(max_in_flight=args.in_flight, ports_per_host=len(PORTS))
+    peak = 0
+
+    async def run():
+        nonlocal peak
+        async for _res in sweeper.sweep((ip, p) for ip in hosts for p in PORTS):
+            peak = max(peak, sweeper.stats['in_flight'])
+
+    asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    stats = sweeper.stats
+    print(f"{cidr:>16}  hosts={len(hosts):>6}  pairs={stats['attempted']:>6}  time={elapsed:6.2f}s  "
+          f"hosts/s={sweeper.hosts_per_second():8.1f}  open={stats['open']}  closed={stats['closed']}  "
+          f"filtered={stats['filtered']}  peak_in_flight={peak}  max_in_flight={sweeper.max_in_flight}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--density', type=int, default=64, help='one stand-in broker every N hosts')
+    parser.add_argument('--in-flight', type=int, default=10000)
+    parser.add_argument('--full', action='store_true', help='run the full sweep + probe scan through run_scan')
+    parser.add_argument('ranges', nargs='*', default=['127.30.0.0/20', '127.40.0.0/16'])
+    args = parser.parse_args()
+
+    for cidr in args.ranges:
+        bench_range(cidr, args)
+
+
+if __name__ == '__main__':
+    main()
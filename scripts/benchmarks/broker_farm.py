@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+A farm of stand-in brokers (fake_broker) for repeatable scanner benchmarks.
+
+Each variant listens on its own loopback addresses (127.0.<n>.1 ...) so one
+scan over the farm's target spec hits every kind of endpoint:
+
+    anonymous   plaintext, anonymous access, a few retained topics
+    auth        plaintext, CONNACK 5 unless the farm's credentials are sent
+    tls         TLS with the repo's self-signed test certificate
+    slow        CONNACK after SLOW_CONNACK_SECS
+    blackhole   accepts connections, never answers
+    firehose    streams FIREHOSE_RATE messages/s after SUBSCRIBE
+
+Plaintext variants listen on 1883 and TLS on 8883; scanning both ports on
+every address also gives one refused port per address.
+
+Usage:
+    farm = BrokerFarm(per_variant=8).start()      # background event loop thread
+    run_scan(farm.target, ports=farm.ports)
+    farm.stop()
+    python broker_farm.py --per-variant 8         # serve until Ctrl+C
+"""
+import argparse
+import asyncio
+import threading
+
+import fake_broker
+
+PLAIN_PORT = 1883
+TLS_PORT = 8883
+CREDENTIALS = ('bench', 'bench-pass')
+SLOW_CONNACK_SECS = 1.5
+FIREHOSE_RATE = 2000
+RETAINED = {'sensors/dht': b'{"t":21.5,"h":40}', 'site/door': b'closed',
+            '$SYS/broker/version': b'fake 1.0', '$SYS/broker/clients/connected': b'3'}
+
+# name -> (port, start_brokers options); subnets are assigned in this order
+VARIANTS = {
+    'anonymous': (PLAIN_PORT, dict(retained=RETAINED)),
+    'auth': (PLAIN_PORT, dict(retained=RETAINED, credentials=CREDENTIALS)),
+    'tls': (TLS_PORT, dict(retained=RETAINED, tls=True)),
+    'slow': (PLAIN_PORT, dict(retained=RETAINED, connack_delay=SLOW_CONNACK_SECS)),
+    'blackhole': (PLAIN_PORT, dict(black_hole=True)),
+    'firehose': (PLAIN_PORT, dict(message_rate=FIREHOSE_RATE)),
+}
+FIRST_SUBNET = 20  # 127.0.20.0/24 onwards, clear of anything bound to 127.0.0.x
+
+
+class BrokerFarm:
+    def __init__(self, per_variant=4, variants=None):
+        self.per_variant = per_variant
+        self.variants = list(variants or VARIANTS)
+        self.addresses = {}  # variant -> [address]
+        self.ports = f'{PLAIN_PORT},{TLS_PORT}'
+        self._loop = None
+        self._thread = None
+        self._servers = []
+
+    @property
+    def target(self):
+        """Target spec covering every address of the farm."""
+        return ','.join(f'{addrs[0]}-{addrs[-1].rsplit(".", 1)[1]}' for addrs in self.addresses.values())
+
+    def variant_of(self, ip):
+        for name, addrs in self.addresses.items():
+            if ip in addrs:
+                return name
+        return None
+
+    async def _start(self):
+        for name in self.variants:
+            subnet = FIRST_SUBNET + list(VARIANTS).index(name)
+            port, options = VARIANTS[name]
+            options = dict(options)
+            if options.pop('tls', False):
+                options['ssl_context'] = fake_broker.self_signed_context()
+            addrs = self.addresses[name] = [f'127.0.{subnet}.{i}' for i in range(1, self.per_variant + 1)]
+            self._servers += await fake_broker.start_brokers(addrs, port, **options)
+
+    def start(self):
+        """Serve every variant from an event loop on a daemon thread; returns self once listening."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='broker-farm', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        async def close():
+            for server in self._servers:
+                server.close()
+            # Connections the servers handed out (black holes, streams) are closed with them
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a farm of stand-in MQTT brokers until Ctrl+C.')
+    parser.add_argument('--per-variant', type=int, default=4)
+    parser.add_argument('--variant', action='append', choices=list(VARIANTS), help='default: all')
+    args = parser.parse_args()
+
+    farm = BrokerFarm(args.per_variant, args.variant).start()
+    for name, addrs in farm.addresses.items():
+        print(f"{name:<10} {addrs[0]} - {addrs[-1]}  port {VARIANTS[name][0]}")
+    print(f"target: {farm.target}  ports: {farm.ports}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        farm.stop()
+
+
+if __name__ == '__main__':
+    main()
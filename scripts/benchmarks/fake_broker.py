@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Minimal in-process stand-in MQTT broker for benchmarks.
+Speaks just enough MQTT 3.1.1 for the scanner: CONNECT/CONNACK,
+SUBSCRIBE/SUBACK, PINGREQ/PINGRESP and DISCONNECT.
+
+Behaviour variants (see start_brokers): fixed CONNACK code, required
+credentials, delayed CONNACK, black hole (accepts TCP, never answers) and
+a steady stream of PUBLISHes after SUBSCRIBE. Like a real broker, a CONNECT
+with a client id that is already connected drops the older session.
+"""
+import asyncio
+import os
+import ssl
+from collections import Counter
+
+CERT_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'mqtt-brokers', 'secure', 'certs')
+
+# (address, port) -> number of TCP connections accepted
+connection_counts = Counter()
+
+
+def self_signed_context():
+    """Server-side TLS context using the repo's self-signed test broker certificate."""
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(os.path.join(CERT_DIR, 'server.crt'), os.path.join(CERT_DIR, 'server.key'))
+    return ctx
+
+
+async def _read_packet(reader):
+    header = await reader.readexactly(1)
+    multiplier, length = 1, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b''
+    return header[0] >> 4, body
+
+
+def _publish_packet(topic, payload, retain=True):
+    topic_bytes = topic.encode('utf-8')
+    body = len(topic_bytes).to_bytes(2, 'big') + topic_bytes + payload
+    length, encoded = len(body), bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            break
+    return bytes([0x31 if retain else 0x30]) + bytes(encoded) + body
+
+
+def _connect_fields(body):
+    """(client_id, username, password) from a CONNECT body; None for fields that are absent."""
+    pos = 2 + int.from_bytes(body[:2], 'big')  # Protocol name
+    flags = body[pos + 1]
+    pos += 4  # Level, flags, keepalive
+    fields = []
+    while pos + 2 <= len(body):
+        length = int.from_bytes(body[pos:pos + 2], 'big')
+        fields.append(body[pos + 2:pos + 2 + length].decode('utf-8', errors='replace'))
+        pos += 2 + length
+    client_id = fields.pop(0)
+    if flags & 0x04:
+        fields = fields[2:]  # Will topic and message
+    username = fields.pop(0) if flags & 0x80 and fields else None
+    password = fields.pop(0) if flags & 0x40 and fields else None
+    return client_id, username, password
+
+
+async def _publish_stream(writer, rate):
+    """Non-retained PUBLISHes at about `rate` messages/s until the client goes away."""
+    interval, seq = 1.0 / rate, 0
+    batch = max(1, int(rate / 100))  # Write in ~10 ms batches
+    while not writer.is_closing():
+        for _ in range(batch):
+            writer.write(_publish_packet(f'stream/{seq % 50}', str(seq).encode(), retain=False))
+            seq += 1
+        await writer.drain()
+        await asyncio.sleep(interval * batch)
+
+
+async def _handle_client(reader, writer, sessions, connack_rc=0, retained=None, credentials=None,
+                         connack_delay=0, black_hole=False, message_rate=0):
+    stream = client_id = None
+    try:
+        if black_hole:
+            await reader.read()  # Hold the connection open without a word until the client gives up
+            return
+        while True:
+            ptype, body = await _read_packet(reader)
+            if ptype == 1:  # CONNECT
+                rc = connack_rc
+                try:
+                    client_id, *login = _connect_fields(body)
+                except IndexError:
+                    break  # Not a CONNECT after all (e.g. a TLS ClientHello on the plaintext port)
+                if credentials is not None and tuple(login) != tuple(credentials):
+                    rc = 5  # Not authorized
+                if not rc:
+                    # Session takeover: the newest connection with an id wins
+                    previous = sessions.get(client_id)
+                    if previous is not None:
+                        previous.close()
+                    sessions[client_id] = writer
+                if connack_delay:
+                    await asyncio.sleep(connack_delay)
+                writer.write(bytes([0x20, 0x02, 0x00, rc]))
+                if rc:
+                    await writer.drain()
+                    break
+            elif ptype == 8:  # SUBSCRIBE -> grant QoS 0 for every filter
+                packet_id = body[:2]
+                pos, granted = 2, 0
+                while pos < len(body):
+                    topic_len = int.from_bytes(body[pos:pos + 2], 'big')
+                    pos += 2 + topic_len + 1
+                    granted += 1
+                payload = packet_id + b'\x00' * granted
+                writer.write(bytes([0x90, len(payload)]) + payload)
+                for topic, message in (retained or {}).items():
+                    writer.write(_publish_packet(topic, message))
+                if message_rate and stream is None:
+                    stream = asyncio.ensure_future(_publish_stream(writer, message_rate))
+            elif ptype == 12:  # PINGREQ
+                writer.write(b'\xd0\x00')
+            elif ptype == 14:  # DISCONNECT
+                break
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        if stream is not None:
+            stream.cancel()
+        if client_id is not None and sessions.get(client_id) is writer:
+            del sessions[client_id]
+        writer.close()
+
+
+async def start_brokers(addresses, port, connack_rc=0, retained=None, ssl_context=None, credentials=None,
+                        connack_delay=0, black_hole=False, message_rate=0):
+    """
+    Start one stand-in broker per address on `port`; returns the server objects.
+    connack_rc: CONNACK return code to answer with (5 = not authorized).
+    retained: {topic: payload bytes} delivered as retained messages after SUBSCRIBE.
+    ssl_context: serve TLS with this context (see self_signed_context()).
+    credentials: (username, password) required to connect; anything else gets rc 5.
+    connack_delay: seconds to wait before answering CONNECT.
+    black_hole: accept connections (and TLS handshakes) but never answer.
+    message_rate: after SUBSCRIBE, publish this many messages/s until disconnected.
+    """
+    options = dict(connack_rc=connack_rc, retained=retained, credentials=credentials,
+                   connack_delay=connack_delay, black_hole=black_hole, message_rate=message_rate)
+
+    def make_handler(addr):
+        sessions = {}  # client id -> writer of the connected session
+
+        async def handler(reader, writer):
+            connection_counts[(addr, port)] += 1
+            await _handle_client(reader, writer, sessions, **options)
+        return handler
+
+    servers = []
+    for addr in addresses:
+        servers.append(await asyncio.start_server(make_handler(addr), addr, port, ssl=ssl_context))
+    return servers
+
+
+if __name__ == '__main__':
+    async def main():
+        servers = await start_brokers(['127.0.0.1'], 18830)
+        print("Stand-in broker listening on 127.0.0.1:18830 (Ctrl+C to stop)")
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass